@@ -26,11 +26,14 @@ import os
 import logging
 import sys
 import timeit
+from array import array
 
 if __name__ == '__main__':
     import length_stats_GUI
+    import length_engine
 else:
     from . import length_stats_GUI
+    from . import length_engine
 
 SCALE = 1000000.0
 
@@ -46,6 +49,85 @@ else:
     BUILD_VERSION = "Unknown"
 
 
+class NetTable():
+    """
+    rows of the net list, shown through a sort permutation. Each row is
+    (net name, length, via length, electrical length, netclass, groups, deviation, layer lengths ...)
+    """
+    def __init__(self, rows):
+        self.rows = list(rows)
+        # net name -> index in rows
+        self.row_index = dict((row[0], index) for index, row in enumerate(self.rows))
+        # position in the list -> index in rows
+        self.order = array('l', range(len(self.rows)))
+
+    def __len__(self):
+        return len(self.order)
+
+    def get_net(self, position):
+        return self.rows[self.order[position]][0]
+
+    def get_text(self, position, column):
+        value = self.rows[self.order[position]][column]
+        if isinstance(value, float):
+            return "%.2f" % value
+        return value
+
+    def set_row(self, row):
+        self.rows[self.row_index[row[0]]] = row
+
+    def sort(self, column, reverse):
+        """ stable sort, nets with equal values keep their current order """
+        rows = self.rows
+
+        # nets without deviation (not in any group) have an empty string, keep them together
+        def sort_key(index):
+            value = rows[index][column]
+            return not isinstance(value, float), value
+
+        self.order = array('l', sorted(self.order, key=sort_key, reverse=reverse))
+
+    def delete(self, positions):
+        """ delete rows at the given positions, returns names of deleted nets """
+        deleted = set(self.order[position] for position in positions)
+        deleted_nets = [self.rows[index][0] for index in sorted(deleted)]
+
+        # old index in rows -> new index in rows
+        new_index = {}
+        rows = []
+        for index, row in enumerate(self.rows):
+            if index not in deleted:
+                new_index[index] = len(rows)
+                rows.append(row)
+        self.rows = rows
+        self.row_index = dict((row[0], index) for index, row in enumerate(self.rows))
+        self.order = array('l', [new_index[index] for index in self.order if index in new_index])
+        return deleted_nets
+
+
+class NetListCtrl(wx.ListCtrl):
+    """ virtual list control showing the net table, only visible rows are painted """
+    def __init__(self, parent, table, is_violation):
+        wx.ListCtrl.__init__(self, parent, wx.ID_ANY, style=wx.LC_REPORT | wx.LC_VIRTUAL)
+        self.table = table
+        self.is_violation = is_violation
+        # wxPython 4 renamed ListItemAttr to ItemAttr
+        if hasattr(wx, 'ItemAttr'):
+            self.violation_attr = wx.ItemAttr()
+        else:
+            self.violation_attr = wx.ListItemAttr()
+        self.violation_attr.SetTextColour(wx.RED)
+
+    def OnGetItemText(self, item, column):
+        return self.table.get_text(item, column)
+
+    def OnGetItemAttr(self, item):
+        # nets out of tolerance are shown in red
+        if self.is_violation(self.table.get_net(item)):
+            return self.violation_attr
+        return None
+
+
 class LengthStatsDialog(length_stats_GUI.LengthStatsGUI):
     # hack for new wxFormBuilder generating code incompatible with old wxPython
     # noinspection PyMethodOverriding
@@ -57,13 +139,12 @@ class LengthStatsDialog(length_stats_GUI.LengthStatsGUI):
             # wxPython 4
             super(LengthStatsDialog, self).SetSizeHints(sz1, sz2)
 
-    def __init__(self,  parent, board, nets, logger):
+    def __init__(self,  parent, board, nets, logger, match_groups=()):
         length_stats_GUI.LengthStatsGUI.__init__(self, parent)
 
-        self.net_list.InsertColumn(0, 'Net', width=100) 
-        self.net_list.InsertColumn(1, 'Length')
-
-        self.net_data = []
+        # copper layers shown in the breakdown
+        self.layers = [layer for layer in range(length_engine.COPPER_LAYERS) if board.IsLayerEnabled(layer)]
+        self.layer_depths = length_engine.get_layer_depths(board)
 
         nets.sort()
         #remove empty nets
@@ -71,29 +152,75 @@ class LengthStatsDialog(length_stats_GUI.LengthStatsGUI):
             if not net:
                 nets.remove(net)
 
-        for net in nets:
-            index_net = nets.index(net)
-            index = self.net_list.InsertStringItem(index_net, net)
-            self.net_list.SetStringItem(index, 1, "0.0")
-            self.net_data.append( (net, 0.0) )
-
         self.board = board
-        self.nets = nets
         self.logger = logger
 
+        # netcodes and netclasses do not change while the dialog is open
+        self.netcodes = dict((net, board.GetNetcodeFromNetname(net)) for net in nets)
+        self.net_names = dict((netcode, net) for net, netcode in self.netcodes.items())
+        self.netclasses = dict((netcode, board.FindNet(netcode).GetClassName())
+                               for netcode in self.netcodes.values())
+        self.length_cache = length_engine.NetLengthCache()
+
+        # netcodes of highlighted nets
+        self.highlighted = set()
+
+        # length matching groups of (name, net names, target, tolerance)
+        self.match_groups = length_engine.MatchGroups()
+        for name, group_nets, target, tolerance in match_groups:
+            group = length_engine.MatchGroup(name, [self.netcodes[net] for net in group_nets if net in self.netcodes],
+                                             target, tolerance)
+            self.match_groups.add_group(group)
+
+        rows = [(net, 0.0, 0.0, 0.0, self.netclasses[self.netcodes[net]], self.get_group_names(net), "")
+                + (0.0,) * len(self.layers) for net in nets]
+        self.table = NetTable(rows)
+
+        # replace generated list control with a virtual one showing the net table
+        net_list = NetListCtrl(self.net_list.GetParent(), self.table, self.is_violation)
+        self.net_list.GetContainingSizer().Replace(self.net_list, net_list)
+        self.net_list.Destroy()
+        self.net_list = net_list
+        self.net_list.Bind(wx.EVT_LIST_COL_CLICK, self.sort_items)
+        self.net_list.Bind(wx.EVT_LIST_ITEM_DESELECTED, self.item_selected)
+        self.net_list.Bind(wx.EVT_LIST_ITEM_SELECTED, self.item_selected)
+        self.net_list.Bind(wx.EVT_LIST_KEY_DOWN, self.delete_items)
+        self.m_panel1.Layout()
+        # selection events are ignored while the selection is set by the dialog
+        self.updating_selection = False
+
+        self.net_list.InsertColumn(0, 'Net', width=100) 
+        self.net_list.InsertColumn(1, 'Length')
+        self.net_list.InsertColumn(2, 'Via length')
+        self.net_list.InsertColumn(3, 'Electrical length')
+        self.net_list.InsertColumn(4, 'Net class')
+        self.net_list.InsertColumn(5, 'Group')
+        self.net_list.InsertColumn(6, 'Deviation')
+        for column, layer in enumerate(self.layers, 7):
+            self.net_list.InsertColumn(column, board.GetLayerName(layer))
+        self.net_list.SetItemCount(len(self.table))
+
         self.column_sorted = 0
-        self.column_0_dir = 0
-        self.column_1_dir = 0
+        # column -> sort direction
+        self.column_dir = {}
 
         self.timer = wx.Timer(self, 1)
         self.refresh_time = 0.1
 
+        # lengths are computed in a worker thread, results are passed back to UI thread
+        self.snapshot_time = 0.0
+        self.refresh_pending = False
+        self.closing = False
+        self.worker = length_engine.LengthWorker(lambda sweep, compute_time:
+                                                 wx.CallAfter(self.on_lengths, sweep, compute_time))
+        self.worker.start()
+
         self.sort_items(None)
 
         self.Bind(wx.EVT_TIMER, self.on_update, self.timer)
 
         self.logger.info("Length stats gui initialized")
-        self.logger.info("Nets for stats are;\n" + repr(self.nets))
+        self.logger.info("Nets for stats are;\n" + repr(nets))
 
     def cont_refresh_toggle(self, event):
         if self.chk_cont.IsChecked():
@@ -111,12 +238,13 @@ class LengthStatsDialog(length_stats_GUI.LengthStatsGUI):
 		
 
     def on_btn_ok(self, event):
-        # remove higlightning from tracks
-        tracks = self.board.GetTracks()
-        for track in tracks:
-            track.ClearBrightened()
+        # stop refreshing
+        self.closing = True
+        self.timer.Stop()
+        self.worker.stop()
 
-        pcbnew.Refresh()
+        # remove higlightning from tracks
+        self.set_highlight(set())
 
         self.logger.info("Closing GUI")
         logging.shutdown()
@@ -128,79 +256,157 @@ class LengthStatsDialog(length_stats_GUI.LengthStatsGUI):
         self.refresh()
         event.Skip()
 
+    def get_group_names(self, net):
+        return ", ".join(group.name for group in self.match_groups.net_groups.get(self.netcodes[net], []))
+
+    def get_electrical_length(self, netcode):
+        net_length = self.length_cache.get_net_length(netcode)
+        return net_length.length + net_length.via_length
+
+    def get_row(self, net, net_length):
+        """
+        net name, length, via length, electrical length, netclass, length matching groups,
+        deviation from the group target length and length on each layer
+        """
+        deviation = self.match_groups.get_deviation(self.netcodes[net])
+        if deviation is None:
+            deviation = ""
+        return ((net, net_length.length, net_length.via_length, net_length.length + net_length.via_length,
+                 self.netclasses[self.netcodes[net]], self.get_group_names(net), deviation)
+                + tuple(net_length.layer_lengths[layer] for layer in self.layers))
+
+    def is_violation(self, net):
+        return self.match_groups.is_violation(self.netcodes[net])
+
+    def get_selected_positions(self):
+        positions = []
+        position = self.net_list.GetFirstSelected()
+        while position != -1:
+            positions.append(position)
+            position = self.net_list.GetNextSelected(position)
+        return positions
+
     def refresh(self):
+        # if the previous refresh is still being computed, refresh again once it is done
+        if self.worker.is_busy():
+            self.refresh_pending = True
+            return
+
         self.logger.info("Refreshing net lengths")
         start_time = timeit.default_timer()
 
-        # go through all the nets
-        for net in self.nets:
-            # get tracks on net
-            netcode = self.board.GetNetcodeFromNetname(net)
-            tracks_on_net = self.board.TracksInNet(netcode)
+        # copy track geometry on the UI thread, as pcbnew objects can not be accessed from the worker
+        netcodes = list(self.netcodes.values())
+        tracks_by_net = {}
+        snapshot = length_engine.get_tracks_snapshot(self.board.GetTracks(), netcodes, tracks_by_net)
+        # tracks added since last refresh have to be highlighted too. Track references are not kept
+        # after the refresh, as tracks can be deleted in the meantime
+        for netcode in self.highlighted:
+            for track in tracks_by_net.get(netcode, []):
+                track.SetBrightened()
+        self.snapshot_time = timeit.default_timer() - start_time
+
+        # nets whose tracks did not change keep their cached lengths
+        self.worker.request(snapshot, netcodes, self.board.GetNetCount(), self.layer_depths,
+                            self.length_cache.get_known())
 
-            # sum their length
-            length = 0
-            for t in tracks_on_net:
-                length = length + t.GetLength()/SCALE
+    def on_lengths(self, sweep, compute_time):
+        # dialog was closed while lengths were computed
+        if self.closing:
+            return
+        start_time = timeit.default_timer()
 
-            index_net = self.nets.index(net)
-            self.net_data[index_net] = (net, length)
-            self.net_list.SetStringItem(index_net, 1, "%.2f" % length)
+        # update only the nets which have changed since last refresh
+        changed = set(self.length_cache.update(sweep, list(self.netcodes.values())))
+        # deviation of all the nets in the evaluated groups could change
+        evaluated = self.match_groups.update(changed, self.get_electrical_length)
+        updated = changed | evaluated
+        for netcode in updated:
+            net = self.net_names[netcode]
+            self.table.set_row(self.get_row(net, self.length_cache.get_net_length(netcode)))
+        # only visible rows are repainted
+        if updated:
+            self.net_list.Refresh()
+        self.logger.info("Lengths changed on " + str(len(changed)) + " nets")
+        if changed:
+            net_lengths = dict((netcode, self.length_cache.get_net_length(netcode))
+                               for netcode in self.netcodes.values())
+            self.logger.info("Netclass lengths (length, via length):\n"
+                             + repr(length_engine.get_netclass_lengths(net_lengths, self.netclasses)))
 
         stop_time = timeit.default_timer()
-        delta_time = stop_time - start_time
+        ui_time = self.snapshot_time + stop_time - start_time
+        delta_time = compute_time + ui_time
         if delta_time > 0.05:
             self.refresh_time = delta_time
         else:
             self.refresh_time = 0.05
-        self.lbl_refresh_time.SetLabelText(u"Refresh time: %.2f s" % delta_time)
+        label = u"Refresh time: %.2f s (compute %.2f s, UI %.2f s)" % (delta_time, compute_time, ui_time)
+        if self.match_groups.groups:
+            label = label + u", %d nets out of tolerance" % len(self.match_groups.get_violations())
+        self.lbl_refresh_time.SetLabelText(label)
+
+        if self.refresh_pending:
+            self.refresh_pending = False
+            self.refresh()
 
     def delete_items(self, event):
         self.logger.info("Deleting nets")
         # test if delete key was pressed
         if event.GetKeyCode() == wx.WXK_DELETE:
-            # find selected items
-            selected_items = []
-            for index in range(self.net_list.GetItemCount()):
-                if self.net_list.IsSelected(index):
-                    selected_items.append( (index, self.nets[index]))
-
-            selected_items.sort(key=lambda tup: tup[0], reverse=True)
-
-            # remove selected items from the back
-            for item in selected_items:
-                self.net_list.DeleteItem(item[0])
-                del self.nets[item[0]]
-                del self.net_data[item[0]]
+            positions = self.get_selected_positions()
+
+            # clear the selection, as the rows will move
+            self.updating_selection = True
+            for position in positions:
+                self.net_list.Select(position, 0)
+            self.updating_selection = False
+
+            deleted_netcodes = set()
+            for net in self.table.delete(positions):
+                netcode = self.netcodes.pop(net)
+                del self.net_names[netcode]
+                self.length_cache.forget(netcode)
+                self.match_groups.remove_net(netcode)
+                deleted_netcodes.add(netcode)
+            self.set_highlight(self.highlighted - deleted_netcodes)
+
+            self.net_list.SetItemCount(len(self.table))
+            self.net_list.Refresh()
 
         event.Skip()
 
-    def item_selected(self, event):
-        tracks = self.board.GetTracks()
-        # get all tracks which we are interested in
-        list_tracks = []
-        for track in tracks:
-            if track.GetNetname() in self.nets:
-                list_tracks.append(track)
-
-        # remove highlight on all tracks
-        self.logger.info("Removing highlights for nets:\n" + repr(self.nets))
-        for track in list_tracks:
-            track.ClearBrightened()
-
-        pcbnew.Refresh()
-        # find selected tracks
-        selected_items = []
-        for index in range(self.net_list.GetItemCount()):
-            if self.net_list.IsSelected(index):
-                selected_items.append(self.nets[index])        
-
-        self.logger.info("Adding highlights for nets:\n" + repr(selected_items))
-        for track in list_tracks:
-            if track.GetNetname() in selected_items:
+    def set_highlight(self, netcodes):
+        """
+        highlight tracks of the given nets, touching only the nets which change their highlight
+        tracks are looked up in a single pass over the board each time, so deleted tracks are never touched
+        """
+        removed = self.highlighted - netcodes
+        added = netcodes - self.highlighted
+        if not removed and not added:
+            return
+
+        changed = removed | added
+        for track in self.board.GetTracks():
+            netcode = track.GetNetCode()
+            if netcode not in changed:
+                continue
+            if netcode in added:
                 track.SetBrightened()
-
+            else:
+                track.ClearBrightened()
+        self.highlighted = set(netcodes)
         pcbnew.Refresh()
+
+    def item_selected(self, event):
+        if self.updating_selection:
+            event.Skip()
+            return
+        # find selected nets
+        selected_items = [self.table.get_net(position) for position in self.get_selected_positions()]
+
+        self.logger.info("Highlighting nets:\n" + repr(selected_items))
+        self.set_highlight(set(self.netcodes[net] for net in selected_items))
         event.Skip()
 
     def sort_items(self, event):
@@ -211,52 +417,40 @@ class LengthStatsDialog(length_stats_GUI.LengthStatsGUI):
         else:
             self.column_sorted = 0
 
-        # sort column 0
-        if self.column_sorted == 0:
-            # ascending
-            if self.column_0_dir == 0:
-                self.column_0_dir = 1
-                self.net_data.sort(key=lambda tup: tup[0], reverse=True)
-            # descending
-            else:
-                self.column_0_dir = 0
-                self.net_data.sort(key=lambda tup: tup[0], reverse=False)
-        # sort column 1
-        else:
-            # ascending
-            if self.column_1_dir == 0:
-                self.column_1_dir = 1
-                self.net_data.sort(key=lambda tup: tup[1], reverse=True)
-            # descending
-            else:
-                self.column_1_dir = 0
-                self.net_data.sort(key=lambda tup: tup[1], reverse=False)
-                # sort
-
-        self.nets = [x[0] for x in self.net_data]
+        column = self.column_sorted
 
-        # clear and repopulate the list ctrl
-        self.net_list.DeleteAllItems()
-        for net in self.net_data:
-            index_net = self.net_data.index(net)
-            index = self.net_list.InsertStringItem(index_net, net[0])
-            self.net_list.SetStringItem(index, 1, "%.2f" % net[1])
+        # ascending
+        if self.column_dir.get(column, 0) == 0:
+            self.column_dir[column] = 1
+            self.table.sort(column, reverse=True)
+        # descending
+        else:
+            self.column_dir[column] = 0
+            self.table.sort(column, reverse=False)
+
+        # keep highlighted nets selected at their new positions
+        self.updating_selection = True
+        for position in range(len(self.table)):
+            selected = self.netcodes[self.table.get_net(position)] in self.highlighted
+            if selected != self.net_list.IsSelected(position):
+                self.net_list.Select(position, selected)
+        self.updating_selection = False
+        self.net_list.Refresh()
 
         if event:
             event.Skip()
 
-
     def copy_items(self, event):
         self.logger.info("Copying List")
         selectedItems = []
         row = []
-        for j in xrange(self.net_list.GetColumnCount()):
+        for j in range(self.net_list.GetColumnCount()):
             row.append(self.net_list.GetColumn(j).GetText())
         selectedItems.append("\t".join(row))
-        for i in xrange(self.net_list.GetItemCount()):
+        for i in range(len(self.table)):
             row = []
-            for j in xrange(self.net_list.GetColumnCount()):
-                row.append(self.net_list.GetItemText(i,j))
+            for j in range(self.net_list.GetColumnCount()):
+                row.append(self.table.get_text(i, j))
             selectedItems.append("\t".join(row))
 
         clipdata = wx.TextDataObject()
@@ -327,7 +521,27 @@ class LengthStats(pcbnew.ActionPlugin):
             pads = mod.Pads()
             nets.update([pad.GetNetname() for pad in pads if pad.IsSelected()])
 
-        dlg = LengthStatsDialog(_pcbnew_frame, board, list(nets), logger)
+        # length matching groups are defined in <board name>_length_groups.json
+        match_groups = []
+        groups_filename = os.path.splitext(board.GetFileName())[0] + "_length_groups.json"
+        if os.path.isfile(groups_filename):
+            net_names = [board.FindNet(netcode).GetNetname() for netcode in range(1, board.GetNetCount())]
+            try:
+                match_groups = length_engine.load_match_groups(groups_filename, net_names)
+            except LookupError as error:
+                caption = 'Length stats'
+                message = str(error)
+                dlg = wx.MessageDialog(_pcbnew_frame, message, caption, wx.OK | wx.ICON_ERROR)
+                dlg.ShowModal()
+                dlg.Destroy()
+                logger.info(message)
+                return
+            logger.info("Loaded " + str(len(match_groups)) + " length matching groups from " + groups_filename)
+            # nets of all the groups are shown
+            for _, group_nets, _, _ in match_groups:
+                nets.update(group_nets)
+
+        dlg = LengthStatsDialog(_pcbnew_frame, board, list(nets), logger, match_groups)
         dlg.Show()
 
 
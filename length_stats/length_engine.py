@@ -0,0 +1,506 @@
+# -*- coding: utf-8 -*-
+#  length_engine.py
+#
+# Copyright (C) 2018 Mitja Nemec
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""
+Track length computation used by the length stats dialog. It does not depend on wx.
+"""
+from __future__ import absolute_import, division, print_function
+import sys
+import json
+import random
+import logging
+import fnmatch
+import threading
+import timeit
+from array import array
+from collections import namedtuple, defaultdict
+
+logger = logging.getLogger(__name__)
+
+SCALE = 1000000.0
+
+# F_Cu = 0, In1_Cu ... In30_Cu = 1 ... 30, B_Cu = 31
+COPPER_LAYERS = 32
+
+# lengths of a single net in mm, layer lengths are indexed by copper layer
+NetLength = namedtuple('NetLength', ['length', 'via_length', 'layer_lengths'])
+
+
+def get_layer_depths(board):
+    """
+    depth of each copper layer from the top of the board in nm, from the board stackup when pcbnew has it
+    and from evenly spaced copper layers otherwise
+    """
+    stackup = get_board_stackup(board)
+    if stackup:
+        layer_depths = make_stackup_layer_depths(stackup)
+        if layer_depths is not None:
+            return layer_depths
+    logger.info("Board stackup is not available, via lengths assume evenly spaced copper layers")
+    return make_layer_depths(board.GetDesignSettings().GetBoardThickness(), board.GetCopperLayerCount())
+
+
+def get_board_stackup(board):
+    """
+    (copper layer, thickness in nm) of the stackup items from top to bottom, layer is None for dielectrics.
+    Returns None when pcbnew has no stackup (V5.1)
+    """
+    design_settings = board.GetDesignSettings()
+    # V5.99 forward compatibility
+    if not hasattr(design_settings, 'GetStackupDescriptor'):
+        return None
+    stackup = []
+    for item in design_settings.GetStackupDescriptor().GetList():
+        layer = item.GetBrdLayerId()
+        if 0 <= layer < COPPER_LAYERS:
+            stackup.append((layer, item.GetThickness()))
+        # dielectrics are not on any board layer and can have multiple sublayers
+        elif layer < 0:
+            stackup.append((None, sum(item.GetThickness(index) for index in range(item.GetSublayersCount()))))
+    return stackup
+
+
+def make_stackup_layer_depths(stackup):
+    """
+    depth of each copper layer in nm, measured from the middle of the top copper to the middle of each copper layer.
+    Stackup is a list of (copper layer, thickness in nm) from top to bottom, layer is None for dielectrics.
+    Returns None when there is no copper in the stackup
+    """
+    layer_depths = array('d', [0.0]) * COPPER_LAYERS
+    top = None
+    depth = 0.0
+    for layer, thickness in stackup:
+        if layer is not None:
+            middle = depth + thickness / 2
+            if top is None:
+                top = middle
+            layer_depths[layer] = middle - top
+        depth = depth + thickness
+    if top is None:
+        return None
+    return layer_depths
+
+
+def make_layer_depths(thickness, nr_layers):
+    """
+    depth of each copper layer from the top of the board in nm, for board thickness in nm.
+    Copper layers are assumed to be evenly spaced through the board thickness
+    """
+    spacing = thickness / max(nr_layers - 1, 1)
+    layer_depths = array('d', [0.0]) * COPPER_LAYERS
+    for layer in range(1, min(nr_layers - 1, COPPER_LAYERS - 1)):
+        layer_depths[layer] = layer * spacing
+    layer_depths[COPPER_LAYERS - 1] = thickness
+    return layer_depths
+
+
+def get_tracks_snapshot(tracks, netcodes, tracks_by_net=None):
+    """
+    plain python copy of the tracks on the watched nets, which can be used outside of the UI thread
+    each track is (netcode, length, start x, start y, end x, end y, layer, top layer, bottom layer)
+    for vias top and bottom layer are the layers the via spans, for tracks both are the track layer
+    if tracks_by_net dict is given, it is filled with netcode -> list of tracks in the same pass
+    """
+    watched = set(netcodes)
+    snapshot = []
+    for track in tracks:
+        netcode = track.GetNetCode()
+        if netcode in watched:
+            if tracks_by_net is not None:
+                tracks_by_net.setdefault(netcode, []).append(track)
+            start = track.GetStart()
+            end = track.GetEnd()
+            layer = track.GetLayer()
+            if track.GetClass() == "VIA":
+                via = track.Cast()
+                top_layer = via.TopLayer()
+                bottom_layer = via.BottomLayer()
+            else:
+                top_layer = bottom_layer = layer
+            snapshot.append((netcode, track.GetLength(), start.x, start.y, end.x, end.y,
+                             layer, top_layer, bottom_layer))
+    return snapshot
+
+
+class TrackSweep():
+    """
+    lengths in mm, number of tracks and checksum of track endpoints of the watched nets,
+    computed in a pass over the tracks snapshot. Arrays are indexed by netcode,
+    layer lengths by netcode * COPPER_LAYERS + layer.
+    Via barrel length is counted only when layer depths are given.
+    Known is netcode -> (signature, NetLength) of the last refresh, lengths of the nets whose
+    signature did not change since are taken from it instead of being summed again
+    """
+    def __init__(self, snapshot, netcodes, net_count, layer_depths=None, known=None):
+        self.lengths = array('d', [0.0]) * net_count
+        self.via_lengths = array('d', [0.0]) * net_count
+        self.layer_lengths = array('d', [0.0]) * (net_count * COPPER_LAYERS)
+        self.counts = array('l', [0]) * net_count
+        self.checksums = [0] * net_count
+
+        watched = [False] * net_count
+        for netcode in netcodes:
+            watched[netcode] = True
+
+        counts = self.counts
+        checksums = self.checksums
+        for netcode, _, start_x, start_y, end_x, end_y, layer, top_layer, bottom_layer in snapshot:
+            if netcode >= net_count or not watched[netcode]:
+                continue
+            counts[netcode] = counts[netcode] + 1
+            checksums[netcode] = checksums[netcode] + hash((start_x, start_y, end_x, end_y,
+                                                            layer, top_layer, bottom_layer))
+
+        # only the nets which changed are summed
+        self.unchanged = {}
+        if known:
+            for netcode in netcodes:
+                cached = known.get(netcode)
+                if cached is not None and cached[0] == self.get_signature(netcode):
+                    self.unchanged[netcode] = cached[1]
+                    watched[netcode] = False
+
+        lengths = self.lengths
+        via_lengths = self.via_lengths
+        layer_lengths = self.layer_lengths
+        if len(self.unchanged) < len(netcodes):
+            for netcode, length, start_x, start_y, end_x, end_y, layer, top_layer, bottom_layer in snapshot:
+                if netcode >= net_count or not watched[netcode]:
+                    continue
+                if top_layer == bottom_layer:
+                    lengths[netcode] = lengths[netcode] + length
+                    index = netcode * COPPER_LAYERS + layer
+                    layer_lengths[index] = layer_lengths[index] + length
+                elif layer_depths is not None:
+                    via_lengths[netcode] = (via_lengths[netcode]
+                                            + abs(layer_depths[bottom_layer] - layer_depths[top_layer]))
+
+        for netcode in netcodes:
+            net_length = self.unchanged.get(netcode)
+            if net_length is not None:
+                lengths[netcode] = net_length.length
+                via_lengths[netcode] = net_length.via_length
+                index = netcode * COPPER_LAYERS
+                layer_lengths[index:index + COPPER_LAYERS] = array('d', net_length.layer_lengths)
+                continue
+            lengths[netcode] = lengths[netcode] / SCALE
+            via_lengths[netcode] = via_lengths[netcode] / SCALE
+            for index in range(netcode * COPPER_LAYERS, (netcode + 1) * COPPER_LAYERS):
+                if layer_lengths[index]:
+                    layer_lengths[index] = layer_lengths[index] / SCALE
+
+    def get_signature(self, netcode):
+        """ changes when any track of the net is added, removed or moved """
+        return self.counts[netcode], self.checksums[netcode]
+
+    def get_net_length(self, netcode):
+        index = netcode * COPPER_LAYERS
+        return NetLength(self.lengths[netcode], self.via_lengths[netcode],
+                         tuple(self.layer_lengths[index:index + COPPER_LAYERS]))
+
+
+class NetLengthCache():
+    """ length of each net, with the signature of the net tracks it was computed for """
+    def __init__(self):
+        # netcode -> (signature, NetLength)
+        self.cache = {}
+
+    def update(self, sweep, netcodes):
+        """ store lengths from the sweep, returns netcodes of the nets which changed since the last update """
+        changed = []
+        for netcode in netcodes:
+            signature = sweep.get_signature(netcode)
+            cached = self.cache.get(netcode)
+            if cached is None or cached[0] != signature:
+                self.cache[netcode] = (signature, sweep.get_net_length(netcode))
+                changed.append(netcode)
+        return changed
+
+    def get_net_length(self, netcode):
+        return self.cache[netcode][1]
+
+    def get_known(self):
+        """ copy of the cache, which the next sweep can use from the worker thread """
+        return dict(self.cache)
+
+    def forget(self, netcode):
+        self.cache.pop(netcode, None)
+
+
+def get_netclass_lengths(net_lengths, netclasses):
+    """
+    total track length and via length for each netclass
+    net_lengths is netcode -> NetLength, netclasses is netcode -> netclass name
+    """
+    netclass_lengths = {}
+    for netcode, net_length in net_lengths.items():
+        length, via_length = netclass_lengths.get(netclasses[netcode], (0.0, 0.0))
+        netclass_lengths[netclasses[netcode]] = (length + net_length.length, via_length + net_length.via_length)
+    return netclass_lengths
+
+
+def get_matching_nets(patterns, net_names):
+    """ net names which match any of the net names or fnmatch patterns """
+    return [net for net in net_names if any(fnmatch.fnmatchcase(net, pattern) for pattern in patterns)]
+
+
+def load_match_groups(filename, net_names):
+    """
+    read length matching groups from a json file:
+    [{"name": "DQ0-7", "nets": ["/DDR/DQ[0-7]"], "target": 25.4, "tolerance": 0.1}, ...]
+    nets can be net names or fnmatch patterns, without target the nets are matched to the longest net
+    returns a list of (name, net names, target, tolerance)
+    """
+    with open(filename, 'rb') as f:
+        try:
+            definitions = json.loads(f.read().decode('utf-8'))
+        except ValueError:
+            raise LookupError("Length matching groups file is not valid json: " + filename)
+
+    groups = []
+    for definition in definitions:
+        if "name" not in definition or "nets" not in definition:
+            raise LookupError("Each length matching group needs a \"name\" and \"nets\": " + repr(definition))
+        nets = get_matching_nets(definition["nets"], net_names)
+        if not nets:
+            logger.info("Length matching group " + definition["name"] + " does not match any net")
+        groups.append((definition["name"], nets, definition.get("target"), definition.get("tolerance", 0.0)))
+    return groups
+
+
+class MatchGroup():
+    """ nets which have to be matched to target length within tolerance, lengths are in mm """
+    def __init__(self, name, netcodes, target=None, tolerance=0.0):
+        self.name = name
+        self.netcodes = set(netcodes)
+        self.target = target
+        self.tolerance = tolerance
+        # netcode -> deviation from the target length
+        self.deviations = {}
+        self.violations = set()
+
+    def evaluate(self, get_length):
+        """ without explicit target length the nets are matched to the longest net """
+        if not self.netcodes:
+            self.deviations = {}
+            self.violations = set()
+            return
+        lengths = dict((netcode, get_length(netcode)) for netcode in self.netcodes)
+        if self.target is not None:
+            target = self.target
+        else:
+            target = max(lengths.values())
+        self.deviations = dict((netcode, length - target) for netcode, length in lengths.items())
+        self.violations = set(netcode for netcode, deviation in self.deviations.items()
+                              if abs(deviation) > self.tolerance)
+
+
+class MatchGroups():
+    """ all length matching groups, only the groups with changed nets are evaluated on update """
+    def __init__(self):
+        self.groups = []
+        # netcode -> groups the net belongs to
+        self.net_groups = defaultdict(list)
+        self.dirty = set()
+
+    def add_group(self, group):
+        self.groups.append(group)
+        for netcode in group.netcodes:
+            self.net_groups[netcode].append(group)
+        self.dirty.add(group)
+
+    def remove_net(self, netcode):
+        for group in self.net_groups.pop(netcode, []):
+            group.netcodes.discard(netcode)
+            self.dirty.add(group)
+
+    def update(self, changed, get_length):
+        """
+        evaluate the groups which contain any of the changed nets, get_length(netcode) returns net length
+        returns netcodes of all the nets in the evaluated groups
+        """
+        for netcode in changed:
+            self.dirty.update(self.net_groups.get(netcode, []))
+        evaluated = set()
+        for group in self.dirty:
+            group.evaluate(get_length)
+            evaluated.update(group.netcodes)
+            if group.violations:
+                logger.info("Length matching group " + group.name + " has "
+                            + str(len(group.violations)) + " nets out of tolerance")
+        self.dirty = set()
+        return evaluated
+
+    def get_deviation(self, netcode):
+        """ the largest deviation of the net in any of its groups, None if the net is not in any group """
+        deviations = [group.deviations[netcode] for group in self.net_groups.get(netcode, [])
+                      if netcode in group.deviations]
+        if not deviations:
+            return None
+        return max(deviations, key=abs)
+
+    def is_violation(self, netcode):
+        return any(netcode in group.violations for group in self.net_groups.get(netcode, []))
+
+    def get_violations(self):
+        return set().union(*[group.violations for group in self.groups])
+
+
+class LengthWorker(threading.Thread):
+    """
+    computes track sweeps outside of the UI thread and passes them to callback(sweep, compute_time)
+    only the latest requested snapshot is kept, so requests arriving during a slow sweep are coalesced
+    """
+    def __init__(self, callback):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.callback = callback
+        self.condition = threading.Condition()
+        self.pending = None
+        self.busy = False
+        self.running = True
+
+    def request(self, snapshot, netcodes, net_count, layer_depths=None, known=None):
+        with self.condition:
+            if self.pending is not None:
+                logger.info("Coalescing length refresh requests")
+            self.pending = (snapshot, netcodes, net_count, layer_depths, known)
+            self.condition.notify()
+
+    def is_busy(self):
+        with self.condition:
+            return self.busy or self.pending is not None
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.pending = None
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and self.pending is None:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                arguments = self.pending
+                self.pending = None
+                self.busy = True
+
+            start_time = timeit.default_timer()
+            sweep = TrackSweep(*arguments)
+            compute_time = timeit.default_timer() - start_time
+
+            with self.condition:
+                self.busy = False
+                if not self.running:
+                    return
+            self.callback(sweep, compute_time)
+
+
+def make_test_snapshot(nr_nets, nr_tracks, nr_vias):
+    """ synthetic snapshot of nr_nets nets on a 4 layer board, netcode 0 is left unconnected """
+    snapshot = []
+    layers = (0, 1, 2, 31)
+    for netcode in range(1, nr_nets + 1):
+        x = 0
+        for index in range(nr_tracks):
+            length = random.randint(100000, 5000000)
+            snapshot.append((netcode, length, x, netcode * 1000000, x + length, netcode * 1000000,
+                             layers[index % 4], layers[index % 4], layers[index % 4]))
+            x = x + length
+        for index in range(nr_vias):
+            snapshot.append((netcode, 0, index, netcode, index, netcode, 0, 0, 31))
+    return snapshot
+
+
+def main():
+    layer_depths = array('d', [0.0]) * COPPER_LAYERS
+    layer_depths[1] = 533333.3
+    layer_depths[2] = 1066666.7
+    layer_depths[31] = 1600000.0
+
+    nr_nets = 500
+    netcodes = list(range(1, nr_nets + 1))
+    snapshot = make_test_snapshot(nr_nets, 40, 4)
+    start_time = timeit.default_timer()
+    sweep = TrackSweep(snapshot, netcodes, nr_nets + 1, layer_depths)
+    print("%d nets, %d tracks swept in %.4f s" % (nr_nets, len(snapshot), timeit.default_timer() - start_time))
+
+    for netcode in (1, nr_nets):
+        tracks = [x for x in snapshot if x[0] == netcode]
+        net_length = sweep.get_net_length(netcode)
+        assert abs(net_length.length - sum(x[1] for x in tracks) / SCALE) < 1e-9
+        assert abs(net_length.length - sum(net_length.layer_lengths)) < 1e-9
+        assert abs(net_length.via_length - 4 * 1.6) < 1e-9
+
+    # 4 layer stackup with thin prepregs and a thick core
+    stackup = [(0, 35000), (None, 200000), (1, 35000), (None, 1060000), (2, 35000), (None, 200000), (31, 35000)]
+    stackup_depths = make_stackup_layer_depths(stackup)
+    assert [stackup_depths[layer] for layer in (0, 1, 2, 31)] == [0.0, 235000.0, 1330000.0, 1565000.0]
+    assert make_stackup_layer_depths([(None, 1600000)]) is None
+    sweep_stackup = TrackSweep(snapshot, netcodes, nr_nets + 1, stackup_depths)
+    assert abs(sweep_stackup.get_net_length(1).via_length - 4 * 1.565) < 1e-9
+
+    cache = NetLengthCache()
+    assert len(cache.update(sweep, netcodes)) == nr_nets
+    snapshot[0] = snapshot[0][0:2] + (1,) + snapshot[0][3:]
+    sweep = TrackSweep(snapshot, netcodes, nr_nets + 1, layer_depths)
+    # nets which did not change are not summed again
+    start_time = timeit.default_timer()
+    known_sweep = TrackSweep(snapshot, netcodes, nr_nets + 1, layer_depths, cache.get_known())
+    known_time = timeit.default_timer() - start_time
+    assert sorted(known_sweep.unchanged) == netcodes[1:]
+    assert all(known_sweep.get_net_length(x) == sweep.get_net_length(x) for x in netcodes)
+    assert known_sweep.lengths == sweep.lengths and known_sweep.layer_lengths == sweep.layer_lengths
+    print("1 changed net swept in %.4f s" % known_time)
+    assert cache.update(known_sweep, netcodes) == [1]
+
+    netclass_lengths = get_netclass_lengths(dict((x, cache.get_net_length(x)) for x in netcodes),
+                                            dict((x, "Default" if x % 2 else "DDR") for x in netcodes))
+    assert sorted(netclass_lengths.keys()) == ["DDR", "Default"]
+    print("netclass lengths: " + repr(netclass_lengths))
+
+    def get_length(netcode):
+        return cache.get_net_length(netcode).length
+
+    match_groups = MatchGroups()
+    for index in range(nr_nets // 10):
+        match_groups.add_group(MatchGroup("lane " + str(index), range(index * 10 + 1, index * 10 + 11),
+                                          tolerance=1000.0))
+    match_groups.add_group(MatchGroup("tight", [1, 2], target=get_length(2), tolerance=0.01))
+    assert len(match_groups.update([], get_length)) == nr_nets
+    assert match_groups.get_violations() == set([1])
+    assert abs(match_groups.groups[-1].deviations[2]) < 1e-9
+    # only the groups of the changed nets are evaluated
+    start_time = timeit.default_timer()
+    assert match_groups.update([15], get_length) == set(range(11, 21))
+    print("dirty group evaluated in %.6f s" % (timeit.default_timer() - start_time))
+    match_groups.remove_net(1)
+    assert match_groups.update([], get_length) == set(range(2, 11))
+    assert not match_groups.get_violations()
+
+
+# for testing purposes only
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler(sys.stdout)])
+    main()
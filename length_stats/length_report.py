@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+#  length_report.py
+#
+# Copyright (C) 2018 Mitja Nemec
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""
+Headless net length report of .kicad_pcb files, e.g. for checking length matching on CI.
+Boards are read with pcbnew.LoadBoard when pcbnew is available, otherwise with a line based
+reader of KiCad 5 board files. Lengths are computed with the same engine as the length stats dialog.
+
+python length_report.py board.kicad_pcb [board.kicad_pcb ...] [-n NET_PATTERN] [-g GROUPS_FILE]
+                        [-o OUTPUT_FILE] [-r {auto,pcbnew,sexpr}] [-w WORKERS]
+python length_report.py --test
+
+Exit code is 1 when any net of length matching groups is out of tolerance.
+"""
+from __future__ import absolute_import, division, print_function
+import os
+import io
+import re
+import sys
+import csv
+import json
+import math
+import shutil
+import logging
+import tempfile
+import argparse
+import multiprocessing
+from collections import namedtuple
+
+try:
+    import concurrent.futures
+    HAS_FUTURES = True
+except ImportError:
+    # python 2 without "futures" backport
+    HAS_FUTURES = False
+
+try:
+    import pcbnew
+    HAS_PCBNEW = True
+except ImportError:
+    HAS_PCBNEW = False
+
+# not only when run as a script, but also in spawned workers, which import the script as __mp_main__
+if __package__:
+    from . import length_engine
+else:
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import length_engine
+
+logger = logging.getLogger(__name__)
+
+SCALE = 1000000.0
+# board thickness, when it is not found in the file
+DEFAULT_THICKNESS = 1.6
+
+# everything the report needs from a board. Snapshot holds the tracks of all the nets,
+# net names and netclasses are indexed by netcode, layer names by copper layer
+BoardData = namedtuple('BoardData', ['net_names', 'netclasses', 'layer_names', 'layer_depths', 'snapshot'])
+
+NAME = r'("(?:[^"\\]|\\.)*"|[^\s()"]+)'
+NUMBER = r'([-+\d.eE]+)'
+NET_RE = re.compile(r'\(net (\d+) ' + NAME + r'\)')
+NETCODE_RE = re.compile(r'\(net (\d+)\)')
+NET_CLASS_RE = re.compile(r'\(net_class ' + NAME)
+ADD_NET_RE = re.compile(r'\(add_net ' + NAME + r'\)')
+LAYER_DEFINITION_RE = re.compile(r'\((\d+) ' + NAME + r' (?:signal|power|mixed|jumper|user)')
+THICKNESS_RE = re.compile(r'\(thickness ' + NUMBER + r'\)')
+# stackup thickness can be locked, dielectrics list thickness of each sublayer
+STACKUP_THICKNESS_RE = re.compile(r'\(thickness ' + NUMBER + r'[ )]')
+STACKUP_LAYER_RE = re.compile(r'\(layer ' + NAME)
+START_RE = re.compile(r'\(start ' + NUMBER + ' ' + NUMBER + r'\)')
+END_RE = re.compile(r'\(end ' + NUMBER + ' ' + NUMBER + r'\)')
+AT_RE = re.compile(r'\(at ' + NUMBER + ' ' + NUMBER + r'\)')
+LAYER_RE = re.compile(r'\(layer ' + NAME + r'\)')
+LAYERS_RE = re.compile(r'\(layers ' + NAME + ' ' + NAME + r'\)')
+
+
+def unquote(name):
+    if name.startswith('"'):
+        return name[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+    return name
+
+
+def to_nm(value):
+    return int(round(float(value) * SCALE))
+
+
+def read_board_sexpr(filename):
+    """
+    read the board file line by line. KiCad 5 writes every track and via on a single line,
+    after the layer, net and netclass definitions. Boards saved by V5.99 also have the stackup,
+    each of its layers on a single line
+    """
+    net_names = {}
+    netclass_by_name = {}
+    layer_ids = {}
+    thickness = None
+    stackup = []
+    snapshot = []
+
+    in_layers = False
+    in_stackup = False
+    netclass = None
+    with io.open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            item = line.strip()
+            if item.startswith('(segment '):
+                start = START_RE.search(item)
+                end = END_RE.search(item)
+                layer = layer_ids.get(unquote(LAYER_RE.search(item).group(1)))
+                if layer is None:
+                    continue
+                start_x, start_y = to_nm(start.group(1)), to_nm(start.group(2))
+                end_x, end_y = to_nm(end.group(1)), to_nm(end.group(2))
+                snapshot.append((int(NETCODE_RE.search(item).group(1)),
+                                 math.hypot(end_x - start_x, end_y - start_y),
+                                 start_x, start_y, end_x, end_y, layer, layer, layer))
+            elif item.startswith('(via '):
+                at = AT_RE.search(item)
+                layers = LAYERS_RE.search(item)
+                via_layers = [layer_ids.get(unquote(layers.group(1)), 0),
+                              layer_ids.get(unquote(layers.group(2)), length_engine.COPPER_LAYERS - 1)]
+                x, y = to_nm(at.group(1)), to_nm(at.group(2))
+                snapshot.append((int(NETCODE_RE.search(item).group(1)), 0.0, x, y, x, y,
+                                 min(via_layers), min(via_layers), max(via_layers)))
+            elif in_layers:
+                if item == ')':
+                    in_layers = False
+                else:
+                    layer_definition = LAYER_DEFINITION_RE.match(item)
+                    if layer_definition and int(layer_definition.group(1)) < length_engine.COPPER_LAYERS:
+                        layer_ids[unquote(layer_definition.group(2))] = int(layer_definition.group(1))
+            elif item == '(layers':
+                in_layers = True
+            elif in_stackup:
+                if item == ')':
+                    in_stackup = False
+                elif item.startswith('(layer '):
+                    name = unquote(STACKUP_LAYER_RE.match(item).group(1))
+                    layer_thickness = sum(float(value) for value in STACKUP_THICKNESS_RE.findall(item)) * SCALE
+                    if name in layer_ids:
+                        stackup.append((layer_ids[name], layer_thickness))
+                    elif name.startswith('dielectric'):
+                        stackup.append((None, layer_thickness))
+            elif item == '(stackup':
+                in_stackup = True
+            elif item.startswith('(net '):
+                # pads repeat the same definitions
+                net = NET_RE.match(item)
+                if net:
+                    net_names[int(net.group(1))] = unquote(net.group(2))
+            elif item.startswith('(net_class '):
+                netclass = unquote(NET_CLASS_RE.match(item).group(1))
+            elif item.startswith('(add_net '):
+                netclass_by_name[unquote(ADD_NET_RE.match(item).group(1))] = netclass
+            elif item.startswith('(thickness ') and thickness is None:
+                thickness = float(THICKNESS_RE.match(item).group(1))
+
+    if not layer_ids:
+        raise LookupError("No copper layers found in: " + filename)
+    if thickness is None:
+        thickness = DEFAULT_THICKNESS
+
+    netclasses = dict((netcode, netclass_by_name.get(name, "Default")) for netcode, name in net_names.items())
+    layer_names = dict((layer, name) for name, layer in layer_ids.items())
+    layer_depths = length_engine.make_stackup_layer_depths(stackup)
+    if layer_depths is None:
+        logger.info(filename + ": no stackup, via lengths assume evenly spaced copper layers")
+        layer_depths = length_engine.make_layer_depths(thickness * SCALE, len(layer_ids))
+    return BoardData(net_names, netclasses, layer_names, layer_depths, snapshot)
+
+
+def read_board_pcbnew(filename):
+    board = pcbnew.LoadBoard(filename)
+    net_names = {}
+    netclasses = {}
+    for netcode in range(board.GetNetCount()):
+        net = board.FindNet(netcode)
+        net_names[netcode] = net.GetNetname()
+        netclasses[netcode] = net.GetClassName()
+    layer_names = dict((layer, board.GetLayerName(layer))
+                       for layer in range(length_engine.COPPER_LAYERS) if board.IsLayerEnabled(layer))
+    snapshot = length_engine.get_tracks_snapshot(board.GetTracks(), list(net_names.keys()))
+    return BoardData(net_names, netclasses, layer_names, length_engine.get_layer_depths(board), snapshot)
+
+
+def read_board(filename, reader="auto"):
+    if reader == "pcbnew" or (reader == "auto" and HAS_PCBNEW):
+        return read_board_pcbnew(filename)
+    return read_board_sexpr(filename)
+
+
+def get_length_report(filename, net_patterns=(), groups_filename=None, reader="auto"):
+    """
+    lengths in mm of the nets matching the patterns and of the nets in length matching groups,
+    all the nets when neither is given. Returns a list of dicts, one for each net
+    """
+    board_data = read_board(filename, reader)
+    net_names = [name for netcode, name in sorted(board_data.net_names.items()) if netcode != 0 and name]
+    netcodes_by_name = dict((name, netcode) for netcode, name in board_data.net_names.items())
+
+    match_groups = []
+    if groups_filename:
+        match_groups = length_engine.load_match_groups(groups_filename, net_names)
+    if net_patterns or match_groups:
+        nets = length_engine.get_matching_nets(net_patterns, net_names)
+    else:
+        nets = list(net_names)
+    listed = set(nets)
+    for _, group_nets, _, _ in match_groups:
+        for net in group_nets:
+            if net not in listed:
+                listed.add(net)
+                nets.append(net)
+    netcodes = [netcodes_by_name[net] for net in nets]
+
+    sweep = length_engine.TrackSweep(board_data.snapshot, netcodes, max(board_data.net_names) + 1,
+                                     board_data.layer_depths)
+
+    def get_electrical_length(netcode):
+        return sweep.lengths[netcode] + sweep.via_lengths[netcode]
+
+    groups = length_engine.MatchGroups()
+    for name, group_nets, target, tolerance in match_groups:
+        groups.add_group(length_engine.MatchGroup(name, [netcodes_by_name[net] for net in group_nets],
+                                                  target, tolerance))
+    groups.update(netcodes, get_electrical_length)
+
+    report = []
+    for net, netcode in zip(nets, netcodes):
+        net_length = sweep.get_net_length(netcode)
+        report.append({"board": filename,
+                       "net": net,
+                       "netclass": board_data.netclasses[netcode],
+                       "length": net_length.length,
+                       "via_length": net_length.via_length,
+                       "electrical_length": net_length.length + net_length.via_length,
+                       "groups": [group.name for group in groups.net_groups.get(netcode, [])],
+                       "deviation": groups.get_deviation(netcode),
+                       "violation": groups.is_violation(netcode),
+                       "layers": dict((layer_name, net_length.layer_lengths[layer])
+                                      for layer, layer_name in board_data.layer_names.items())})
+    logger.info(filename + ": " + str(len(report)) + " nets, "
+                + str(len(groups.get_violations())) + " out of tolerance")
+    return report
+
+
+def get_length_reports(filenames, net_patterns=(), groups_filename=None, reader="auto", workers=0,
+                       mp_context=None):
+    """
+    reports of all the boards, one after another
+    with workers > 0 the boards are read in a pool of worker processes, started with mp_context if given
+    """
+    if workers and not HAS_FUTURES:
+        logger.info("concurrent.futures is not available, reading boards serially")
+        workers = 0
+
+    if not workers or len(filenames) < 2:
+        return [get_length_report(filename, net_patterns, groups_filename, reader) for filename in filenames]
+
+    pool_arguments = {}
+    if mp_context is not None:
+        pool_arguments["mp_context"] = mp_context
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, **pool_arguments) as executor:
+        futures = [executor.submit(get_length_report, filename, net_patterns, groups_filename, reader)
+                   for filename in filenames]
+        return [future.result() for future in futures]
+
+
+def save_length_report(filename, report):
+    """
+    save report to .json file, or as comma separated values to any other file or to stdout
+    lengths on each layer are only saved to .json
+    """
+    if filename is not None and filename.lower().endswith('.json'):
+        with open(filename, 'w') as f:
+            json.dump(report, f, indent=2)
+        return
+
+    if filename is None:
+        f = sys.stdout
+    elif sys.version_info[0] < 3:
+        f = open(filename, 'wb')
+    else:
+        f = open(filename, 'w', newline='')
+    try:
+        writer = csv.writer(f)
+        writer.writerow(["Board", "Net", "Net class", "Length [mm]", "Via length [mm]", "Electrical length [mm]",
+                         "Groups", "Deviation [mm]", "Out of tolerance"])
+        for net in report:
+            row = [net["board"], net["net"], net["netclass"]]
+            row.extend("%.4f" % net[key] for key in ("length", "via_length", "electrical_length"))
+            row.append(" ".join(net["groups"]))
+            # nets which are not in any group have no deviation
+            row.append("" if net["deviation"] is None else "%.4f" % net["deviation"])
+            row.append("yes" if net["violation"] else "")
+            if sys.version_info[0] < 3:
+                row = [value.encode('utf-8') for value in row]
+            writer.writerow(row)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report track lengths of nets on KiCad boards")
+    parser.add_argument("boards", nargs="+", help=".kicad_pcb files")
+    parser.add_argument("-n", "--nets", action="append", default=[], metavar="NET_PATTERN",
+                        help="net name or fnmatch pattern, can be given multiple times")
+    parser.add_argument("-g", "--groups", help="length matching groups .json file, same as used by length stats")
+    parser.add_argument("-o", "--output", help=".json or .csv file, comma separated values to stdout if omitted")
+    parser.add_argument("-r", "--reader", choices=["auto", "pcbnew", "sexpr"], default="auto",
+                        help="read boards with pcbnew or with built in reader, pcbnew if available by default")
+    parser.add_argument("-w", "--workers", type=int, default=0,
+                        help="number of worker processes for multiple boards")
+    args = parser.parse_args(argv)
+
+    if args.reader == "pcbnew" and not HAS_PCBNEW:
+        parser.error("pcbnew module is not available")
+
+    try:
+        reports = get_length_reports(args.boards, args.nets, args.groups, args.reader, args.workers)
+    except (LookupError, IOError, OSError) as error:
+        logger.error(str(error))
+        return 2
+
+    report = [net for board_report in reports for net in board_report]
+    save_length_report(args.output, report)
+    if any(net["violation"] for net in report):
+        return 1
+    return 0
+
+
+def test():
+    """ reports read by spawned workers, as on windows and macos, have to match the serial ones """
+    filename = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "..", "pad2pad_track_distance", "En_mostic_test.kicad_pcb")
+    filenames = [filename] * 3
+    serial = get_length_reports(filenames, reader="sexpr")
+    parallel = get_length_reports(filenames, reader="sexpr", workers=2,
+                                  mp_context=multiprocessing.get_context('spawn'))
+    assert serial == parallel
+    assert len(serial) == 3 and len(serial[0]) == 56
+    print("Reports of %d boards read by spawned workers match" % len(filenames))
+
+    # via lengths follow the stackup when the board has one
+    with io.open(filename, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    setup_index = lines.index(u'  (setup\n') + 1
+    lines[setup_index:setup_index] = [u'    (stackup\n',
+                                      u'      (layer "F.SilkS" (type "Top Silk Screen"))\n',
+                                      u'      (layer "F.Cu" (type "copper") (thickness 0.035))\n',
+                                      u'      (layer "dielectric 1" (type "core") (thickness 1.51 locked))\n',
+                                      u'      (layer "B.Cu" (type "copper") (thickness 0.035))\n',
+                                      u'      (copper_finish "None")\n',
+                                      u'    )\n']
+    stackup_filename = os.path.join(tempfile.mkdtemp(), "stackup.kicad_pcb")
+    try:
+        with io.open(stackup_filename, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        even = read_board_sexpr(filename).layer_depths
+        stackup = read_board_sexpr(stackup_filename).layer_depths
+    finally:
+        shutil.rmtree(os.path.dirname(stackup_filename))
+    assert abs(even[31] - 1.6 * SCALE) < 1e-6
+    assert abs(stackup[31] - 1.545 * SCALE) < 1e-6
+    print("Via depth from stackup: %.3f mm, evenly spaced: %.3f mm" % (stackup[31] / SCALE, even[31] / SCALE))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler(sys.stderr)])
+    if sys.argv[1:] == ["--test"]:
+        test()
+        sys.exit(0)
+    sys.exit(main())
@@ -55,7 +55,7 @@ class Net2NedDistance(pcbnew.ActionPlugin):
     def defaults(self):
         self.name = "Net2Net distance"
         self.category = "Measure distance"
-        self.description = "Measure minimum distance between two selected nets"
+        self.description = "Measure minimum distance between selected nets"
 
     def Run(self):
         # load board
@@ -107,16 +107,20 @@ class Net2NedDistance(pcbnew.ActionPlugin):
             pads = mod.Pads()
             nets.update([pad.GetNetname() for pad in pads if pad.IsSelected()])
 
-        # if two pads are selected
-        if len(nets) != 2:
-            # if more or less than one show only a messagebox
+        # at least two nets have to be selected
+        if len(nets) < 2:
             caption = 'Net2Net Distance'
-            message = "You have to select two and only two nets"
+            message = "You have to select at least two nets"
             dlg = wx.MessageDialog(_pcbnew_frame, message, caption, wx.OK | wx.ICON_INFORMATION)
             dlg.ShowModal()
             dlg.Destroy()
             return
 
+        # with more than two nets, clearances between all pairs are saved into a file
+        if len(nets) > 2:
+            self.save_clearance_matrix(board, sorted(nets), user_units, _pcbnew_frame, logger)
+            return
+
         try:
             dis, loc = net2net_distance.get_min_distance(board, list(nets))
         except Exception:
@@ -133,9 +137,43 @@ class Net2NedDistance(pcbnew.ActionPlugin):
             
         caption = 'Net2Net Track Distance'
         if user_units == 'mm':
-            message = "Minimum distance between net segments is " + "%.3f" % (dis/SCALE) + " mm"
+            message = "Minimum distance between net copper is " + "%.3f" % (dis/SCALE) + " mm"
         else:
-            message = "Minimum distance between net segments is " + "%.4f" % (dis/(SCALE*25.4)) + " in"
+            message = "Minimum distance between net copper is " + "%.4f" % (dis/(SCALE*25.4)) + " in"
+        dlg = wx.MessageDialog(_pcbnew_frame, message, caption, wx.OK | wx.ICON_INFORMATION)
+        dlg.ShowModal()
+        dlg.Destroy()
+        logging.shutdown()
+
+    def save_clearance_matrix(self, board, nets, user_units, _pcbnew_frame, logger):
+        board_filename = os.path.abspath(board.GetFileName())
+        csv_filename = os.path.splitext(board_filename)[0] + "_net2net_clearances.csv"
+        try:
+            clearance_matrix = net2net_distance.get_clearance_matrix(board, nets)
+            net2net_distance.save_clearance_matrix(csv_filename, clearance_matrix)
+        except Exception:
+            logger.exception("Fatal error running net2net_min_distance")
+            caption = 'Net2Net Track Distance'
+            message = "Fatal error when measuring clearances.\n"\
+                    + "You can raise an issue on GiHub page.\n" \
+                    + "Please attach the net2et_distance.log which you should find in the project folder."
+            dlg = wx.MessageDialog(_pcbnew_frame, message, caption, wx.OK | wx.ICON_ERROR)
+            dlg.ShowModal()
+            dlg.Destroy()
+            logging.shutdown()
+            return
+
+        # report the closest pair of nets, nets without tracks have no clearance
+        measured = [x for x in clearance_matrix if x[2] == x[2]]
+        caption = 'Net2Net Track Distance'
+        message = "Clearances between " + str(len(nets)) + " nets saved to:\n" + csv_filename
+        if measured:
+            net_1, net_2, dis, _ = min(measured, key=lambda x: x[2])
+            if user_units == 'mm':
+                message = message + "\nMinimum distance is " + "%.3f" % (dis/SCALE) + " mm"
+            else:
+                message = message + "\nMinimum distance is " + "%.4f" % (dis/(SCALE*25.4)) + " in"
+            message = message + " between " + net_1 + " and " + net_2
         dlg = wx.MessageDialog(_pcbnew_frame, message, caption, wx.OK | wx.ICON_INFORMATION)
         dlg.ShowModal()
         dlg.Destroy()
@@ -24,10 +24,28 @@ import os
 import logging
 import pcbnew
 import sys
+import csv
 import math
+import time
+import heapq
+import random
+import itertools
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
 
 logger = logging.getLogger(__name__)
 SCALE = 1000000.0
+# max number of segments in a leaf of the SegmentTree
+LEAF_SIZE = 32
+LEAF_SIZE_PYTHON = 8
+# leaves of the tree shared by all the nets on a layer, these are split by net within each leaf
+LEAF_SIZE_SHARED = 64
+# with fewer nets on a layer the shared tree costs more than it saves, pairs are searched one by one
+SHARED_TREE_MIN_NETS = 16
 
 # get version information
 version_filename = os.path.join(os.path.dirname(os.path.realpath(__file__)), "version.txt")
@@ -46,20 +64,20 @@ def segments_distance(x11, y11, x12, y12, x21, y21, x22, y22):
         one segment is (x11, y11) to (x12, y12)
         the other is   (x21, y21) to (x22, y22)
     """
-    if segments_intersect(x11, y11, x12, y12, x21, y21, x22, y22):
-        return 0
+    intersection = segments_intersection(x11, y11, x12, y12, x21, y21, x22, y22)
+    if intersection is not None:
+        return 0, intersection + intersection
     # try each of the 4 vertices w/the other segment
     distances = []
     distances.append(point_segment_distance(x11, y11, x21, y21, x22, y22))
     distances.append(point_segment_distance(x12, y12, x21, y21, x22, y22))
     distances.append(point_segment_distance(x21, y21, x11, y11, x12, y12))
     distances.append(point_segment_distance(x22, y22, x11, y11, x12, y12))
-    logger.info("All distances:\n" + repr(distances))
     return min(distances, key=lambda t: t[0])
 
 
-def segments_intersect(x11, y11, x12, y12, x21, y21, x22, y22):
-    """ whether two segments in the plane intersect:
+def segments_intersection(x11, y11, x12, y12, x21, y21, x22, y22):
+    """ intersection point of two segments in the plane or None if they do not intersect:
         one segment is (x11, y11) to (x12, y12)
         the other is   (x21, y21) to (x22, y22)
     """
@@ -69,83 +87,708 @@ def segments_intersect(x11, y11, x12, y12, x21, y21, x22, y22):
     dy2 = y22 - y21
     delta = dx2 * dy1 - dy2 * dx1
     if delta == 0:
-        return False  # parallel segments
+        return None  # parallel segments
     s = (dx1 * (y21 - y11) + dy1 * (x11 - x21)) / delta
     t = (dx2 * (y11 - y21) + dy2 * (x21 - x11)) / (-delta)
 
-    return (0 <= s <= 1) and (0 <= t <= 1)
+    if (0 <= s <= 1) and (0 <= t <= 1):
+        return int(x21 + s * dx2), int(y21 + s * dy2)
+    return None
+
+
+def segments_intersect(x11, y11, x12, y12, x21, y21, x22, y22):
+    """ whether two segments in the plane intersect:
+        one segment is (x11, y11) to (x12, y12)
+        the other is   (x21, y21) to (x22, y22)
+    """
+    return segments_intersection(x11, y11, x12, y12, x21, y21, x22, y22) is not None
 
 
 def point_segment_distance(px, py, x1, y1, x2, y2):
     dx = x2 - x1
     dy = y2 - y1
-    if dx == dy == 0:  # the segment's just a point
-        return math.hypot(px - x1, py - y1)
-
-    # Calculate the t that minimizes the distance.
-    t = ((px - x1) * dx + (py - y1) * dy) / (dx * dx + dy * dy)
-
-    # See if this represents one of the segment's
-    # end points or a point in the middle.
-    if t < 0:
+    if dx == dy == 0:  # the segment's just a point (e.g. via)
         dx = px - x1
         dy = py - y1
-    elif t > 1:
-        dx = px - x2
-        dy = py - y2
     else:
-        near_x = x1 + t * dx
-        near_y = y1 + t * dy
-        dx = px - near_x
-        dy = py - near_y
+        # Calculate the t that minimizes the distance.
+        t = ((px - x1) * dx + (py - y1) * dy) / (dx * dx + dy * dy)
+
+        # See if this represents one of the segment's
+        # end points or a point in the middle.
+        if t < 0:
+            dx = px - x1
+            dy = py - y1
+        elif t > 1:
+            dx = px - x2
+            dy = py - y2
+        else:
+            near_x = x1 + t * dx
+            near_y = y1 + t * dy
+            dx = px - near_x
+            dy = py - near_y
     location = (px, py, int(px+dx), int(py+dy))
 
     return math.hypot(dx, dy), location
 
 
-def get_min_distance(board, nets):
-    # get nets
-    net1 = nets[0]
-    net2 = nets[1]
-    logger.info("Net2net getting min distance between " + str(net1) + " and " + str(net2))
+def point_in_polygon(px, py, rings):
+    """ whether the point is inside of the polygon given by outline and hole rings (even-odd rule) """
+    inside = False
+    for ring in rings:
+        x2, y2 = ring[-1]
+        for x1, y1 in ring:
+            if (y1 > py) != (y2 > py):
+                if px < x1 + (py - y1) * (x2 - x1) / (y2 - y1):
+                    inside = not inside
+            x2 = x1
+            y2 = y1
+    return inside
 
-    # get tracks on net
-    tracks_1 = []
-    tracks_2 = []
-    all_tracks = board.GetTracks()
-    for track in all_tracks:
-        if track.GetNetname() == net1:
-            tracks_1.append(track)
-        if track.GetNetname() == net2:
-            tracks_2.append(track)
-
-    logger.info("Found " + str(len(tracks_1)+1) + " tracks on " + str(net1) + " and " + str(len(tracks_2)+1) + "tracks on " + str(net2))
-    # TODO maybe I have to raise an exception if there ar no tracks on either net
 
+class NetCopper():
+    """
+    copper of one net on one layer. Polygon outlines are also added to segments,
+    so the segment engine measures the distance to polygon edges
+    """
+    def __init__(self, segments=None):
+        # (x start, y start, x end, y end, width) of tracks, vias, round pads and polygon edges
+        self.segments = segments if segments is not None else []
+        # (rings of (x, y) points, bounding box, edge width) of pads and zone fills
+        self.polygons = []
+        self.tree = None
+
+    def add_polygon(self, rings, width):
+        rings = [ring for ring in rings if ring]
+        if not rings:
+            return
+        for ring in rings:
+            x1, y1 = ring[-1]
+            for x2, y2 in ring:
+                self.segments.append((x1, y1, x2, y2, width))
+                x1 = x2
+                y1 = y2
+        all_x = [x for ring in rings for x, _ in ring]
+        all_y = [y for ring in rings for _, y in ring]
+        self.polygons.append((rings, (min(all_x), min(all_y), max(all_x), max(all_y)), width))
+
+    def get_tree(self):
+        if self.tree is None:
+            self.tree = SegmentTree(self.segments)
+        return self.tree
+
+
+def get_copper_layers(board):
+    return [layer for layer in range(pcbnew.PCB_LAYER_ID_COUNT)
+            if pcbnew.IsCopperLayer(layer) and board.IsLayerEnabled(layer)]
+
+
+def get_poly_set_rings(poly_set):
+    """ get all outlines and holes of SHAPE_POLY_SET as lists of (x, y) """
+    rings = []
+    for outline_index in range(poly_set.OutlineCount()):
+        chains = [poly_set.Outline(outline_index)]
+        chains.extend([poly_set.Hole(outline_index, hole_index)
+                       for hole_index in range(poly_set.HoleCount(outline_index))])
+        for chain in chains:
+            ring = []
+            for point_index in range(chain.PointCount()):
+                point = chain.CPoint(point_index)
+                ring.append((point.x, point.y))
+            rings.append(ring)
+    return rings
+
+
+# V5.99 forward compatibility, pad shapes and zone fills take a layer
+# (older SWIG raises NotImplementedError for a wrong overload)
+def get_pad_rings(pad, layer):
+    """ rings of the pad shape on the layer """
+    poly_set = pcbnew.SHAPE_POLY_SET()
+    try:
+        pad.TransformShapeWithClearanceToPolygon(poly_set, 0)
+    except (TypeError, NotImplementedError):
+        pad.TransformShapeWithClearanceToPolygon(poly_set, layer, 0)
+    return get_poly_set_rings(poly_set)
+
+
+def get_zone_rings(zone, layer):
+    """ rings of the zone fill on the layer """
+    try:
+        poly_set = zone.GetFilledPolysList()
+    except (TypeError, NotImplementedError):
+        poly_set = zone.GetFilledPolysList(layer)
+    return get_poly_set_rings(poly_set)
+
+
+def is_keepout(zone):
+    if hasattr(zone, 'GetIsRuleArea'):
+        return zone.GetIsRuleArea()
+    return zone.GetIsKeepout()
+
+
+def get_net_copper(board, nets):
+    """
+    get copper of each of the nets as a dict of layer -> NetCopper, with tracks, vias, pads
+    and filled zones. Round pads and vias are segments of zero length, other pads are polygons
+    """
+    layers = get_copper_layers(board)
+    copper = dict((net, {}) for net in nets)
+
+    def get_layer_copper(net, layer):
+        if layer not in copper[net]:
+            copper[net][layer] = NetCopper()
+        return copper[net][layer]
+
+    for track in board.GetTracks():
+        net = track.GetNetname()
+        if net not in copper:
+            continue
+        start = track.GetStart()
+        end = track.GetEnd()
+        segment = (start.x, start.y, end.x, end.y, track.GetWidth())
+        if track.Type() == pcbnew.PCB_VIA_T:
+            track_layers = [layer for layer in layers if track.IsOnLayer(layer)]
+        else:
+            track_layers = [track.GetLayer()]
+        for layer in track_layers:
+            get_layer_copper(net, layer).segments.append(segment)
+
+    # V5.99 forward compatibility
+    modules = board.GetFootprints() if hasattr(board, 'GetFootprints') else board.GetModules()
+    for mod in modules:
+        for pad in mod.Pads():
+            net = pad.GetNetname()
+            if net not in copper:
+                continue
+            pad_layers = [layer for layer in layers if pad.IsOnLayer(layer)]
+            if pad.GetShape() == pcbnew.PAD_SHAPE_CIRCLE:
+                position = pad.ShapePos()
+                segment = (position.x, position.y, position.x, position.y, pad.GetSize().x)
+                for layer in pad_layers:
+                    get_layer_copper(net, layer).segments.append(segment)
+            else:
+                for layer in pad_layers:
+                    get_layer_copper(net, layer).add_polygon(get_pad_rings(pad, layer), 0)
+
+    for zone_index in range(board.GetAreaCount()):
+        zone = board.GetArea(zone_index)
+        net = zone.GetNetname()
+        if net not in copper or is_keepout(zone) or not zone.IsFilled():
+            continue
+        if not pcbnew.IsCopperLayer(zone.GetLayer()):
+            continue
+        # filled polygons are drawn with min thickness outline
+        rings = get_zone_rings(zone, zone.GetLayer())
+        get_layer_copper(net, zone.GetLayer()).add_polygon(rings, zone.GetMinThickness())
+
+    return [copper[net] for net in nets]
+
+
+def get_segments_min_distance_python(segments_1, segments_2):
+    """ reference implementation, checks every pair of segments """
     min_distance = None
     location = None
-    for track1 in tracks_1:
-        w1 = track1.GetWidth()
-        x11 = track1.GetStart().x
-        y11 = track1.GetStart().y
-        x12 = track1.GetEnd().x
-        y12 = track1.GetEnd().y
-        for track2 in tracks_2:
-            w2 = track2.GetWidth()
-            x21 = track2.GetStart().x
-            y21 = track2.GetStart().y
-            x22 = track2.GetEnd().x
-            y22 = track2.GetEnd().y
+    for x11, y11, x12, y12, w1 in segments_1:
+        for x21, y21, x22, y22, w2 in segments_2:
             dis, loc = segments_distance(x11, y11, x12, y12, x21, y21, x22, y22)
             dis = dis - w1/2 - w2/2
-            if min_distance is None:
+            if min_distance is None or min_distance > dis:
                 min_distance = dis
                 location = tuple(loc)
-            if min_distance > dis:
+    return min_distance, location
+
+
+def points_segments_distance_numpy(px, py, x1, y1, x2, y2):
+    """ vectorized point_segment_distance, only the distance is computed """
+    dx = x2 - x1
+    dy = y2 - y1
+    length = dx * dx + dy * dy
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = ((px - x1) * dx + (py - y1) * dy) / length
+    # zero length segments (vias) are points
+    t = np.where(length == 0, 0.0, np.clip(t, 0.0, 1.0))
+    return np.hypot(px - (x1 + t * dx), py - (y1 + t * dy))
+
+
+def segments_intersect_numpy(x11, y11, x12, y12, x21, y21, x22, y22):
+    """ vectorized segments_intersect """
+    dx1 = x12 - x11
+    dy1 = y12 - y11
+    dx2 = x22 - x21
+    dy2 = y22 - y21
+    delta = dx2 * dy1 - dy2 * dx1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = (dx1 * (y21 - y11) + dy1 * (x11 - x21)) / delta
+        t = (dx2 * (y11 - y21) + dy2 * (x21 - x11)) / (-delta)
+        return (delta != 0) & (s >= 0) & (s <= 1) & (t >= 0) & (t <= 1)
+
+
+def get_distances_numpy(array_1, array_2):
+    """ clearances between every segment in array_1 (rows) and every segment in array_2 (columns) """
+    x11, y11, x12, y12, w1 = (array_1[:, i][:, np.newaxis] for i in range(5))
+    x21, y21, x22, y22, w2 = (array_2[:, i][np.newaxis, :] for i in range(5))
+    distances = np.minimum(np.minimum(points_segments_distance_numpy(x11, y11, x21, y21, x22, y22),
+                                      points_segments_distance_numpy(x12, y12, x21, y21, x22, y22)),
+                           np.minimum(points_segments_distance_numpy(x21, y21, x11, y11, x12, y12),
+                                      points_segments_distance_numpy(x22, y22, x11, y11, x12, y12)))
+    distances[segments_intersect_numpy(x11, y11, x12, y12, x21, y21, x22, y22)] = 0.0
+    return distances - w1 / 2 - w2 / 2
+
+
+class SegmentNode():
+    """ node of the SegmentTree, leaves have no children """
+    __slots__ = ('left', 'top', 'right', 'bottom', 'max_width', 'start', 'end', 'children')
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.children = None
+
+
+class SegmentTree():
+    """
+    kd-tree over segments, split at the median of segment centers along the direction they are spread the most.
+    Segments of each node are a continuous range in self.order
+    """
+    def __init__(self, segments, leaf_size=None):
+        self.segments = segments
+        self.boxes = [(min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)) for x1, y1, x2, y2, _ in segments]
+        self.centers_x = [x1 + x2 for x1, _, x2, _, _ in segments]
+        self.centers_y = [y1 + y2 for _, y1, _, y2, _ in segments]
+        self.order = list(range(len(segments)))
+        if leaf_size is None:
+            leaf_size = LEAF_SIZE if HAS_NUMPY else LEAF_SIZE_PYTHON
+        self.leaf_size = leaf_size
+        self.root = self.build(0, len(segments))
+        if HAS_NUMPY:
+            self.array = np.array([segments[index] for index in self.order], dtype=np.float64)
+
+    def build(self, start, end):
+        node = SegmentNode(start, end)
+        indices = self.order[start:end]
+        if end - start > self.leaf_size:
+            # children first, node bounds are the union of the children bounds
+            self.sort(indices, self.spread_x(indices) > self.spread_y(indices))
+            self.order[start:end] = indices
+            middle = (start + end) // 2
+            node.children = (self.build(start, middle), self.build(middle, end))
+            child_1, child_2 = node.children
+            node.left = min(child_1.left, child_2.left)
+            node.top = min(child_1.top, child_2.top)
+            node.right = max(child_1.right, child_2.right)
+            node.bottom = max(child_1.bottom, child_2.bottom)
+            node.max_width = max(child_1.max_width, child_2.max_width)
+        else:
+            boxes = [self.boxes[index] for index in indices]
+            node.left = min(box[0] for box in boxes)
+            node.top = min(box[1] for box in boxes)
+            node.right = max(box[2] for box in boxes)
+            node.bottom = max(box[3] for box in boxes)
+            node.max_width = max(self.segments[index][4] for index in indices)
+        return node
+
+    def query(self, box):
+        """ get indices of all segments with bounding box overlapping the box """
+        left, top, right, bottom = box
+        indices = []
+        nodes = [self.root]
+        while nodes:
+            node = nodes.pop()
+            if node.left > right or node.right < left or node.top > bottom or node.bottom < top:
+                continue
+            if node.children is not None:
+                nodes.extend(node.children)
+                continue
+            for index in self.order[node.start:node.end]:
+                s_left, s_top, s_right, s_bottom = self.boxes[index]
+                if not (s_left > right or s_right < left or s_top > bottom or s_bottom < top):
+                    indices.append(index)
+        return sorted(indices)
+
+    def spread_x(self, indices):
+        centers = [self.centers_x[index] for index in indices]
+        return max(centers) - min(centers)
+
+    def spread_y(self, indices):
+        centers = [self.centers_y[index] for index in indices]
+        return max(centers) - min(centers)
+
+    def sort(self, indices, along_x):
+        if along_x:
+            indices.sort(key=self.centers_x.__getitem__)
+        else:
+            indices.sort(key=self.centers_y.__getitem__)
+
+
+def get_nodes_min_distance(node_1, node_2):
+    """ lower bound of clearance between any two segments within the nodes """
+    dx = max(node_1.left - node_2.right, node_2.left - node_1.right, 0)
+    dy = max(node_1.top - node_2.bottom, node_2.top - node_1.bottom, 0)
+    return math.hypot(dx, dy) - node_1.max_width / 2 - node_2.max_width / 2
+
+
+def get_leaves_min_distance(tree_1, node_1, tree_2, node_2, best):
+    """ best (distance, index 1, index 2) found among segments of both leaves or the current best """
+    if HAS_NUMPY:
+        distances = get_distances_numpy(tree_1.array[node_1.start:node_1.end],
+                                        tree_2.array[node_2.start:node_2.end])
+        min_distance = distances.min()
+        if min_distance > best[0]:
+            return best
+        rows, columns = np.nonzero(distances == min_distance)
+        pair = min((tree_1.order[node_1.start + row], tree_2.order[node_2.start + column])
+                   for row, column in zip(rows, columns))
+        return min(best, (min_distance, pair[0], pair[1]))
+
+    for index_1 in tree_1.order[node_1.start:node_1.end]:
+        x11, y11, x12, y12, w1 = tree_1.segments[index_1]
+        left_1, top_1, right_1, bottom_1 = tree_1.boxes[index_1]
+        for index_2 in tree_2.order[node_2.start:node_2.end]:
+            x21, y21, x22, y22, w2 = tree_2.segments[index_2]
+            left_2, top_2, right_2, bottom_2 = tree_2.boxes[index_2]
+            # quick check on bounding boxes
+            dx = max(left_1 - right_2, left_2 - right_1, 0)
+            dy = max(top_1 - bottom_2, top_2 - bottom_1, 0)
+            if math.hypot(dx, dy) - w1 / 2 - w2 / 2 > best[0]:
+                continue
+            dis, _ = segments_distance(x11, y11, x12, y12, x21, y21, x22, y22)
+            best = min(best, (dis - w1 / 2 - w2 / 2, index_1, index_2))
+    return best
+
+
+def get_trees_min_distance(tree_1, tree_2):
+    """
+    best (distance, index in first tree, index in second tree) of two segment trees.
+    Branch and bound, node pairs are visited nearest first and dropped as soon as
+    their bounding boxes are further apart than the best distance found so far
+    """
+    best = (float('inf'), None, None)
+    counter = itertools.count()
+    heap = [(get_nodes_min_distance(tree_1.root, tree_2.root), next(counter), tree_1.root, tree_2.root)]
+    while heap:
+        bound, _, node_1, node_2 = heapq.heappop(heap)
+        if bound > best[0]:
+            break
+        if node_1.children is None and node_2.children is None:
+            best = get_leaves_min_distance(tree_1, node_1, tree_2, node_2, best)
+            continue
+        # split the node with more segments
+        if node_2.children is None or (node_1.children is not None
+                                       and node_1.end - node_1.start >= node_2.end - node_2.start):
+            pairs = [(child, node_2) for child in node_1.children]
+        else:
+            pairs = [(node_1, child) for child in node_2.children]
+        for child_1, child_2 in pairs:
+            bound = get_nodes_min_distance(child_1, child_2)
+            if bound <= best[0]:
+                heapq.heappush(heap, (bound, next(counter), child_1, child_2))
+    return best
+
+
+def get_segments_min_distance(segments_1, segments_2):
+    """
+    get minimum distance between two lists of segments and location (x1, y1, x2, y2) where it was found.
+    Ties are resolved the same way as in get_segments_min_distance_python
+    """
+    if not segments_1 or not segments_2:
+        return None, None
+    _, index_1, index_2 = get_trees_min_distance(SegmentTree(segments_1), SegmentTree(segments_2))
+    # distance and location from the reference implementation
+    return get_segments_min_distance_python([segments_1[index_1]], [segments_2[index_2]])
+
+
+def get_segment_end_inside(segment, rings):
+    """ location (x, y, x, y) of the first segment end which lies inside of the polygon or None """
+    x1, y1, x2, y2, _ = segment
+    for px, py in ((x1, y1), (x2, y2)):
+        if point_in_polygon(px, py, rings):
+            return px, py, px, py
+    return None
+
+
+def get_overlap_min_distance(copper_1, copper_2):
+    """
+    segments of copper_1 with any end inside of a polygon of copper_2 overlap with it even when
+    they do not cross the polygon edges. Segments crossing the edges are measured against the edges.
+    Returns best distance and location or (None, None)
+    """
+    if not copper_1.segments:
+        return None, None
+    min_distance = None
+    location = None
+    tree = copper_1.get_tree()
+    for rings, box, width in copper_2.polygons:
+        for index in tree.query(box):
+            segment = copper_1.segments[index]
+            dis = 0 - segment[4] / 2 - width / 2
+            if min_distance is not None and min_distance <= dis:
+                continue
+            loc = get_segment_end_inside(segment, rings)
+            if loc is not None:
                 min_distance = dis
-                location = tuple(loc)
+                location = loc
+    return min_distance, location
+
+
+def get_copper_min_distance(copper_1, copper_2):
+    """ get minimum distance between copper of two nets on one layer and location where it was found """
+    if not copper_1.segments or not copper_2.segments:
+        return None, None
+    _, index_1, index_2 = get_trees_min_distance(copper_1.get_tree(), copper_2.get_tree())
+    # distance and location from the reference implementation
+    min_distance, location = get_segments_min_distance_python([copper_1.segments[index_1]],
+                                                              [copper_2.segments[index_2]])
+    # copper completely within the polygon of the other net
+    for dis, loc in (get_overlap_min_distance(copper_1, copper_2), get_overlap_min_distance(copper_2, copper_1)):
+        if dis is not None and min_distance > dis:
+            min_distance = dis
+            location = loc
+    return min_distance, location
+
+
+def get_nets_min_distance(net_copper_1, net_copper_2):
+    """ get minimum distance between two nets, given as dicts layer -> NetCopper, over all the layers """
+    min_distance = None
+    location = None
+    for layer in sorted(set(net_copper_1) & set(net_copper_2)):
+        dis, loc = get_copper_min_distance(net_copper_1[layer], net_copper_2[layer])
+        if dis is not None and (min_distance is None or min_distance > dis):
+            min_distance = dis
+            location = loc
+    return min_distance, location
+
+
+def get_nodes_nets(tree, segment_nets):
+    """
+    nets with segments within each node of the tree, as an array of nets and an array of bounds
+    (left, top, right, bottom, max width) of their segments. Leaves also get positions of each net's segments
+    within the leaf. segment_nets are given in tree order
+    """
+    nodes_bounds = {}
+    nodes_positions = {}
+    nodes = [tree.root]
+    # parents before children, so reversed order visits children first
+    for node in nodes:
+        if node.children is not None:
+            nodes.extend(node.children)
+    for node in reversed(nodes):
+        if node.children is not None:
+            bounds = dict(nodes_bounds[node.children[0]])
+            for net, (left, top, right, bottom, max_width) in nodes_bounds[node.children[1]].items():
+                if net in bounds:
+                    b_left, b_top, b_right, b_bottom, b_max_width = bounds[net]
+                    bounds[net] = (min(left, b_left), min(top, b_top), max(right, b_right),
+                                   max(bottom, b_bottom), max(max_width, b_max_width))
+                else:
+                    bounds[net] = (left, top, right, bottom, max_width)
+            nodes_bounds[node] = bounds
+            continue
+        positions = {}
+        for position in range(node.end - node.start):
+            positions.setdefault(segment_nets[node.start + position], []).append(position)
+        bounds = {}
+        for net, net_positions in positions.items():
+            indices = [tree.order[node.start + position] for position in net_positions]
+            boxes = [tree.boxes[index] for index in indices]
+            bounds[net] = (min(box[0] for box in boxes), min(box[1] for box in boxes),
+                           max(box[2] for box in boxes), max(box[3] for box in boxes),
+                           max(tree.segments[index][4] for index in indices))
+            positions[net] = np.array(net_positions)
+        nodes_bounds[node] = bounds
+        nodes_positions[node] = positions
+    for node, bounds in nodes_bounds.items():
+        nets = sorted(bounds)
+        nodes_bounds[node] = (np.array(nets), np.array([bounds[net] for net in nets], dtype=np.float64))
+    return nodes_bounds, nodes_positions
+
+
+def get_open_pairs(bounds_1, bounds_2, candidates, best_distances):
+    """
+    lower bound and those candidate pairs of nets (two arrays), which could still have clearance lower
+    or equal to the best found so far. Bounding boxes of each net within the nodes are used for the bound
+    """
+    nets_1, array_1 = bounds_1
+    nets_2, array_2 = bounds_2
+    candidates_1, candidates_2 = candidates
+    # positions of the candidate nets within the nodes
+    positions_1 = np.minimum(np.searchsorted(nets_1, candidates_1), len(nets_1) - 1)
+    positions_2 = np.minimum(np.searchsorted(nets_2, candidates_2), len(nets_2) - 1)
+    present = (nets_1[positions_1] == candidates_1) & (nets_2[positions_2] == candidates_2)
+    candidates_1 = candidates_1[present]
+    candidates_2 = candidates_2[present]
+    left_1, top_1, right_1, bottom_1, max_width_1 = array_1[positions_1[present]].T
+    left_2, top_2, right_2, bottom_2, max_width_2 = array_2[positions_2[present]].T
+    dx = np.maximum(np.maximum(left_1 - right_2, left_2 - right_1), 0)
+    dy = np.maximum(np.maximum(top_1 - bottom_2, top_2 - bottom_1), 0)
+    bounds = np.hypot(dx, dy) - max_width_1 / 2 - max_width_2 / 2
+    open_pairs = bounds <= best_distances[candidates_1, candidates_2]
+    if not open_pairs.any():
+        return None, None
+    return bounds[open_pairs].min(), (candidates_1[open_pairs], candidates_2[open_pairs])
+
+
+def update_best(best, best_distances, net_1, net_2, dis, index_1, index_2):
+    """ keep the best (distance, index 1, index 2) for a pair of nets, indices are within each net """
+    if net_1 > net_2:
+        net_1, net_2, index_1, index_2 = net_2, net_1, index_2, index_1
+    candidate = (dis, index_1, index_2)
+    current = best.get((net_1, net_2))
+    if current is None or candidate < current:
+        best[(net_1, net_2)] = candidate
+        best_distances[net_1, net_2] = dis
+        best_distances[net_2, net_1] = dis
+
+
+def get_leaves_clearances(tree, node_1, node_2, pairs, segment_keys, nodes_positions, best, best_distances):
+    """ update the best clearances of the pairs of nets with segments in both leaves """
+    positions_1 = nodes_positions[node_1]
+    positions_2 = nodes_positions[node_2]
+    all_distances = get_distances_numpy(tree.array[node_1.start:node_1.end],
+                                        tree.array[node_2.start:node_2.end])
+    for net_1, net_2 in zip(pairs[0].tolist(), pairs[1].tolist()):
+        rows = positions_1[net_1]
+        columns = positions_2[net_2]
+        distances = all_distances[rows[:, np.newaxis], columns]
+        min_distance = distances.min()
+        if min_distance > best_distances[net_1, net_2]:
+            continue
+        # all the ties, as the lowest indices are kept in the order of the nets
+        block_rows, block_columns = np.nonzero(distances == min_distance)
+        for row, column in zip(block_rows, block_columns):
+            update_best(best, best_distances, net_1, net_2, float(min_distance),
+                        segment_keys[tree.order[node_1.start + rows[row]]][1],
+                        segment_keys[tree.order[node_2.start + columns[column]]][1])
+
+
+def get_layer_clearances(coppers):
+    """
+    get minimum distance and location for every pair of nets on one layer, coppers is a dict net -> NetCopper.
+    Segments of all the nets are put into a single tree, tagged with their net, and the tree is searched
+    against itself once. Node pairs are visited nearest first and each carries the pairs of nets still open
+    within it. A pair is dropped as soon as the bounding boxes of both nets within the nodes are further apart
+    than the best distance found for it. Requires numpy
+    """
+    nets = sorted(net for net in coppers if coppers[net].segments)
+    if len(nets) < 2:
+        return {}
+    segments = []
+    # (net, index of segment within the net) for each segment
+    segment_keys = []
+    for net in nets:
+        segments.extend(coppers[net].segments)
+        segment_keys.extend((net, index) for index in range(len(coppers[net].segments)))
 
-    # if location was not set we assume there are zero tracks on either net
+    tree = SegmentTree(segments, LEAF_SIZE_SHARED)
+    nodes_bounds, nodes_positions = get_nodes_nets(tree, [segment_keys[index][0] for index in tree.order])
+
+    best = {}
+    best_distances = np.full((nets[-1] + 1, nets[-1] + 1), np.inf)
+    # within the same node only pairs with net 1 < net 2 are kept
+    rows, columns = np.triu_indices(len(nets), 1)
+    candidates = (np.array(nets)[rows], np.array(nets)[columns])
+    counter = itertools.count()
+    heap = [(float('-inf'), next(counter), tree.root, tree.root, candidates)]
+    while heap:
+        _, _, node_1, node_2, candidates = heapq.heappop(heap)
+        # pairs could be closed by the results found since the node pair was pushed
+        bound, candidates = get_open_pairs(nodes_bounds[node_1], nodes_bounds[node_2], candidates, best_distances)
+        if bound is None:
+            continue
+        if node_1.children is None and node_2.children is None:
+            get_leaves_clearances(tree, node_1, node_2, candidates, segment_keys, nodes_positions, best, best_distances)
+            continue
+        if node_1 is node_2:
+            child_1, child_2 = node_1.children
+            both_orders = (np.concatenate(candidates), np.concatenate(candidates[::-1]))
+            children = [(child_1, child_1, candidates), (child_1, child_2, both_orders), (child_2, child_2, candidates)]
+        # split the node with more segments
+        elif node_2.children is None or (node_1.children is not None
+                                         and node_1.end - node_1.start >= node_2.end - node_2.start):
+            children = [(child, node_2, candidates) for child in node_1.children]
+        else:
+            children = [(node_1, child, candidates) for child in node_2.children]
+        for child_1, child_2, child_candidates in children:
+            bound, pairs = get_open_pairs(nodes_bounds[child_1], nodes_bounds[child_2], child_candidates,
+                                          best_distances)
+            if bound is not None:
+                heapq.heappush(heap, (bound, next(counter), child_1, child_2, pairs))
+
+    # copper completely within the polygon of the other net, (segments net, polygon net) -> (distance, location)
+    overlaps = {}
+    for polygon_net in nets:
+        for rings, box, width in coppers[polygon_net].polygons:
+            for index in tree.query(box):
+                net = segment_keys[index][0]
+                if net == polygon_net:
+                    continue
+                dis = 0 - segments[index][4] / 2 - width / 2
+                overlap = overlaps.get((net, polygon_net))
+                if overlap is not None and overlap[0] <= dis:
+                    continue
+                loc = get_segment_end_inside(segments[index], rings)
+                if loc is not None:
+                    overlaps[(net, polygon_net)] = (dis, loc)
+
+    clearances = {}
+    for (net_1, net_2), (_, index_1, index_2) in best.items():
+        # distance and location from the reference implementation
+        min_distance, location = get_segments_min_distance_python([coppers[net_1].segments[index_1]],
+                                                                  [coppers[net_2].segments[index_2]])
+        for overlap in (overlaps.get((net_1, net_2)), overlaps.get((net_2, net_1))):
+            if overlap is not None and min_distance > overlap[0]:
+                min_distance, location = overlap
+        clearances[(net_1, net_2)] = (min_distance, location)
+    return clearances
+
+
+def get_layer_clearances_pairwise(coppers):
+    """ same as get_layer_clearances, but with a search for each pair of nets on their own trees """
+    clearances = {}
+    nets = sorted(net for net in coppers if coppers[net].segments)
+    for net_1, net_2 in itertools.combinations(nets, 2):
+        clearances[(net_1, net_2)] = get_copper_min_distance(coppers[net_1], coppers[net_2])
+    return clearances
+
+
+def get_copper_clearance_matrix(nets_copper):
+    """
+    get minimum distance and location for every pair of nets, given as dicts layer -> NetCopper.
+    Returns a dict with keys (index 1, index 2), index 1 < index 2. Pairs without copper
+    on a common layer are left out. With numpy and at least SHARED_TREE_MIN_NETS nets on a layer,
+    copper of all the nets on the layer is searched in one pass over a shared tree, on 64 nets
+    this is about twice as fast as searching each pair. Otherwise the pairs are searched one by one,
+    the tree of each net on each layer is built only once and used for all the pairs with this net.
+    In pure python the shared tree is slower than that at any number of nets
+    """
+    clearances = {}
+    for layer in sorted(set(layer for net_copper in nets_copper for layer in net_copper)):
+        coppers = dict((net, net_copper[layer]) for net, net_copper in enumerate(nets_copper) if layer in net_copper)
+        if HAS_NUMPY and len([net for net in coppers if coppers[net].segments]) >= SHARED_TREE_MIN_NETS:
+            layer_clearances = get_layer_clearances(coppers)
+        else:
+            layer_clearances = get_layer_clearances_pairwise(coppers)
+        for pair, (min_distance, location) in layer_clearances.items():
+            if pair not in clearances or clearances[pair][0] > min_distance:
+                clearances[pair] = (min_distance, location)
+    return clearances
+
+
+def get_min_distance(board, nets):
+    # get nets
+    net1 = nets[0]
+    net2 = nets[1]
+    logger.info("Net2net getting min distance between " + str(net1) + " and " + str(net2))
+
+    # get copper of both nets
+    copper_1, copper_2 = get_net_copper(board, [net1, net2])
+
+    logger.info("Found copper on " + str(len(copper_1)) + " layers on " + str(net1) + " and on "
+                + str(len(copper_2)) + " layers on " + str(net2))
+    # TODO maybe I have to raise an exception if there ar no tracks on either net
+
+    min_distance, location = get_nets_min_distance(copper_1, copper_2)
+
+    # if location was not set we assume there is no copper on either net
     if location is None:
         min_distance = float('Nan')
         location = (float('Nan'), float('Nan'), float('Nan'), float('Nan'))
@@ -153,7 +796,146 @@ def get_min_distance(board, nets):
     return min_distance, location
 
 
+def get_clearance_matrix(board, nets):
+    """
+    get minimum distance and location for every pair of nets,
+    returns a list of (net 1, net 2, distance, location) in the order of nets
+    """
+    logger.info("Net2net getting clearance matrix of " + str(len(nets)) + " nets")
+    nets_copper = get_net_copper(board, nets)
+    clearances = get_copper_clearance_matrix(nets_copper)
+
+    clearance_matrix = []
+    for index_1 in range(len(nets)):
+        for index_2 in range(index_1 + 1, len(nets)):
+            # nets without copper on a common layer
+            min_distance, location = clearances.get((index_1, index_2), (None, None))
+            if location is None:
+                min_distance = float('Nan')
+                location = (float('Nan'), float('Nan'), float('Nan'), float('Nan'))
+            clearance_matrix.append((nets[index_1], nets[index_2], min_distance, location))
+    return clearance_matrix
+
+
+def save_clearance_matrix(filename, clearance_matrix):
+    """ save clearances in mm as comma separated values """
+    if sys.version_info[0] < 3:
+        f = open(filename, 'wb')
+    else:
+        f = open(filename, 'w', newline='')
+    with f:
+        writer = csv.writer(f)
+        writer.writerow(["Net 1", "Net 2", "Clearance [mm]", "X1 [mm]", "Y1 [mm]", "X2 [mm]", "Y2 [mm]"])
+        for net_1, net_2, min_distance, location in clearance_matrix:
+            if sys.version_info[0] < 3:
+                net_1 = net_1.encode('utf-8')
+                net_2 = net_2.encode('utf-8')
+            writer.writerow([net_1, net_2] + ["%.4f" % (value / SCALE) for value in (min_distance,) + tuple(location)])
+
+
+def make_test_segments(nr_segments, offset, seed):
+    """ random walk of nr_segments connected segments, starting at (0, offset) """
+    rnd = random.Random(seed)
+    segments = []
+    x = 0
+    y = offset
+    for _ in range(nr_segments):
+        if rnd.random() < 0.05:
+            # via
+            segments.append((x, y, x, y, 600000))
+            continue
+        new_x = x + rnd.randint(-500000, 1500000)
+        new_y = y + rnd.randint(-1000000, 1000000)
+        segments.append((x, y, new_x, new_y, 250000))
+        x = new_x
+        y = new_y
+    return segments
+
+
+def test_engines():
+    """ compare pruned search with the reference implementation on synthetic nets """
+    for nr_segments in (10, 100, 1000):
+        segments_1 = make_test_segments(nr_segments, 0, 1)
+        segments_2 = make_test_segments(nr_segments, 3000000, 2)
+        start_time = time.time()
+        reference = get_segments_min_distance_python(segments_1, segments_2)
+        python_time = time.time() - start_time
+        start_time = time.time()
+        result = get_segments_min_distance(segments_1, segments_2)
+        pruned_time = time.time() - start_time
+        assert result == reference, repr(result) + " != " + repr(reference)
+        logger.info("%d x %d segments: all pairs %.3f s, pruned %.3f s"
+                    % (nr_segments, nr_segments, python_time, pruned_time))
+
+    for nr_segments in (10000, 50000):
+        segments_1 = make_test_segments(nr_segments, 0, 1)
+        segments_2 = make_test_segments(nr_segments, 3000000, 2)
+        start_time = time.time()
+        get_segments_min_distance(segments_1, segments_2)
+        logger.info("%d x %d segments: pruned %.3f s"
+                    % (nr_segments, nr_segments, time.time() - start_time))
+
+    # short nets starting close to each other cross many times, so a lot of pairs are ties
+    for nr_nets, nr_segments, spacing in ((8, 200, 500000), (64, 200, 500000), (40, 20, 100000)):
+        nets_segments = [make_test_segments(nr_segments, net * spacing, net) for net in range(nr_nets)]
+        nets_segments.append([])
+        start_time = time.time()
+        clearances = get_copper_clearance_matrix([{0: NetCopper(net_segments)} if net_segments else {}
+                                                  for net_segments in nets_segments])
+        matrix_time = time.time() - start_time
+        start_time = time.time()
+        results = dict(((net_1, net_2), get_segments_min_distance(nets_segments[net_1], nets_segments[net_2]))
+                       for net_1, net_2 in itertools.combinations(range(nr_nets), 2))
+        pairwise_time = time.time() - start_time
+        for pair, result in results.items():
+            assert clearances[pair] == result, repr(clearances[pair]) + " != " + repr(result)
+        assert len(clearances) == nr_nets * (nr_nets - 1) // 2
+        logger.info("%d nets with %d segments: matrix %.3f s, pairwise %.3f s"
+                    % (nr_nets, nr_segments, matrix_time, pairwise_time))
+        # shared tree has to pay off on many nets
+        if HAS_NUMPY and nr_nets >= 4 * SHARED_TREE_MIN_NETS:
+            assert matrix_time < pairwise_time, "clearance matrix is not faster than pairwise search"
+
+
+def test_polygons():
+    """ segments within the polygon overlap with it, also when they do not cross its edges """
+    pad = NetCopper()
+    pad.add_polygon([[(0, 0), (1000000, 0), (1000000, 1000000), (0, 1000000)],
+                     [(400000, 400000), (600000, 400000), (600000, 600000), (400000, 600000)]], 0)
+    track = NetCopper([(100000, 500000, 200000, 500000, 100000)])
+    assert get_copper_min_distance(pad, track) == (-50000, (100000, 500000, 100000, 500000))
+    # within the hole
+    track = NetCopper([(450000, 500000, 550000, 500000, 50000)])
+    assert get_copper_min_distance(pad, track)[0] == 25000
+    # only the end is inside
+    track = NetCopper([(-100000, 200000, 50000, 200000, 20000)])
+    assert get_overlap_min_distance(track, pad) == (-10000, (50000, 200000, 50000, 200000))
+    assert get_copper_min_distance(track, pad)[0] == -10000
+    # outside
+    track = NetCopper([(1500000, 500000, 1600000, 500000, 200000)])
+    assert get_copper_min_distance(track, pad)[0] == 400000
+    # clearance matrix on more layers, with the track inside the pad on one of them
+    nets_copper = [{0: pad, 31: NetCopper([(0, 2000000, 1000000, 2000000, 200000)])},
+                   {0: NetCopper([(100000, 500000, 200000, 500000, 100000)])},
+                   {0: NetCopper([(2000000, 0, 2000000, 1000000, 200000)]),
+                    31: NetCopper([(500000, 2500000, 500000, 3000000, 200000)])},
+                   {}]
+    clearances = get_copper_clearance_matrix(nets_copper)
+    assert clearances[(0, 1)] == (-50000, (100000, 500000, 100000, 500000))
+    for net_1, net_2 in itertools.combinations(range(len(nets_copper)), 2):
+        result = get_nets_min_distance(nets_copper[net_1], nets_copper[net_2])
+        assert clearances.get((net_1, net_2), (None, None)) == result, repr((net_1, net_2, result))
+    # few nets are searched pairwise, so also check the shared tree directly
+    if HAS_NUMPY:
+        for layer in (0, 31):
+            coppers = dict((net, net_copper[layer]) for net, net_copper in enumerate(nets_copper) if layer in net_copper)
+            assert get_layer_clearances(coppers) == get_layer_clearances_pairwise(coppers)
+
+
 def main():
+    test_engines()
+    test_polygons()
+
     os.chdir(os.path.join(os.path.dirname(os.path.realpath(__file__)), "net2net_test"))
     logger.info("Testing net2net")
     input_file = 'net2net_test.kicad_pcb'
@@ -58,17 +58,58 @@ class Pad2PadTrackDistanceDialog(pad2pad_track_distance_GUI.Pad2PadTrackDistance
             # wxPython 4
             super(Pad2PadTrackDistanceDialog, self).SetSizeHints(sz1, sz2)
 
-    def __init__(self, parent, all_tracks, selected_tracks, logger):
+    def __init__(self, parent, all_tracks, paths, user_units, logger):
         pad2pad_track_distance_GUI.Pad2PadTrackDistanceGUI.__init__(self, parent)
-        self.Fit()
         self.all_tracks = all_tracks
-        self.selected_tracks = selected_tracks
+        self.paths = paths
+        self.user_units = user_units
+        self.selected_tracks = []
+        self.highlighted = False
         self.logger = logger
 
+        # alternative paths, shortest first, the generated GUI has no control for them
+        if len(paths) > 1:
+            self.choice_path = wx.Choice(self, wx.ID_ANY,
+                                         choices=[u"Path %d: " % (index + 1) + self.format_length(length)
+                                                  for index, (length, _, _) in enumerate(paths)])
+            self.choice_path.SetToolTip(u"Pads are connected through more than one path")
+            self.choice_path.Bind(wx.EVT_CHOICE, self.path_selected)
+            # just before the buttons
+            sizer = self.GetSizer()
+            sizer.Insert(sizer.GetItemCount() - 1, self.choice_path, 0, wx.ALL | wx.EXPAND, 5)
+            self.choice_path.SetSelection(0)
+        self.show_path(0)
+        self.Fit()
+
+    def format_length(self, length):
+        if self.user_units == 'mm':
+            return "%.3f" % length + " mm"
+        return "%.4f" % (length / 25.4) + " in"
+
+    def show_path(self, index):
+        length, resistance, tracks = self.paths[index]
+        self.lbl_length.SetLabelText(self.format_length(length))
+        self.lbl_resistance.SetLabelText("%.4f" % resistance + " Ohm")
+        # move the highlight to the tracks of the shown path
+        if self.highlighted:
+            for track in self.selected_tracks:
+                track.ClearBrightened()
+            for track in tracks:
+                track.SetBrightened()
+            pcbnew.Refresh()
+        self.selected_tracks = tracks
+
+    def path_selected(self, event):
+        index = self.choice_path.GetSelection()
+        self.logger.info("Showing path " + str(index + 1))
+        self.show_path(index)
+        event.Skip()
+
     def highlight_tracks(self, event):
         self.logger.info("Highligting tracks")
         for track in self.selected_tracks:
             track.SetBrightened()
+        self.highlighted = True
         pcbnew.Refresh()
         event.Skip()
 
@@ -180,7 +221,7 @@ class Pad2PadTrackDistance(pcbnew.ActionPlugin):
 
         try:
             measure_distance = pad2pad_track_distance.Distance(board, selected_pads[0], selected_pads[1])
-            distance, resistance = measure_distance.get_length()
+            paths = measure_distance.get_paths()
         except LookupError as error:
             caption = 'Pad2Pad Track Distance'
             message = str(error) 
@@ -202,6 +243,9 @@ class Pad2PadTrackDistance(pcbnew.ActionPlugin):
             logging.shutdown()
             return
 
+        logger.info("Found " + str(len(paths)) + " paths between pads, lengths: "
+                    + ", ".join("%.3f mm" % length for length, _, _ in paths))
+
         # trying to show in layout which tracks are taken into account - so far it does not work
         # as the selection is automatically cleared when exiting action plugin
         # I'll leave this code in just for reference
@@ -212,15 +256,7 @@ class Pad2PadTrackDistance(pcbnew.ActionPlugin):
         all_tracks = board.GetTracks()
 
         logger.info("Showing GUI")
-        dlg = Pad2PadTrackDistanceDialog(_pcbnew_frame, all_tracks, measure_distance.track_list[0][1:-1], logger)
-
-        if user_units == 'mm':
-            dlg.lbl_length.SetLabelText("%.3f" % (distance) + " mm")
-            dlg.lbl_resistance.SetLabelText("%.4f" % resistance + " Ohm")
-        else:
-            dlg.lbl_length.SetLabelText("%.4f" % (distance/25.4) + " in")
-            dlg.lbl_resistance.SetLabelText("%.4f" % resistance + " Ohm")
-
+        dlg = Pad2PadTrackDistanceDialog(_pcbnew_frame, all_tracks, paths, user_units, logger)
         dlg.Show()
 
 
@@ -24,12 +24,30 @@
 import pcbnew
 import os
 import sys
+import math
+import heapq
+import shutil
+import tempfile
+import csv
+import json
 import logging
+import argparse
+import itertools
+from collections import defaultdict, namedtuple
 
 SCALE = 1000000.0
+# track ends, vias and pads closer than this (in nm) are considered connected
+SNAP_TOLERANCE = 1000
+# number of alternative paths offered between two pads
+MAX_PATHS = 10
 
 logger = logging.getLogger(__name__)
 
+# result of measuring one pair of pads, length is in mm
+PairLength = namedtuple('PairLength', ['pad1', 'pad2', 'net', 'length', 'resistance', 'tracks'])
+# keys of the saved pad pairs in .json files, same order as the columns of .csv files
+PAD_PAIRS_KEYS = ["pad1_reference", "pad1", "pad2_reference", "pad2", "net", "length", "resistance"]
+
 # get version information
 version_filename = os.path.join(os.path.dirname(os.path.realpath(__file__)), "version.txt")
 with open(version_filename) as f:
@@ -42,15 +60,241 @@ else:
     BUILD_VERSION = "Unknown"
 
 
+def get_point(point):
+    """ wxPoint is not hashable """
+    return point.x, point.y
+
+
+def get_pad_layer(pad):
+    """ layer on which tracks connect to the pad """
+    # if THT
+    if pad.GetAttribute() == 0:
+        return 'Any'
+    if pad.GetParent().IsFlipped():
+        return pcbnew.B_Cu
+    return pcbnew.F_Cu
+
+
+def get_track_resistance(track):
+    """ DC resistance of 35 um thick copper track """
+    return track.GetLength()/SCALE * (0.0000000168*1000) / (0.035 * track.GetWidth()/SCALE)
+
+
+class EndpointIndex:
+    """
+    index of track and via endpoints. Points closer than tolerance (in nm) to an already
+    known point are snapped to it, only the neighbouring cells of the grid are searched
+    """
+    def __init__(self, tolerance=0):
+        self.tolerance = tolerance
+        self.cell_size = tolerance + 1
+        # grid cell -> known points within it
+        self.cells = defaultdict(list)
+        # known point -> tracks and vias ending at it
+        self.tracks_at_point = defaultdict(list)
+
+    def find(self, point):
+        """ get the known point within tolerance or the point itself """
+        if not self.tolerance:
+            return point
+        x, y = point
+        cell_x = x // self.cell_size
+        cell_y = y // self.cell_size
+        for near_x in (cell_x - 1, cell_x, cell_x + 1):
+            for near_y in (cell_y - 1, cell_y, cell_y + 1):
+                for known_point in self.cells.get((near_x, near_y), ()):
+                    if math.hypot(known_point[0] - x, known_point[1] - y) <= self.tolerance:
+                        return known_point
+        return point
+
+    def add(self, point, track):
+        """ add endpoint of a track, returns the point it was snapped to """
+        snapped_point = self.find(point)
+        if snapped_point not in self.tracks_at_point and self.tolerance:
+            self.cells[(point[0] // self.cell_size, point[1] // self.cell_size)].append(point)
+        self.tracks_at_point[snapped_point].append(track)
+        return snapped_point
+
+
+class NetGraph:
+    """
+    connectivity graph of all tracks on one net. Nodes are (point, layer),
+    tracks connect nodes on their layer and vias connect (point, 'Any') with their layers.
+    Points are snapped with the endpoint index, so ends within tolerance are connected
+    """
+    def __init__(self, tracks, tolerance=0):
+        self.endpoints = EndpointIndex(tolerance)
+        # node -> list of (neighbour node, edge index)
+        self.edges = defaultdict(list)
+        # length in mm and track of each edge
+        self.edge_lengths = []
+        self.edge_tracks = []
+        self.layers_at_point = defaultdict(set)
+        self.vias_at_point = defaultdict(list)
+
+        vias = []
+        for track in tracks:
+            if track.GetClass() == "VIA":
+                vias.append(track)
+                continue
+            layer = track.GetLayer()
+            start = self.endpoints.add(get_point(track.GetStart()), track)
+            end = self.endpoints.add(get_point(track.GetEnd()), track)
+            self.add_edge((start, layer), (end, layer), track.GetLength()/SCALE, track)
+            self.layers_at_point[start].add(layer)
+            self.layers_at_point[end].add(layer)
+
+        for via in vias:
+            point = self.endpoints.add(get_point(via.GetPosition()), via)
+            self.vias_at_point[point].append(via)
+            for layer in self.layers_at_point[point]:
+                if via.IsOnLayer(layer):
+                    self.add_edge((point, 'Any'), (point, layer), 0.0, via)
+
+    def add_edge(self, node_1, node_2, length, track):
+        edge = len(self.edge_lengths)
+        self.edge_lengths.append(length)
+        self.edge_tracks.append(track)
+        self.edges[node_1].append((node_2, edge))
+        self.edges[node_2].append((node_1, edge))
+
+    def get_pad_nodes(self, point, layer):
+        """ nodes through which the tracks connect to the pad at point """
+        point = self.endpoints.find(get_point(point))
+        if layer == 'Any':
+            nodes = [(point, track_layer) for track_layer in sorted(self.layers_at_point[point])]
+        else:
+            nodes = [(point, layer)]
+        # via in pad
+        if any(layer == 'Any' or via.IsOnLayer(layer) for via in self.vias_at_point[point]):
+            nodes.append((point, 'Any'))
+        return nodes
+
+    def find_path(self, start_nodes, end_nodes, excluded_nodes=frozenset(), excluded_edges=frozenset()):
+        """
+        Dijkstra from any of start nodes to the nearest of end nodes, avoiding excluded nodes and edges.
+        Returns (length, nodes, edges) or None
+        """
+        end_nodes = set(end_nodes)
+        visited = set()
+        previous = {}
+        counter = itertools.count()
+        heap = [(0.0, next(counter), node, None, None) for node in start_nodes if node not in excluded_nodes]
+        heapq.heapify(heap)
+        while heap:
+            length, _, node, previous_node, edge = heapq.heappop(heap)
+            if node in visited:
+                continue
+            visited.add(node)
+            previous[node] = (previous_node, edge)
+            if node in end_nodes:
+                nodes, edges = self.get_path(previous, node)
+                return length, nodes, edges
+            for neighbour, edge in self.edges.get(node, ()):
+                if neighbour not in visited and neighbour not in excluded_nodes and edge not in excluded_edges:
+                    heapq.heappush(heap, (length + self.edge_lengths[edge], next(counter), neighbour, node, edge))
+        return None
+
+    def get_shortest_paths(self, start_nodes):
+        """
+        Dijkstra from any of start nodes to all reachable nodes.
+        Returns lengths of shortest paths and predecessor (node, edge) of each node
+        """
+        lengths = {}
+        previous = {}
+        counter = itertools.count()
+        heap = [(0.0, next(counter), node, None, None) for node in start_nodes]
+        heapq.heapify(heap)
+        while heap:
+            length, _, node, previous_node, edge = heapq.heappop(heap)
+            if node in lengths:
+                continue
+            lengths[node] = length
+            previous[node] = (previous_node, edge)
+            for neighbour, edge in self.edges.get(node, ()):
+                if neighbour not in lengths:
+                    heapq.heappush(heap, (length + self.edge_lengths[edge], next(counter), neighbour, node, edge))
+        return lengths, previous
+
+    @staticmethod
+    def get_path(previous, node):
+        """ follow the predecessors from node back to the start, returns (nodes, edges) """
+        nodes = [node]
+        edges = []
+        previous_node, edge = previous[node]
+        while previous_node is not None:
+            nodes.append(previous_node)
+            edges.append(edge)
+            previous_node, edge = previous[previous_node]
+        nodes.reverse()
+        edges.reverse()
+        return nodes, edges
+
+    def get_shortest_path(self, start_nodes, end_nodes):
+        """ shortest path from any of start nodes to the nearest of end nodes, returns (length, tracks) or None """
+        result = self.find_path(start_nodes, end_nodes)
+        if result is None:
+            return None
+        length, _, edges = result
+        return length, [self.edge_tracks[edge] for edge in edges]
+
+    def get_paths(self, start_nodes, end_nodes, k=None, max_length=None):
+        """
+        Yen's k shortest loopless paths, in the order of their length. Returns a list of (length, tracks)
+        with at most k paths (all if k is None) not longer than max_length (any length if None)
+        """
+        if k is None and max_length is None:
+            raise ValueError("Number of paths or max length has to be set")
+        # paths are (length, nodes, edges), nodes start with virtual "pad1" node which is connected
+        # to all start nodes by virtual ("pad1", start node) edges
+        paths = []
+        candidates = []
+        found = set()
+        counter = itertools.count()
+
+        def add_candidate(start, nodes, edges):
+            length = sum(self.edge_lengths[edge] for edge in edges if not isinstance(edge, tuple))
+            if (max_length is not None and length > max_length) or tuple(edges) in found:
+                return
+            found.add(tuple(edges))
+            heapq.heappush(candidates, (length, next(counter), ["pad1"] + nodes, [("pad1", start)] + edges))
+
+        result = self.find_path(start_nodes, end_nodes)
+        if result is not None:
+            add_candidate(result[1][0], result[1], result[2])
+        while candidates and (k is None or len(paths) < k):
+            length, _, nodes, edges = heapq.heappop(candidates)
+            paths.append((length, nodes, edges))
+            # deviate from the last path at each of its nodes
+            for index in range(len(nodes) - 1):
+                spur_node = nodes[index]
+                root_nodes = nodes[:index + 1]
+                root_edges = edges[:index]
+                excluded_edges = set(p_edges[index] for _, p_nodes, p_edges in paths
+                                     if p_nodes[:index + 1] == root_nodes)
+                if spur_node == "pad1":
+                    spur_starts = [node for node in start_nodes if ("pad1", node) not in excluded_edges]
+                else:
+                    spur_starts = [spur_node]
+                spur = self.find_path(spur_starts, end_nodes, set(root_nodes[1:-1]), excluded_edges)
+                if spur is None:
+                    continue
+                _, spur_nodes, spur_edges = spur
+                if spur_node == "pad1":
+                    add_candidate(spur_nodes[0], spur_nodes, spur_edges)
+                else:
+                    add_candidate(root_edges[0][1], root_nodes[1:] + spur_nodes[1:], root_edges[1:] + spur_edges)
+
+        return [(length, [self.edge_tracks[edge] for edge in edges[1:]]) for length, _, edges in paths]
+
+
 class Distance:
-    def __init__(self, board, pad1, pad2):
+    def __init__(self, board, pad1, pad2, tolerance=SNAP_TOLERANCE):
 
         self.board = board
 
-        self.track_list = []
-
-        # get list of all selected pads
-        selected_pads = [pad1, pad2]
+        # tracks of the shortest path found
+        self.path = []
 
         # get the net the pins are on
         net = pad1.GetNetname()
@@ -58,130 +302,201 @@ class Distance:
         # find all tracks on the net
         netcode = self.board.GetNetcodeFromNetname(net)
         self.tracks_on_net = self.board.TracksInNet(netcode)
+        self.graph = NetGraph(self.tracks_on_net, tolerance)
 
         # starting point and layer
-        self.start_point = selected_pads[0].GetPosition()
-        # if THT
-        if selected_pads[0].GetAttribute() == 0:
-            self.start_layer = 'Any'
-        else:
-            if selected_pads[0].GetParent().IsFlipped():
-                self.start_layer = pcbnew.B_Cu
-            else:
-                self.start_layer = pcbnew.F_Cu
-
-        self.end_point = selected_pads[1].GetPosition()
-        # if THT
-        if selected_pads[1].GetAttribute() == 0:
-            self.end_layer = 'Any'
-        else:
-            if selected_pads[1].GetParent().IsFlipped():
-                self.end_layer = pcbnew.B_Cu
-            else:
-                self.end_layer = pcbnew.F_Cu
+        self.start_point = pad1.GetPosition()
+        self.start_layer = get_pad_layer(pad1)
+
+        self.end_point = pad2.GetPosition()
+        self.end_layer = get_pad_layer(pad2)
 
     def get_length(self):
-        # current point and layer
-
-        length = self.get_new_endpoints(self.start_point, self.start_layer, 0, self.tracks_on_net, 0, ["pad1"])
-
-        length_alt = []
-        resistance = []
-        # caluclate again
-        size = len(self.track_list)
-        for i in range(size):
-            length_alt.append(0)
-            resistance.append(0)
-            for track in self.track_list[i][1:-1]:
-                length_alt[i] = length_alt[i] + pcbnew.ToMM(track.GetLength())
-                track_res = track.GetLength()/SCALE * (0.0000000168*1000) / (0.035 * track.GetWidth()/SCALE)
-                resistance[i] = resistance[i] + track_res
+        """ get length in mm and resistance of the shortest path between pads """
+        result = self.graph.get_shortest_path(self.graph.get_pad_nodes(self.start_point, self.start_layer),
+                                              self.graph.get_pad_nodes(self.end_point, self.end_layer))
 
         # if connection vas not found, raise an exception
-        if not length_alt:
+        if result is None:
             raise LookupError("Did not find a connection between pads\nThe connection might be partial or through the zone.")
 
-        # find minimum and get only that track list
-        min_length = min(length_alt)
-        min_res = min(resistance)
-        index = length_alt.index(min_length)
-
-        # go through the list and find minimum
-        min_length = min(length)
-
-        return min_length, min_res
-
-    def get_new_endpoints(self, point, layer, track_length, track_list, level, tl):
-        ret_len = []
-        index = 0
-        tracks_to_do = len(track_list)
-        # find track at this endpoint
-        for track in track_list:
-            tr_list = list(tl)
-            new_point = None
-            # if via, swap layer
-            if track.GetClass() == "VIA":
-                tr_list.append(track)
-                new_layer = "Any"
-                via_point = track.GetPosition()
-                if via_point == point:
-                    new_point = point
-                    # remove current track from list so that we don't iterate over it
-                    new_track_list = list(track_list)
-                    new_track_list.remove(track)
-                    new_track_length = track_length
-            else:
-                point1 = track.GetStart()
-                point2 = track.GetEnd()
-                track_layer = track.GetLayer()
-
-                # if on same layer and start at the same point
-                # TODO - maybe use track.GetTrack method or track.HitTest(point)
-                # TODO - if using hittest, split the tracks if needed
-                # todo - add tracks used in calculation to a list
-                # todo - select all used tracks and deselect pads (in action plugin only)
-                # todo - calculate dc resistance for 35um copper
-                # todo - calculate inductance of a trace only
-                if (track_layer == layer or layer == "Any") and (point1 == point or point2 == point):
-                    if point1 == point:
-                        new_point = point2
-                    if point2 == point:
-                        new_point = point1
-
-                    tr_list.append(track)
-
-                    # remove current track from list so that we don't iterate over it
-                    new_track_list = list(track_list)
-                    new_track_list.remove(track)
-                    new_layer = track.GetLayer()
-
-                    new_track_length = track_length + track.GetLength()/SCALE
-
-                    # check if we arrived to pad2
-                    if new_point == self.end_point and (new_layer == self.end_layer or self.end_layer == 'Any'):
-                        new_point = None
-                        new_layer = None
-                        tr_list.append("pad2")
-                        self.track_list.append(tr_list)
-                        # add to list
-                        if len(ret_len) == 0:
-                            ret_len = [new_track_length]
-                        elif len(ret_len) <= (index + 1):
-                            ret_len[index] = new_track_length
-                        else:
-                            ret_len.append(new_track_length)
-                        index = index + 1
-                # if there is no track at this point this is a blind end
-                else:
-                    new_point = None
-                    new_layer = None
-            # ce se nismo na koncu, potem grem naprej
-            if new_point is not None:
-                delta_len = self.get_new_endpoints(new_point, new_layer, new_track_length, new_track_list, level + 1, tr_list)
-                if any(delta_len):
-                    ret_len[index:index] = delta_len
-                    pass
-        return ret_len
+        length, self.path = result
+        resistance = sum(get_track_resistance(track) for track in self.path)
+        return length, resistance
+
+    def get_paths(self, k=MAX_PATHS, max_length=None):
+        """
+        get distinct paths between pads, shortest first, at most k paths (all if None)
+        not longer than max_length in mm. Returns a list of (length, resistance, tracks)
+        """
+        paths = self.graph.get_paths(self.graph.get_pad_nodes(self.start_point, self.start_layer),
+                                     self.graph.get_pad_nodes(self.end_point, self.end_layer),
+                                     k, max_length)
+        if not paths:
+            raise LookupError("Did not find a connection between pads\nThe connection might be partial or through the zone.")
+
+        self.path = paths[0][1]
+        return [(length, sum(get_track_resistance(track) for track in tracks), tracks) for length, tracks in paths]
+
+
+def get_pad_name(pad):
+    return pad.GetParent().GetReference() + "/" + pad.GetName()
+
+
+def get_pad_pairs_lengths(board, pad_pairs, tolerance=SNAP_TOLERANCE):
+    """
+    measure shortest track length between many pairs of pads. Graph of each net is built only once
+    and shortest paths to all pads are found with one Dijkstra run from each distinct start pad.
+    Returns a list of PairLength in the order of pad pairs, length is None if pads are not connected
+    """
+    pairs_by_net = defaultdict(list)
+    for index, (pad1, pad2) in enumerate(pad_pairs):
+        if pad1.GetNetname() != pad2.GetNetname():
+            raise LookupError("Pads " + get_pad_name(pad1) + " and " + get_pad_name(pad2) + " are not on the same net")
+        pairs_by_net[pad1.GetNetname()].append(index)
+
+    results = [None] * len(pad_pairs)
+    for net, indices in pairs_by_net.items():
+        graph = NetGraph(board.TracksInNet(board.GetNetcodeFromNetname(net)), tolerance)
+        # pairs with the same start pad share single source shortest paths
+        pairs_by_start = defaultdict(list)
+        for index in indices:
+            pad1 = pad_pairs[index][0]
+            start_nodes = tuple(graph.get_pad_nodes(pad1.GetPosition(), get_pad_layer(pad1)))
+            pairs_by_start[start_nodes].append(index)
+        logger.info("Measuring " + str(len(indices)) + " pad pairs from " + str(len(pairs_by_start))
+                    + " start pads on net " + net)
+
+        for start_nodes, start_indices in pairs_by_start.items():
+            lengths, previous = graph.get_shortest_paths(start_nodes)
+            for index in start_indices:
+                pad1, pad2 = pad_pairs[index]
+                end_nodes = [node for node in graph.get_pad_nodes(pad2.GetPosition(), get_pad_layer(pad2))
+                             if node in lengths]
+                if not end_nodes:
+                    results[index] = PairLength(pad1, pad2, net, None, None, [])
+                    continue
+                end_node = min(end_nodes, key=lambda node: lengths[node])
+                tracks = [graph.edge_tracks[edge] for edge in graph.get_path(previous, end_node)[1]]
+                resistance = sum(get_track_resistance(track) for track in tracks)
+                results[index] = PairLength(pad1, pad2, net, lengths[end_node], resistance, tracks)
+    return results
+
+
+def save_pad_pairs_lengths(filename, results):
+    """
+    save lengths in mm and resistances to .json file, or as comma separated values to any other file
+    or to stdout if filename is None
+    """
+    rows = []
+    for result in results:
+        rows.append([result.pad1.GetParent().GetReference(), result.pad1.GetName(),
+                     result.pad2.GetParent().GetReference(), result.pad2.GetName(),
+                     result.net, result.length, result.resistance])
+
+    if filename is not None and filename.lower().endswith('.json'):
+        with open(filename, 'w') as f:
+            json.dump([dict(zip(PAD_PAIRS_KEYS, row)) for row in rows], f, indent=2)
+        return
+
+    if filename is None:
+        f = sys.stdout
+    elif sys.version_info[0] < 3:
+        f = open(filename, 'wb')
+    else:
+        f = open(filename, 'w', newline='')
+    try:
+        writer = csv.writer(f)
+        writer.writerow(["Pad 1 reference", "Pad 1", "Pad 2 reference", "Pad 2", "Net",
+                         "Length [mm]", "Resistance [Ohm]"])
+        for row in rows:
+            # not connected pads have empty length and resistance
+            row[5:] = ["" if value is None else value_format % value
+                       for value, value_format in zip(row[5:], ("%.4f", "%.6f"))]
+            if sys.version_info[0] < 3:
+                row = [value.encode('utf-8') for value in row]
+            writer.writerow(row)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+
+def load_pad_pairs_lengths(filename):
+    """
+    load pad pairs saved by save_pad_pairs_lengths, returns a list of dicts with the .json keys.
+    Length and resistance are None for not connected pads
+    """
+    if filename.lower().endswith('.json'):
+        with open(filename, 'r') as f:
+            return json.load(f)
+
+    if sys.version_info[0] < 3:
+        f = open(filename, 'rb')
+    else:
+        f = open(filename, 'r', newline='')
+    with f:
+        reader = csv.reader(f)
+        next(reader)
+        rows = []
+        for row in reader:
+            if sys.version_info[0] < 3:
+                row = [value.decode('utf-8') for value in row]
+            row[5:] = [float(value) if value else None for value in row[5:]]
+            rows.append(dict(zip(PAD_PAIRS_KEYS, row)))
+    return rows
+
+
+def find_pad(board, reference, name):
+    # V5.99 forward compatibility
+    if hasattr(board, 'FindFootprintByReference'):
+        module = board.FindFootprintByReference(reference)
+    else:
+        module = board.FindModuleByReference(reference)
+    if module is None:
+        raise LookupError("Footprint " + reference + " is not on the board")
+    pad = module.FindPadByName(name)
+    if pad is None:
+        raise LookupError("Footprint " + reference + " has no pad " + name)
+    return pad
+
+
+def measure_pad_pairs(argv=None):
+    """
+    command line entry point, measures pad pairs given as REF/PAD REF/PAD or listed in a file
+    saved by save_pad_pairs_lengths. Exit code is 1 when any of the pairs is not connected
+    """
+    parser = argparse.ArgumentParser(description="Measure track length between pairs of pads on a KiCad board")
+    parser.add_argument("board", help=".kicad_pcb file")
+    parser.add_argument("-p", "--pair", nargs=2, action="append", default=[], metavar=("REF/PAD", "REF/PAD"),
+                        help="pair of pads, can be given multiple times")
+    parser.add_argument("-i", "--input", help=".json or .csv file with pad pairs, as saved with -o")
+    parser.add_argument("-o", "--output", help=".json or .csv file, comma separated values to stdout if omitted")
+    args = parser.parse_args(argv)
+
+    pairs = []
+    for pad1, pad2 in args.pair:
+        if "/" not in pad1 or "/" not in pad2:
+            parser.error("pads have to be given as REF/PAD")
+        pairs.append(tuple(pad1.split("/", 1)) + tuple(pad2.split("/", 1)))
+    try:
+        if args.input:
+            pairs.extend((row["pad1_reference"], row["pad1"], row["pad2_reference"], row["pad2"])
+                         for row in load_pad_pairs_lengths(args.input))
+        if not pairs:
+            parser.error("no pad pairs given")
+
+        board = pcbnew.LoadBoard(args.board)
+        pad_pairs = [(find_pad(board, ref1, name1), find_pad(board, ref2, name2))
+                     for ref1, name1, ref2, name2 in pairs]
+        results = get_pad_pairs_lengths(board, pad_pairs)
+    except (LookupError, IOError, OSError, ValueError, KeyError) as error:
+        logger.error(str(error))
+        return 2
+
+    save_pad_pairs_lengths(args.output, results)
+    if any(result.length is None for result in results):
+        return 1
+    return 0
 
 
 def test(board, pad1, pad2):
@@ -227,6 +542,52 @@ def main():
     dist, res = test(board, pad1, pad2)
     assert(-0.1 < (dist-18.58) < +0.1)
 
+    # all paths up to 25 mm
+    paths = Distance(board, pad1, pad2).get_paths(k=None, max_length=25.0)
+    assert(len(paths) == 2)
+    assert(-0.1 < (paths[0][0]-18.58) < +0.1)
+    assert(-0.1 < (paths[1][0]-19.269) < +0.1)
+
+    # as offered by the action plugin, shortest one first
+    paths = Distance(board, pad1, pad2).get_paths()
+    assert(2 <= len(paths) <= MAX_PATHS)
+    assert([path[0] for path in paths] == sorted(path[0] for path in paths))
+    assert(abs(paths[0][0] - dist) < 1e-9 and abs(paths[0][1] - res) < 1e-9)
+    assert(len(set(tuple(id(track) for track in path[2]) for path in paths)) == len(paths))
+    logger.info("Paths between U1/48 and J2/2: " + ", ".join("%.3f mm" % path[0] for path in paths))
+
+    # all the pairs at once
+    pad_pairs = [(board.FindModuleByReference(ref1).FindPadByName(name1),
+                  board.FindModuleByReference(ref2).FindPadByName(name2))
+                 for ref1, name1, ref2, name2 in [("R2", "2", "R3", "1"), ("U3", "8", "U1", "15"),
+                                                  ("U6", "8", "U1", "7"), ("U1", "48", "J2", "2")]]
+    results = get_pad_pairs_lengths(board, pad_pairs)
+    lengths = [x.length for x in results]
+    expected = [4.767, 19.833, 16.124, 18.58]
+    assert(all(-0.1 < (length - expected_length) < +0.1 for length, expected_length in zip(lengths, expected)))
+
+    # saved lengths load back the same, pairs can be measured again from the saved file
+    test_dir = tempfile.mkdtemp()
+    try:
+        for extension in (".csv", ".json"):
+            filename = os.path.join(test_dir, "pad_pairs" + extension)
+            save_pad_pairs_lengths(filename, results)
+            rows = load_pad_pairs_lengths(filename)
+            assert([(row["pad1_reference"], row["pad1"], row["pad2_reference"], row["pad2"]) for row in rows]
+                   == [("R2", "2", "R3", "1"), ("U3", "8", "U1", "15"), ("U6", "8", "U1", "7"), ("U1", "48", "J2", "2")])
+            assert([row["net"] for row in rows] == [x.net for x in results])
+            assert(all(abs(row["length"] - x.length) < 1e-4 and abs(row["resistance"] - x.resistance) < 1e-6
+                       for row, x in zip(rows, results)))
+
+            output_filename = os.path.join(test_dir, "measured" + extension)
+            assert(measure_pad_pairs(['En_mostic_test.kicad_pcb', '-i', filename, '-o', output_filename]) == 0)
+            assert(load_pad_pairs_lengths(output_filename) == rows)
+        assert(measure_pad_pairs(['En_mostic_test.kicad_pcb', '-p', 'R2/2', 'R3/1',
+                                  '-o', os.path.join(test_dir, "pair.csv")]) == 0)
+        assert(measure_pad_pairs(['En_mostic_test.kicad_pcb', '-p', 'R2/2', 'R99/1']) == 2)
+    finally:
+        shutil.rmtree(test_dir)
+
     # test_board == "medium2":
     module_1 = board.FindModuleByReference("U4")
     pad1 = module_1.FindPadByName("7")
@@ -257,6 +618,11 @@ def main():
 
 # for testing purposes only
 if __name__ == "__main__":
+    # or measuring pad pairs from command line
+    if sys.argv[1:]:
+        logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler(sys.stderr)])
+        sys.exit(measure_pad_pairs())
+
     # if debugging outside of this folder change the folder
     os.chdir(os.path.dirname(os.path.realpath(__file__)))
 
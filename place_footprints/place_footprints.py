@@ -21,7 +21,7 @@
 #
 from __future__ import absolute_import, division, print_function
 import pcbnew
-from collections import namedtuple
+from collections import namedtuple, defaultdict
 import os
 import sys
 import logging
@@ -32,8 +32,10 @@ import re
 parent_module = sys.modules['.'.join(__name__.split('.')[:-1]) or '__main__']
 if __name__ == '__main__' or parent_module.__name__ == '__main__':
     import compare_boards
+    import sch_hierarchy
 else:
     from . import compare_boards
+    from . import sch_hierarchy
 
 # get version information
 version_filename = os.path.join(os.path.dirname(os.path.realpath(__file__)), "version.txt")
@@ -106,70 +108,6 @@ def get_index_of_tuple(list_of_tuples, index, value):
 
 
 class Placer():
-    @staticmethod
-    def extract_subsheets(filename):
-        with open(filename, 'rb') as f:
-            file_folder = os.path.dirname(os.path.abspath(filename))
-            file_lines = f.read().decode('utf-8')
-        # alternative solution
-        # extract all sheet references
-        sheet_indices = [m.start() for m in re.finditer('\$Sheet', file_lines)]
-        endsheet_indices = [m.start() for m in re.finditer('\$EndSheet', file_lines)]
-
-        if len(sheet_indices) != len(endsheet_indices):
-            raise LookupError("Schematic page contains errors")
-
-        sheet_locations = zip(sheet_indices, endsheet_indices)
-        for sheet_location in sheet_locations:
-            sheet_reference = file_lines[sheet_location[0]:sheet_location[1]].split('\n')
-            # parse the sheed description
-            for line in sheet_reference:
-                # found sheet ID
-                if line.startswith('U '):
-                    subsheet_id = line.split()[1]
-                # found sheet name
-                if line.startswith('F0 '):
-                    # remove the first field ("F0 ")
-                    partial_line = line.lstrip("F0 ")
-                    partial_line = " ".join(partial_line.split()[:-1])
-                    # remove the last field (text size)
-                    subsheet_name = partial_line.rstrip("\"").lstrip("\"")
-                # found sheet filename
-                if line.startswith('F1 '):
-                    subsheet_path = re.findall("\s\"(.*.sch)\"\s", line)[0]
-                    subsheet_line = file_lines.split("\n").index(line)
-                    if not os.path.isabs(subsheet_path):
-                        # check if path is encoded with variables
-                        if "${" in subsheet_path:
-                            start_index = subsheet_path.find("${") + 2
-                            end_index = subsheet_path.find("}")
-                            env_var = subsheet_path[start_index:end_index]
-                            path = os.getenv(env_var)
-                            # if variable is not defined rasie an exception
-                            if path is None:
-                                raise LookupError("Can not find subsheet: " + subsheet_path)
-                            # replace variable with full path
-                            subsheet_path = subsheet_path.replace("${", "") \
-                                .replace("}", "") \
-                                .replace("env_var", path)
-
-                    # if path is still not absolute, then it is relative to project
-                    if not os.path.isabs(subsheet_path):
-                        subsheet_path = os.path.join(file_folder, subsheet_path)
-
-                    subsheet_path = os.path.normpath(subsheet_path)
-                    # found subsheet reference go for the next one, no need to parse further
-                    break
-
-            file_path = os.path.abspath(subsheet_path)
-            yield file_path, subsheet_id, subsheet_name
-
-    def find_all_sch_files(self, filename, dict_of_sheets):
-        for file_path, subsheet_id, subsheet_name in self.extract_subsheets(filename):
-            dict_of_sheets[subsheet_id] = [subsheet_name, file_path]
-            dict_of_sheets = self.find_all_sch_files(file_path, dict_of_sheets)
-        return dict_of_sheets
-
     @staticmethod
     def get_module_id(module):
         """ get module id """
@@ -180,17 +118,47 @@ class Placer():
     def get_sheet_id(self, module):
         """ get sheet id """
         module_path = get_path(module).split('/')
-        sheet_id = module_path[0:-1]
+        return self.get_sheet_id_from_path(module_path[0:-1])
+
+    def get_sheet_id_from_path(self, sheet_id):
+        """ get sheet names and sheet files from the list of sheet ids """
         sheet_names = [self.dict_of_sheets[x][0] for x in sheet_id if x]
         sheet_files = [self.dict_of_sheets[x][1] for x in sheet_id if x]
         sheet_id = [sheet_names, sheet_files]
         return sheet_id
 
+    def get_board_modules(self, board):
+        """ construct a list of modules, parsing each footprint path only once """
+        modules = []
+        # footprints on the same sheet share the same lists of sheet names and files
+        sheet_ids = {}
+        for module in board.GetModules():
+            module_path = get_path(module).split('/')
+            sheet_path = tuple(module_path[0:-1])
+            if sheet_path not in sheet_ids:
+                sheet_ids[sheet_path] = self.get_sheet_id_from_path(sheet_path)
+            sheet_names, sheet_files = sheet_ids[sheet_path]
+            modules.append(Module(mod=module,
+                                  mod_id=module_path[-1],
+                                  sheet_id=sheet_names,
+                                  filename=sheet_files,
+                                  ref=module.GetReference()))
+        return modules
+
+    def index_modules(self):
+        """ build lookup tables by reference, by module id and by every sheet path prefix """
+        self.modules_by_ref = {}
+        self.modules_by_id = defaultdict(list)
+        self.modules_by_sheet = defaultdict(list)
+        for mod in self.modules:
+            # get_mod_by_ref returns the first footprint with this reference
+            self.modules_by_ref.setdefault(mod.ref, mod)
+            self.modules_by_id[mod.mod_id].append(mod)
+            for depth in range(len(mod.sheet_id) + 1):
+                self.modules_by_sheet[tuple(mod.sheet_id[0:depth])].append(mod)
+
     def get_mod_by_ref(self, ref):
-        for m in self.modules:
-            if m.ref == ref:
-                return m
-        return None
+        return self.modules_by_ref.get(ref)
 
     def get_modules_with_reference_designator(self, ref_des):
         list_of_modules = []
@@ -211,7 +179,7 @@ class Placer():
 
         # get relation between sheetname and it's id
         logger.info('getting project hierarchy from schematics')
-        self.dict_of_sheets = self.find_all_sch_files(self.sch_filename, {})
+        self.dict_of_sheets = sch_hierarchy.get_dict_of_sheets(self.sch_filename)
 
         # make all paths relative
         for x in self.dict_of_sheets.keys():
@@ -220,25 +188,11 @@ class Placer():
 
         # construct a list of modules with all pertinent data
         logger.info('getting a list of all footprints on board')
-        bmod = board.GetModules()
-        self.modules = []
-        mod_dict = {}
-        for module in bmod:
-            mod_named_tuple = Module(mod=module,
-                                     mod_id=self.get_module_id(module),
-                                     sheet_id=self.get_sheet_id(module)[0],
-                                     filename=self.get_sheet_id(module)[1],
-                                     ref=module.GetReference())
-            mod_dict[module.GetReference()] = mod_named_tuple
-            self.modules.append(mod_named_tuple)
-        pass
+        self.modules = self.get_board_modules(board)
+        self.index_modules()
 
     def get_list_of_modules_with_same_id(self, id):
-        list_of_modules = []
-        for m in self.modules:
-            if m.mod_id == id:
-                list_of_modules.append(m)
-        return list_of_modules
+        return list(self.modules_by_id.get(id, []))
 
     def get_sheets_to_replicate(self, mod, level):
         sheet_id = mod.sheet_id
@@ -282,21 +236,11 @@ class Placer():
         return all_sheets
 
     def get_modules_on_sheet(self, level):
-        modules_on_sheet = []
-        level_depth = len(level)
-        for mod in self.modules:
-            if level == mod.sheet_id[0:level_depth]:
-                modules_on_sheet.append(mod)
-        return modules_on_sheet
+        return list(self.modules_by_sheet.get(tuple(level), []))
 
     def get_modules_not_on_sheet(self, level):
-        modules_not_on_sheet = []
-        level_depth = len(level)
-        for mod in self.modules:
-            a1 = mod.sheet_id[0:level_depth]
-            if level != mod.sheet_id[0:level_depth]:
-                modules_not_on_sheet.append(mod)
-        return modules_not_on_sheet
+        modules_on_sheet = set(id(mod) for mod in self.modules_by_sheet.get(tuple(level), []))
+        return [mod for mod in self.modules if id(mod) not in modules_on_sheet]
 
     def get_modules_bounding_box(self, modules):
         # get the pivot bounding box
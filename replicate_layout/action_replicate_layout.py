@@ -89,6 +89,17 @@ class ReplicateLayoutDialog(replicate_layout_GUI.ReplicateLayoutGUI):
 
         self.src_modules = []
 
+        # number of threads planning the destination sheets, the generated GUI has no control for it
+        workers_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        workers_sizer.Add(wx.StaticText(self, wx.ID_ANY, u"Planning threads"), 0, wx.ALL | wx.ALIGN_CENTER_VERTICAL, 5)
+        self.spin_workers = wx.SpinCtrl(self, wx.ID_ANY, min=1, max=32, initial=1)
+        self.spin_workers.SetToolTip(u"Plan destination sheets in parallel, useful with many sheets")
+        workers_sizer.Add(self.spin_workers, 0, wx.ALL, 5)
+        # just before the buttons
+        sizer = self.GetSizer()
+        sizer.Insert(sizer.GetItemCount() - 1, workers_sizer, 0, 0, 5)
+        self.Layout()
+
         # if only one level, select it by default
         if self.list_levels.GetCount() == 1:
             self.list_levels.SetSelection(0)
@@ -147,6 +158,7 @@ class ReplicateLayoutDialog(replicate_layout_GUI.ReplicateLayoutGUI):
         remove_duplicates = self.chkbox_remove_duplicates.GetValue()
         rep_locked = self.chkbox_locked.GetValue()
         rep_edge_cuts = self.chkbox_edge_cuts.GetValue()
+        workers = self.spin_workers.GetValue()
 
         # failsafe sometimes on my machine wx does not generate a listbox event
         level = self.list_levels.GetSelection()
@@ -204,7 +216,8 @@ class ReplicateLayoutDialog(replicate_layout_GUI.ReplicateLayoutGUI):
                                              drawings=rep_drawings,
                                              rm_duplicates=remove_duplicates,
                                              rep_locked=rep_locked,
-                                             edge_cuts=rep_edge_cuts)
+                                             edge_cuts=rep_edge_cuts,
+                                             workers=workers)
 
             self.logger.info("Replication complete")
             # clear highlight on all modules on selected level
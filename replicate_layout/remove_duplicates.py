@@ -24,130 +24,88 @@ import pcbnew
 import os
 import sys
 import logging
-from collections import defaultdict
 
 logger = logging.getLogger(__name__)
 
 
+def point_key(point):
+    """ wxPoint and wxSize are not hashable, convert them to tuples """
+    return point[0], point[1]
+
+
+def remove_duplicate_items(board, items, key):
+    """ remove all but the last of the items with the same key """
+    seen = set()
+    duplicates = []
+    for item in reversed(items):
+        item_key = key(item)
+        if item_key in seen:
+            duplicates.append(item)
+        else:
+            seen.add(item_key)
+    for item in duplicates:
+        board.RemoveNative(item)
+    logger.info("Removed " + repr(len(duplicates)) + " duplicate items")
+
+
+def zone_key(zone):
+    corners = tuple(point_key(zone.GetCornerPosition(index)) for index in range(zone.GetNumCorners()))
+    return zone.GetLayer(), corners
+
+
 def zones_equal(zone1, zone2):
-    z1_layer = zone1.GetLayer()
-    z1_corners = zone1.GetNumCorners()
-
-    z2_layer = zone2.GetLayer()
-    z2_corners = zone2.GetNumCorners()
-
-    if z1_layer == z2_layer:
-        if z1_corners == z2_corners:
-            z1_corners = [zone1.GetCornerPosition(index) for index in range(z1_corners)]
-            z2_corners = [zone2.GetCornerPosition(index) for index in range(z2_corners)]
-            z1z2_corners = zip(z1_corners, z2_corners)
-            if all(x[0] == x[1] for x in z1z2_corners):
-                return 1
+    if zone_key(zone1) == zone_key(zone2):
+        return 1
     return 0
 
 
 def remove_duplicate_zones(board):
     # load all zones
-    zones = board.Zones()
-
-    # build a dictionary wih a list of tracks for each net
-    zone_dict = defaultdict(list)
-    for zone in zones:
-        zone_dict[zone.GetNetCode()].append(zone)
+    zones = list(board.Zones())
+    # zones are duplicates only if they are on the same net
+    remove_duplicate_items(board, zones, lambda x: (x.GetNetCode(), zone_key(x)))
 
-    # go through all the keys
-    for key in zone_dict:
-        zones = zone_dict[key]
 
-        # for each key compare each track agianst each other and if there is no equal
-        # remove it from the list and add to the new list
-
-        for index in range(len(zones)):
-            z1 = zones[index]
-            bools = map(lambda x: zones_equal(x, z1), zones[index+1:])
-            if sum(bools) != 0:
-                board.RemoveNative(z1)
+def track_key(track):
+    return (track.GetLayer(),
+            point_key(track.GetPosition()),
+            point_key(track.GetStart()),
+            point_key(track.GetEnd()))
 
 
 def tracks_equal(track1, track2):
-    t1_layer = track1.GetLayer()
-    t1_pos = track1.GetPosition()
-    t1_start = track1.GetStart()
-    t1_end = track1.GetEnd()
-
-    t2_layer = track2.GetLayer()
-    t2_pos = track2.GetPosition()
-    t2_start = track2.GetStart()
-    t2_end = track2.GetEnd()
-
-    if t1_layer == t2_layer:
-        if t1_pos == t2_pos:
-            if t1_start == t2_start:
-                if t1_end == t2_end:
-                    return 1
+    if track_key(track1) == track_key(track2):
+        return 1
     return 0
 
 
 def remove_duplicate_tracks(board):
     # load all tracks
-    tracks = board.GetTracks()
-
-    # build a dictionary wih a list of tracks for each net
-    track_dict = defaultdict(list)
-    for track in tracks:
-        track_dict[track.GetNetCode()].append(track)
-
-    # go through all the keys
-    for key in track_dict:
-        tracks = track_dict[key]
-
-        # for each key compare each track agianst each other and if there is no equal
-        # remove it from the list and add to the new list
-
-        for index in range(len(tracks)):
-            t1 = tracks[index] 
-            bools = map(lambda x: tracks_equal(x, t1), tracks[index+1:])
-            if sum(bools) != 0:
-                board.RemoveNative(t1)
+    tracks = list(board.GetTracks())
+    # tracks are duplicates only if they are on the same net
+    remove_duplicate_items(board, tracks, lambda x: (x.GetNetCode(), track_key(x)))
+
+
+def text_key(text):
+    return (text.GetLayer(),
+            point_key(text.GetPosition()),
+            point_key(text.GetTextPos()),
+            text.GetText(),
+            text.GetThickness(),
+            text.GetTextAngle(),
+            text.IsItalic(),
+            text.IsBold(),
+            text.IsVisible(),
+            text.IsMirrored(),
+            text.GetVertJustify(),
+            text.GetHorizJustify(),
+            point_key(text.GetTextSize()),
+            text.GetTextWidth(),
+            text.GetTextHeight())
 
 
 def text_equal(text1, text2):
-    t1_properties = []
-    t1_properties.append(text1.GetLayer())
-    t1_properties.append(text1.GetPosition())
-    t1_properties.append(text1.GetTextPos())
-    t1_properties.append(text1.GetText())
-    t1_properties.append(text1.GetThickness())
-    t1_properties.append(text1.GetTextAngle())
-    t1_properties.append(text1.IsItalic())
-    t1_properties.append(text1.IsBold())
-    t1_properties.append(text1.IsVisible())
-    t1_properties.append(text1.IsMirrored())
-    t1_properties.append(text1.GetVertJustify())
-    t1_properties.append(text1.GetHorizJustify())
-    t1_properties.append(text1.GetTextSize())
-    t1_properties.append(text1.GetTextWidth())
-    t1_properties.append(text1.GetTextHeight())
-
-    t2_properties = []
-    t2_properties.append(text2.GetLayer())
-    t2_properties.append(text2.GetPosition())
-    t2_properties.append(text2.GetTextPos())
-    t2_properties.append(text2.GetText())
-    t2_properties.append(text2.GetThickness())
-    t2_properties.append(text2.GetTextAngle())
-    t2_properties.append(text2.IsItalic())
-    t2_properties.append(text2.IsBold())
-    t2_properties.append(text2.IsVisible())
-    t2_properties.append(text2.IsMirrored())
-    t2_properties.append(text2.GetVertJustify())
-    t2_properties.append(text2.GetHorizJustify())
-    t2_properties.append(text2.GetTextSize())
-    t2_properties.append(text2.GetTextWidth())
-    t2_properties.append(text2.GetTextHeight())
-
-    t1t2_properties = zip(t1_properties, t2_properties)
-    if all(x[0] == x[1] for x in t1t2_properties):
+    if text_key(text1) == text_key(text2):
         return 1
     return 0
 
@@ -161,40 +119,24 @@ def remove_duplicate_text(board):
         if isinstance(drawing, pcbnew.TEXTE_PCB):
             text_items.append(drawing)
 
-    for index in range(len(text_items)):
-        t1 = text_items[index]
-        bools = map(lambda x: text_equal(x, t1), text_items[index+1:])
-        if sum(bools) != 0:
-            board.RemoveNative(t1)
+    remove_duplicate_items(board, text_items, text_key)
+
+
+def drawing_key(drawing):
+    return (drawing.GetLayer(),
+            point_key(drawing.GetPosition()),
+            point_key(drawing.GetStart()),
+            point_key(drawing.GetEnd()),
+            drawing.GetClass(),
+            drawing.GetLength(),
+            drawing.GetWidth(),
+            drawing.GetAngle(),
+            drawing.GetType(),
+            drawing.GetShape())
 
 
 def drawings_equal(drawing1, drawing2):
-    d1_properties = []
-    d1_properties.append(drawing1.GetLayer())
-    d1_properties.append(drawing1.GetPosition())
-    d1_properties.append(drawing1.GetStart())
-    d1_properties.append(drawing1.GetEnd())
-    d1_properties.append(drawing1.GetClass())
-    d1_properties.append(drawing1.GetLength())
-    d1_properties.append(drawing1.GetWidth())
-    d1_properties.append(drawing1.GetAngle())
-    d1_properties.append(drawing1.GetType())
-    d1_properties.append(drawing1.GetShape())
-
-    d2_properties = []
-    d2_properties.append(drawing2.GetLayer())
-    d2_properties.append(drawing2.GetPosition())
-    d2_properties.append(drawing2.GetStart())
-    d2_properties.append(drawing2.GetEnd())
-    d2_properties.append(drawing2.GetClass())
-    d2_properties.append(drawing2.GetLength())
-    d2_properties.append(drawing2.GetWidth())
-    d2_properties.append(drawing2.GetAngle())
-    d2_properties.append(drawing2.GetType())
-    d2_properties.append(drawing2.GetShape())
-
-    d1d2_properties = zip(d1_properties, d2_properties)
-    if all(x[0] == x[1] for x in d1d2_properties):
+    if drawing_key(drawing1) == drawing_key(drawing2):
         return 1
     return 0
 
@@ -208,11 +150,7 @@ def remove_duplicate_drawings(board):
         if isinstance(drawing, pcbnew.DRAWSEGMENT):
             drawing_items.append(drawing)
 
-    for index in range(len(drawing_items)):
-        d1 = drawing_items[index]
-        bools = map(lambda x: drawings_equal(x, d1), drawing_items[index+1:])
-        if sum(bools) != 0:
-            board.RemoveNative(d1)
+    remove_duplicate_items(board, drawing_items, drawing_key)
 
 
 def remove_duplicates(board):
@@ -21,21 +21,26 @@
 #
 from __future__ import absolute_import, division, print_function
 import pcbnew
-from collections import namedtuple
+from collections import namedtuple, defaultdict
 import os
 import sys
 import logging
 import itertools
-import re
 import math
 
 parent_module = sys.modules['.'.join(__name__.split('.')[:-1]) or '__main__']
 if __name__ == '__main__' or parent_module.__name__ == '__main__':
     import compare_boards
     import remove_duplicates
+    import spatial_index
+    import replication_plan
+    import sch_hierarchy
 else:
     from . import compare_boards
     from . import remove_duplicates
+    from . import spatial_index
+    from . import replication_plan
+    from . import sch_hierarchy
 
 
 # V5.1.x backward compatibility for module ID
@@ -94,12 +99,6 @@ def rotate_around_point(old_position, point, angle):
     return new_position
 
 
-def get_index_of_tuple(list_of_tuples, index, value):
-    for pos, t in enumerate(list_of_tuples):
-        if t[index] == value:
-            return pos
-
-
 def get_module_text_items(module):
     """ get all text item belonging to a modules """
     list_of_items = [module.mod.Reference(), module.mod.Value()]
@@ -111,71 +110,29 @@ def get_module_text_items(module):
     return list_of_items
 
 
-class Replicator():
-    @staticmethod
-    def extract_subsheets(filename):
-        with open(filename, 'rb') as f:
-            file_folder = os.path.dirname(os.path.abspath(filename))
-            file_lines = f.read().decode('utf-8')
-        # alternative solution
-        # extract all sheet references
-        sheet_indices = [m.start() for m in re.finditer('\$Sheet', file_lines)]
-        endsheet_indices = [m.start() for m in re.finditer('\$EndSheet', file_lines)]
-
-        if len(sheet_indices) != len(endsheet_indices):
-            raise LookupError("Schematic page contains errors")
-
-        sheet_locations = zip(sheet_indices, endsheet_indices)
-        for sheet_location in sheet_locations:
-            sheet_reference = file_lines[sheet_location[0]:sheet_location[1]].split('\n')
-            # parse the sheed description
-            for line in sheet_reference:
-                # found sheet ID
-                if line.startswith('U '):
-                    subsheet_id = line.split()[1]
-                # found sheet name
-                if line.startswith('F0 '):
-                    # remove the first field ("F0 ")
-                    partial_line = line.lstrip("F0 ")
-                    partial_line = " ".join(partial_line.split()[:-1])
-                    # remove the last field (text size)
-                    subsheet_name = partial_line.rstrip("\"").lstrip("\"")
-                # found sheet filename
-                if line.startswith('F1 '):
-                    subsheet_path = re.findall("\s\"(.*.sch)\"\s", line)[0]
-                    subsheet_line = file_lines.split("\n").index(line)
-                    if not os.path.isabs(subsheet_path):
-                        # check if path is encoded with variables
-                        if "${" in subsheet_path:
-                            start_index = subsheet_path.find("${") + 2
-                            end_index = subsheet_path.find("}")
-                            env_var = subsheet_path[start_index:end_index]
-                            path = os.getenv(env_var)
-                            # if variable is not defined rasie an exception
-                            if path is None:
-                                raise LookupError("Can not find subsheet: " + subsheet_path)
-                            # replace variable with full path
-                            subsheet_path = subsheet_path.replace("${", "") \
-                                .replace("}", "") \
-                                .replace("env_var", path)
-
-                    # if path is still not absolute, then it is relative to project
-                    if not os.path.isabs(subsheet_path):
-                        subsheet_path = os.path.join(file_folder, subsheet_path)
-
-                    subsheet_path = os.path.normpath(subsheet_path)
-                    # found subsheet reference go for the next one, no need to parse further
-                    break
-
-            file_path = os.path.abspath(subsheet_path)
-            yield file_path, subsheet_id, subsheet_name
-
-    def find_all_sch_files(self, filename, dict_of_sheets):
-        for file_path, subsheet_id, subsheet_name in self.extract_subsheets(filename):
-            dict_of_sheets[subsheet_id] = [subsheet_name, file_path]
-            dict_of_sheets = self.find_all_sch_files(file_path, dict_of_sheets)
-        return dict_of_sheets
+class SheetPlan():
+    """ anchor, transform, module pairs and net map for one destination sheet """
+    def __init__(self, sheet, anchor_module, modules, module_pairs,
+                 anchor_delta_angle, anchor_delta_pos, delta_orientation):
+        self.sheet = sheet
+        self.anchor_module = anchor_module
+        self.anchor_position = anchor_module.mod.GetPosition()
+        # destination modules on the sheet
+        self.modules = modules
+        # (destination module, source module) pairs
+        self.module_pairs = module_pairs
+        # rotation in degrees and translation used for footprints, text and drawings
+        self.anchor_delta_angle = anchor_delta_angle
+        self.anchor_delta_pos = anchor_delta_pos
+        # rotation in tenths of degree used for tracks and zones
+        self.delta_orientation = delta_orientation
+        # source net name -> (destination net name, destination net item), built on first use
+        self.net_map = None
+        # source net name -> destination net name, when planned in worker threads
+        self.net_names = None
 
+
+class Replicator():
     @staticmethod
     def get_module_id(module):
         """ get module id """
@@ -186,20 +143,51 @@ class Replicator():
     def get_sheet_id(self, module):
         """ get sheet id """
         module_path = get_path(module).split('/')
-        sheet_id = module_path[0:-1]
+        return self.get_sheet_id_from_path(module_path[0:-1])
+
+    def get_sheet_id_from_path(self, sheet_id):
+        """ get sheet names and sheet files from the list of sheet ids """
         sheet_names = [self.dict_of_sheets[x][0] for x in sheet_id if x]
         sheet_files = [self.dict_of_sheets[x][1] for x in sheet_id if x]
         sheet_id = [sheet_names, sheet_files]
         return sheet_id
 
+    def get_board_modules(self, board):
+        """ construct a list of modules, parsing each footprint path only once """
+        modules = []
+        # footprints on the same sheet share the same lists of sheet names and files
+        sheet_ids = {}
+        for module in board.GetModules():
+            module_path = get_path(module).split('/')
+            sheet_path = tuple(module_path[0:-1])
+            if sheet_path not in sheet_ids:
+                sheet_ids[sheet_path] = self.get_sheet_id_from_path(sheet_path)
+            sheet_names, sheet_files = sheet_ids[sheet_path]
+            modules.append(Module(mod=module,
+                                  mod_id=module_path[-1],
+                                  sheet_id=sheet_names,
+                                  filename=sheet_files,
+                                  ref=module.GetReference()))
+        return modules
+
+    def index_modules(self):
+        """ build lookup tables by reference, by module id and by every sheet path prefix """
+        self.modules_by_ref = {}
+        self.modules_by_id = defaultdict(list)
+        self.modules_by_sheet = defaultdict(list)
+        for mod in self.modules:
+            # get_mod_by_ref returns the first footprint with this reference
+            self.modules_by_ref.setdefault(mod.ref, mod)
+            self.modules_by_id[mod.mod_id].append(mod)
+            for depth in range(len(mod.sheet_id) + 1):
+                self.modules_by_sheet[tuple(mod.sheet_id[0:depth])].append(mod)
+
     def get_mod_by_ref(self, ref):
-        for m in self.modules:
-            if m.ref == ref:
-                return m
-        return None
+        return self.modules_by_ref.get(ref)
 
     def __init__(self, board):
         self.board = board
+        self.board_index = None
         self.stage = 1
         self.update_progress = None
 
@@ -213,7 +201,7 @@ class Replicator():
 
         # get relation between sheetname and it's id
         logger.info('getting project hierarchy from schematics')
-        self.dict_of_sheets = self.find_all_sch_files(self.sch_filename, {})
+        self.dict_of_sheets = sch_hierarchy.get_dict_of_sheets(self.sch_filename)
         logger.info("Project hierarchy looks like:\n%s" % repr(self.dict_of_sheets))
 
         # make all paths relative
@@ -223,23 +211,11 @@ class Replicator():
 
         # construct a list of modules with all pertinent data 
         logger.info('getting a list of all footprints on board') 
-        bmod = board.GetModules()
-        self.modules = []
-        for module in bmod:
-            mod_named_tuple = Module(mod=module,
-                                     mod_id=self.get_module_id(module),
-                                     sheet_id=self.get_sheet_id(module)[0],
-                                     filename=self.get_sheet_id(module)[1], 
-                                     ref=module.GetReference())
-            self.modules.append(mod_named_tuple)
-        pass
+        self.modules = self.get_board_modules(board)
+        self.index_modules()
 
     def get_list_of_modules_with_same_id(self, id):
-        list_of_modules = []
-        for m in self.modules:
-            if m.mod_id == id:
-                list_of_modules.append(m)
-        return list_of_modules
+        return list(self.modules_by_id.get(id, []))
 
     def get_sheets_to_replicate(self, mod, level):
         sheet_id = mod.sheet_id
@@ -292,20 +268,11 @@ class Replicator():
         return all_sheets
 
     def get_modules_on_sheet(self, level):
-        modules_on_sheet = []
-        level_depth = len(level)
-        for mod in self.modules:
-            if level == mod.sheet_id[0:level_depth]:
-                modules_on_sheet.append(mod)
-        return modules_on_sheet
+        return list(self.modules_by_sheet.get(tuple(level), []))
 
     def get_modules_not_on_sheet(self, level):
-        modules_not_on_sheet = []
-        level_depth = len(level)
-        for mod in self.modules:
-            if level != mod.sheet_id[0:level_depth]:
-                modules_not_on_sheet.append(mod)
-        return modules_not_on_sheet
+        modules_on_sheet = set(id(mod) for mod in self.modules_by_sheet.get(tuple(level), []))
+        return [mod for mod in self.modules if id(mod) not in modules_on_sheet]
 
     @staticmethod
     def get_nets_from_modules(modules):
@@ -318,10 +285,12 @@ class Replicator():
             for pad in pads:
                 nets.append(pad.GetNetname())
 
-        # remove duplicates
+        # remove duplicates, but keep the order
         nets_clean = []
+        nets_seen = set()
         for i in nets:
-            if i not in nets_clean:
+            if i not in nets_seen:
+                nets_seen.add(i)
                 nets_clean.append(i)
         return nets_clean
 
@@ -357,73 +326,38 @@ class Replicator():
         bounding_box = pcbnew.EDA_RECT(position, size)
         return bounding_box
 
+    def get_board_index(self):
+        # build spatial index of the board items only once
+        if self.board_index is None:
+            self.board_index = spatial_index.BoardIndex(self.board)
+        return self.board_index
+
     def get_tracks(self, bounding_box, local_nets, containing):
-        # find all tracks within the source bounding box
-        all_tracks = self.board.GetTracks()
-        # keep only tracks that are within our bounding box
-        tracks = []
-        # get all the tracks for replication
-        for track in all_tracks:
-            track_bb = track.GetBoundingBox()
-            # if track is contained or intersecting the bounding box
-            if (containing and bounding_box.Contains(track_bb)) or\
-               (not containing and bounding_box.Intersects(track_bb)):
-                tracks.append(track)
-            # even if track is not within the bounding box
-            else:
-                # check if it on a local net
-                if track.GetNetname() in local_nets:
-                    # and add it to the
-                    tracks.append(track)
-        return tracks
+        track_index = self.get_board_index().tracks
+        # find all tracks contained or intersecting the bounding box
+        track_indices = set(track_index.query_indices(bounding_box, containing))
+        # even if track is not within the bounding box, add it if it is on a local net
+        for net in local_nets:
+            track_indices.update(track_index.query_group_indices(net))
+        # keep the order of the tracks on the board
+        return track_index.get_items(sorted(track_indices))
 
     def get_zones(self, bounding_box, containing):
         # get all zones in source bounding box
-        all_zones = []
-        for zoneid in range(self.board.GetAreaCount()):
-            all_zones.append(self.board.GetArea(zoneid))
-        # find all zones which are completely within the source bounding box
-        zones = []
-        for zone in all_zones:
-            zone_bb = zone.GetBoundingBox()
-            if (containing and bounding_box.Contains(zone_bb)) or\
-               (not containing and bounding_box.Intersects(zone_bb)):
-                zones.append(zone)
-        return zones
+        return self.get_board_index().zones.query(bounding_box, containing)
 
     def get_text_items(self, bounding_box, containing):
         # get all text objects in source bounding box
-        all_text = []
-        for drawing in self.board.GetDrawings():
-            if not isinstance(drawing, pcbnew.TEXTE_PCB):
-                continue
-            text_bb = drawing.GetBoundingBox()
-            if containing:
-                if bounding_box.Contains(text_bb):
-                    all_text.append(drawing)
-            else:
-                if bounding_box.Intersects(text_bb):
-                    all_text.append(drawing)
-        return all_text
+        return self.get_board_index().text.query(bounding_box, containing)
 
     def get_drawings(self, bounding_box, containing):
         # get all drawings in source bounding box
-        all_drawings = []
-        for drawing in self.board.GetDrawings():
-            if not isinstance(drawing, pcbnew.DRAWSEGMENT):
-                continue
-            dwg_bb = drawing.GetBoundingBox()
-            if containing:
-                if bounding_box.Contains(dwg_bb):
-                    all_drawings.append(drawing)
-            else:
-                if bounding_box.Intersects(dwg_bb):
-                    all_drawings.append(drawing)
-        return all_drawings
+        return self.get_board_index().drawings.query(bounding_box, containing)
 
-    def get_sheet_anchor_module(self, sheet):
+    def get_sheet_anchor_module(self, sheet, sheet_modules=None):
         # get all modules on this sheet
-        sheet_modules = self.get_modules_on_sheet(sheet)
+        if sheet_modules is None:
+            sheet_modules = self.get_modules_on_sheet(sheet)
         # get anchor module
         list_of_possible_anchor_modules = []
         for mod in sheet_modules:
@@ -450,106 +384,156 @@ class Replicator():
         return sheet_anchor_mod
 
     def get_net_pairs(self, sheet):
-        """ find all net pairs between source sheet and current sheet"""
+        """ find all net pairs between source sheet and current sheet
+            returns a dictionary source net name -> (destination net name, destination net item)"""
+        sheet_plan = self.get_sheet_plan(sheet)
+        if sheet_plan.net_map is not None:
+            return sheet_plan.net_map
+
         # find all modules, pads and nets on this sheet
-        sheet_modules = self.get_modules_on_sheet(sheet)
+        sheet_modules = sheet_plan.modules
+
+        # net names were already paired by plan_sheets, only net items are needed
+        if sheet_plan.net_names is not None:
+            net_items = {}
+            for d_mod in sheet_modules:
+                for pad in d_mod.mod.Pads():
+                    net_items[pad.GetNetname()] = pad.GetNet()
+            net_map = dict((s_net_name, (d_net_name, net_items[d_net_name]))
+                           for s_net_name, d_net_name in sheet_plan.net_names.items())
+            sheet_plan.net_map = net_map
+            return net_map
+
+        # group destination modules by their id
+        dst_modules_by_id = defaultdict(list)
+        for d_mod in sheet_modules:
+            dst_modules_by_id[d_mod.mod_id].append(d_mod)
 
-        # find all net pairs via same modules pads,
-        net_pairs = []
-        net_dict = {}
         # construct module pairs
-        mod_matches = []
-        for s_mod in self.src_modules:
-            mod_matches.append([s_mod.mod, s_mod.mod_id, s_mod.sheet_id])
-
-        for d_mod in sheet_modules:
-            for mod in mod_matches:
-                if mod[1] == d_mod.mod_id:
-                    index = mod_matches.index(mod)
-                    mod_matches[index].append(d_mod.mod)
-                    mod_matches[index].append(d_mod.mod_id)
-                    mod_matches[index].append(d_mod.sheet_id)
-        # find closest match
         mod_pairs = []
-        mod_pairs_by_reference = []
-        for index in range(len(mod_matches)):
-            mod = mod_matches[index]
-            # get number of matches
-            matches = (len(mod) - 3) // 3
+        for s_mod in self.src_modules:
+            matches = dst_modules_by_id.get(s_mod.mod_id, [])
             # if more than one match, get the most likely one
             # this is when replicating a sheet which consist of two or more identical subsheets (multiple hierachy)
             # todo might want to find common code with code in "get_sheet_anchor_module"
-            if matches > 1:
-                match_len = []
-                for index in range(0, matches):
-                    match_len.append(len(set(mod[2]) & set(mod[2+3*(index+1)])))
+            if len(matches) > 1:
+                src_sheet_id = set(s_mod.sheet_id)
+                match_len = [len(src_sheet_id & set(d_mod.sheet_id)) for d_mod in matches]
                 index = match_len.index(max(match_len))
-                mod_pairs.append((mod[0], mod[3*(index+1)]))
-                mod_pairs_by_reference.append((mod[0].GetReference(), mod[3*(index+1)].GetReference()))
+                mod_pairs.append((s_mod.mod, matches[index].mod))
             # if only one match
-            elif matches == 1:
-                mod_pairs.append((mod[0], mod[3]))
-                mod_pairs_by_reference.append((mod[0].GetReference(), mod[3].GetReference()))
+            elif len(matches) == 1:
+                mod_pairs.append((s_mod.mod, matches[0].mod))
             # can not find at least one matching footprint
-            elif matches == 0:
-                raise LookupError("Could not find at least one matching footprint for: " + mod[0].GetReference() +
+            else:
+                raise LookupError("Could not find at least one matching footprint for: " + s_mod.mod.GetReference() +
                                   ".\nPlease make sure that schematics and layout are in sync.")
 
-        pad_pairs = []
-        for x in range(len(mod_pairs)):
-            pad_pairs.append([])
-
-        for pair in mod_pairs:
-            index = mod_pairs.index(pair)
-            # get all footprint pads
-            s_mod_pads = pair[0].Pads()
-            d_mod_pads = pair[1].Pads()
-            # create a list of padsnames and pads
-            s_pads = []
-            d_pads = []
-            for pad in s_mod_pads:
-                s_pads.append((pad.GetName(), pad))
-            for pad in d_mod_pads:
-                d_pads.append((pad.GetName(), pad))
-            # sort by padnames
-            s_pads.sort(key=lambda tup: tup[0])
-            d_pads.sort(key=lambda tup: tup[0])
-            # extract pads and append them to pad pairs list
-            pad_pairs[index].append([x[1] for x in s_pads])
-            pad_pairs[index].append([x[1] for x in d_pads])
-
-        for pair in mod_pairs:
-            index = mod_pairs.index(pair)
-            s_mod = pair[0]
-            d_mod = pair[1]
-            # get their pads
-            s_mod_pads = pad_pairs[index][0]
-            d_mod_pads = pad_pairs[index][1]
-            # I am going to assume pads are in the same order
-            s_nets = []
-            d_nets = []
-            # get nelists for each pad
-            for p_pad in s_mod_pads:
-                pad_name = p_pad.GetName()
-                s_nets.append((pad_name, p_pad.GetNetname()))
-            for s_pad in d_mod_pads:
-                pad_name = s_pad.GetName()
-                d_nets.append((pad_name, s_pad.GetNetname()))
-                net_dict[s_pad.GetNetname()] = s_pad.GetNet()
-            # sort both lists by pad name
-            # so that they have the same order - needed in some cases
+        # find all net pairs via same modules pads
+        net_map = {}
+        for s_mod, d_mod in mod_pairs:
+            # sort pads by padnames so that they have the same order
             # as the iterator thorugh the pads list does not return pads always in the proper order
-            s_nets.sort(key=lambda tup: tup[0])
-            d_nets.sort(key=lambda tup: tup[0])
-            # build list of net tupules
-            for net in s_nets:
-                index = get_index_of_tuple(s_nets, 1, net[1])
-                net_pairs.append((s_nets[index][1], d_nets[index][1]))
-
-        # remove duplicates
-        net_pairs_clean = list(set(net_pairs))
+            s_pads = sorted([(pad.GetName(), pad) for pad in s_mod.Pads()], key=lambda tup: tup[0])
+            d_pads = sorted([(pad.GetName(), pad) for pad in d_mod.Pads()], key=lambda tup: tup[0])
+            # I am going to assume pads are in the same order
+            for index in range(len(s_pads)):
+                s_net_name = s_pads[index][1].GetNetname()
+                if s_net_name not in net_map:
+                    d_pad = d_pads[index][1]
+                    net_map[s_net_name] = (d_pad.GetNetname(), d_pad.GetNet())
+
+        sheet_plan.net_map = net_map
+        return net_map
+
+    def get_src_module(self, dst_mod):
+        """ find proper match in source modules """
+        list_of_possible_src_modules = []
+        for s_mod in self.src_modules:
+            if s_mod.mod_id == dst_mod.mod_id:
+                list_of_possible_src_modules.append(s_mod)
+
+        # if there is more than one possible anchor, select the correct one
+        if len(list_of_possible_src_modules) == 1:
+            return list_of_possible_src_modules[0]
+        list_of_matches = []
+        for index, m in enumerate(list_of_possible_src_modules):
+            matches = 0
+            for item in dst_mod.sheet_id:
+                if item in m.sheet_id:
+                    matches = matches + 1
+            list_of_matches.append((index, matches))
+        # if list is empty it is highly likely that shematics and pcb are not in sync
+        if not list_of_matches:
+            return None
+        # select the one with most matches
+        index, _ = max(list_of_matches, key=lambda item: item[1])
+        return list_of_possible_src_modules[index]
+
+    def get_sheet_plan(self, sheet):
+        """ get replication plan for the sheet, computed only once per replication """
+        sheet_key = tuple(sheet)
+        if sheet_key in self.sheet_plans:
+            return self.sheet_plans[sheet_key]
 
-        return net_pairs_clean, net_dict
+        sheet_modules = self.get_modules_on_sheet(sheet)
+        # get anchor module
+        dst_anchor_module = self.get_sheet_anchor_module(sheet, sheet_modules)
+        # get anchor angle and position with respect to source anchor module
+        anchor_delta_angle = self.src_anchor_module.mod.GetOrientationDegrees()\
+            - dst_anchor_module.mod.GetOrientationDegrees()
+        anchor_delta_pos = dst_anchor_module.mod.GetPosition() - self.src_anchor_module.mod.GetPosition()
+        delta_orientation = dst_anchor_module.mod.GetOrientation() - self.src_anchor_module.mod.GetOrientation()
+
+        module_pairs = [(dst_mod, self.get_src_module(dst_mod)) for dst_mod in sheet_modules]
+
+        sheet_plan = SheetPlan(sheet, dst_anchor_module, sheet_modules, module_pairs,
+                               anchor_delta_angle, anchor_delta_pos, delta_orientation)
+        self.sheet_plans[sheet_key] = sheet_plan
+        return sheet_plan
+
+    def get_modules_snapshot(self):
+        """ plain python copy of footprint data needed for replication planning """
+        snapshot = []
+        for index, m in enumerate(self.modules):
+            position = m.mod.GetPosition()
+            pads = sorted([(pad.GetName(), pad.GetNetname()) for pad in m.mod.Pads()], key=lambda tup: tup[0])
+            snapshot.append(replication_plan.ModuleData(index=index,
+                                                        ref=m.mod.GetReference(),
+                                                        mod_id=m.mod_id,
+                                                        sheet_id=m.sheet_id,
+                                                        position=(position.x, position.y),
+                                                        orientation=m.mod.GetOrientation(),
+                                                        orientation_degrees=m.mod.GetOrientationDegrees(),
+                                                        pads=tuple(pads)))
+        return snapshot
+
+    def plan_sheets(self, workers):
+        """
+        compute plans for all destination sheets in worker threads. Board is read only here, in the main thread,
+        workers see only the plain python snapshot. Sheets which could not be planned are left to get_sheet_plan
+        """
+        snapshot = self.get_modules_snapshot()
+        positions = dict((id(m), index) for index, m in enumerate(self.modules))
+        src_modules = [snapshot[positions[id(m)]] for m in self.src_modules]
+        src_anchor = snapshot[positions[id(self.src_anchor_module)]]
+
+        plans = replication_plan.plan_sheets(snapshot, src_modules, src_anchor, self.dst_sheets, workers)
+
+        # map the results back to board objects
+        for plan in plans:
+            if plan.anchor_index is None:
+                continue
+            module_pairs = []
+            for dst_index, src_index in plan.module_pairs:
+                src_mod = self.modules[src_index] if src_index is not None else None
+                module_pairs.append((self.modules[dst_index], src_mod))
+            sheet_modules = [pair[0] for pair in module_pairs]
+            sheet_plan = SheetPlan(plan.sheet, self.modules[plan.anchor_index], sheet_modules, module_pairs,
+                                   plan.anchor_delta_angle, pcbnew.wxPoint(*plan.anchor_delta_pos),
+                                   plan.delta_orientation)
+            sheet_plan.net_names = plan.net_map
+            self.sheet_plans[tuple(plan.sheet)] = sheet_plan
 
     def prepare_for_replication(self, level, containing):
         # get a list of source modules for replication
@@ -594,21 +578,16 @@ class Replicator():
             progress = st_index/nr_sheets
             self.update_progress(self.stage, progress, None)
             logger.info("Replicating footprints on sheet " + repr(sheet))
-            # get anchor module
-            dst_anchor_module = self.get_sheet_anchor_module(sheet)
-            # get anchor angle with respect to source module
-            dst_anchor_module_angle = dst_anchor_module.mod.GetOrientationDegrees()
-            # get exact anchor position
-            dst_anchor_module_position = dst_anchor_module.mod.GetPosition()
-
-            anchor_delta_angle = self.src_anchor_module.mod.GetOrientationDegrees() - dst_anchor_module_angle
-            anchor_delta_pos = dst_anchor_module_position - self.src_anchor_module.mod.GetPosition()
+            sheet_plan = self.get_sheet_plan(sheet)
+            dst_anchor_module = sheet_plan.anchor_module
+            dst_anchor_module_position = sheet_plan.anchor_position
+            anchor_delta_angle = sheet_plan.anchor_delta_angle
+            anchor_delta_pos = sheet_plan.anchor_delta_pos
 
             # go through all modules
-            dst_modules = self.get_modules_on_sheet(sheet)
-            nr_mods = len(dst_modules)
+            nr_mods = len(sheet_plan.module_pairs)
             for mod_index in range(nr_mods):
-                dst_mod = dst_modules[mod_index]
+                dst_mod, src_mod = sheet_plan.module_pairs[mod_index]
 
                 progress = progress + (1/nr_sheets)*(1/nr_mods)
                 self.update_progress(self.stage, progress, None)
@@ -617,32 +596,10 @@ class Replicator():
                 if dst_mod.mod.IsLocked() is True and self.rep_locked is False:
                     continue
 
-                # find proper match in source modules
-                src_mod = None
-                list_of_possible_src_modules = []
-                for s_mod in self.src_modules:
-                    if s_mod.mod_id == dst_mod.mod_id:
-                        list_of_possible_src_modules.append(s_mod)
-
-                # if there is more than one possible anchor, select the correct one
-                if len(list_of_possible_src_modules) == 1:
-                    src_mod = list_of_possible_src_modules[0]
-                else:
-                    list_of_matches = []
-                    for m in list_of_possible_src_modules:
-                        index = list_of_possible_src_modules.index(m)
-                        matches = 0
-                        for item in dst_mod.sheet_id:
-                            if item in m.sheet_id:
-                                matches = matches + 1
-                        list_of_matches.append((index, matches))
-                    # check if list is empty, if it is, then it is highly likely that shematics and pcb are not in sync
-                    if not list_of_matches:
-                        raise LookupError("Can not find anchor (source) footprint for footprint: " + repr(dst_mod.ref)
-                                          + "\n" + "Most likely, schematics and PCB are not in sync")
-                    # select the one with most matches
-                    index, _ = max(list_of_matches, key=lambda item: item[1])
-                    src_mod = list_of_possible_src_modules[index]
+                # if there is no source module, then it is highly likely that shematics and pcb are not in sync
+                if src_mod is None:
+                    raise LookupError("Can not find anchor (source) footprint for footprint: " + repr(dst_mod.ref)
+                                      + "\n" + "Most likely, schematics and PCB are not in sync")
 
                 # get module to clone position
                 src_module_orientation = src_mod.mod.GetOrientationDegrees()
@@ -725,20 +682,12 @@ class Replicator():
             self.update_progress(self.stage, progress, None)
             logger.info("Replicating tracks on sheet " + repr(sheet))
 
-            # get anchor module
-            dst_anchor_module = self.get_sheet_anchor_module(sheet)
-            # get anchor angle with respect to source anchor module
-            dst_anchor_module_angle = dst_anchor_module.mod.GetOrientation()
-            # get exact anchor position
-            dst_anchor_module_position = dst_anchor_module.mod.GetPosition()
-
-            src_anchor_module_angle = self.src_anchor_module.mod.GetOrientation()
+            sheet_plan = self.get_sheet_plan(sheet)
             src_anchor_module_position = self.src_anchor_module.mod.GetPosition()
+            move_vector = sheet_plan.anchor_delta_pos
+            delta_orientation = sheet_plan.delta_orientation
 
-            move_vector = dst_anchor_module_position - src_anchor_module_position
-            delta_orientation = dst_anchor_module_angle - src_anchor_module_angle
-
-            net_pairs, net_dict = self.get_net_pairs(sheet)
+            net_map = self.get_net_pairs(sheet)
 
             # go through all the tracks
             nr_tracks = len(self.src_tracks)
@@ -749,14 +698,10 @@ class Replicator():
                 # get from which net we are cloning
                 from_net_name = track.GetNetname()
                 # find to net
-                tup = [item for item in net_pairs if item[0] == from_net_name]
                 # if net was not found, then the track is not part of this sheet and should not be cloned
-                if not tup:
-                    pass
-                else:
-                    to_net_name = tup[0][1]
-                    to_net_code = net_dict[to_net_name].GetNet()
-                    to_net_item = net_dict[to_net_name]
+                if from_net_name in net_map:
+                    to_net_name, to_net_item = net_map[from_net_name]
+                    to_net_code = to_net_item.GetNet()
 
                     # make a duplicate, move it, rotate it, select proper net and add it to the board
                     new_track = track.Duplicate()
@@ -777,20 +722,12 @@ class Replicator():
             self.update_progress(self.stage, progress, None)
             logger.info("Replicating zones on sheet " + repr(sheet))
 
-            # get anchor module
-            dst_anchor_module = self.get_sheet_anchor_module(sheet)
-            # get anchor angle with respect to source anchor module
-            dst_anchor_module_angle = dst_anchor_module.mod.GetOrientation()
-            # get exact anchor position
-            dst_anchor_module_position = dst_anchor_module.mod.GetPosition()
-
-            src_anchor_module_angle = self.src_anchor_module.mod.GetOrientation()
+            sheet_plan = self.get_sheet_plan(sheet)
             src_anchor_module_position = self.src_anchor_module.mod.GetPosition()
+            move_vector = sheet_plan.anchor_delta_pos
+            delta_orientation = sheet_plan.delta_orientation
 
-            move_vector = dst_anchor_module_position - src_anchor_module_position
-            delta_orientation = dst_anchor_module_angle - src_anchor_module_angle
-
-            net_pairs, net_dict = self.get_net_pairs(sheet)
+            net_map = self.get_net_pairs(sheet)
             # go through all the zones
             nr_zones = len(self.src_zones)
             for zone_index in range(nr_zones):
@@ -802,28 +739,27 @@ class Replicator():
                 from_net_name = zone.GetNetname()
                 # if zone is not on copper layer it does not matter on which net it is
                 if not zone.IsOnCopperLayer():
-                    tup = [('', '')]
+                    net_pair = (u'', None)
                 else:
-                    tup = [item for item in net_pairs if item[0] == from_net_name]
+                    net_pair = net_map.get(from_net_name)
 
                 # there is no net
-                if not tup:
+                if net_pair is None:
                     # Allow keepout zones to be cloned.
                     if zone.GetIsKeepout():
-                        tup = [('', '')]
+                        net_pair = (u'', None)
                     # do not clone
                     else:
                         logger.info('Skipping replication of a zone on copper layer without a net')
                         continue
 
                 # start the clone
-                to_net_name = tup[0][1]
+                to_net_name, to_net_item = net_pair
                 if to_net_name == u'':
                     to_net_code = 0
                     to_net_item = self.board.FindNet(0)
                 else:
-                    to_net_code = net_dict[to_net_name].GetNet()
-                    to_net_item = net_dict[to_net_name]
+                    to_net_code = to_net_item.GetNet()
 
                 # make a duplicate, move it, rotate it, select proper net and add it to the board
                 new_zone = zone.Duplicate()
@@ -843,15 +779,10 @@ class Replicator():
             self.update_progress(self.stage, progress, None)
             logger.info("Replicating text on sheet " + repr(sheet))
 
-            # get anchor module
-            dst_anchor_module = self.get_sheet_anchor_module(sheet)
-            # get anchor angle with respect to source module
-            dst_anchor_module_angle = dst_anchor_module.mod.GetOrientationDegrees()
-            # get exact anchor position
-            dst_anchor_module_position = dst_anchor_module.mod.GetPosition()
-
-            anchor_delta_angle = self.src_anchor_module.mod.GetOrientationDegrees() - dst_anchor_module_angle
-            anchor_delta_pos = dst_anchor_module_position - self.src_anchor_module.mod.GetPosition()
+            sheet_plan = self.get_sheet_plan(sheet)
+            dst_anchor_module_position = sheet_plan.anchor_position
+            anchor_delta_angle = sheet_plan.anchor_delta_angle
+            anchor_delta_pos = sheet_plan.anchor_delta_pos
 
             nr_text = len(self.src_text)
             for text_index in range(nr_text):
@@ -873,15 +804,10 @@ class Replicator():
             self.update_progress(self.stage, progress, None)
             logger.info("Replicating drawings on sheet " + repr(sheet))
 
-            # get anchor module
-            dst_anchor_module = self.get_sheet_anchor_module(sheet)
-            # get anchor angle with respect to source module
-            dst_anchor_module_angle = dst_anchor_module.mod.GetOrientationDegrees()
-            # get exact anchor position
-            dst_anchor_module_position = dst_anchor_module.mod.GetPosition()
-
-            anchor_delta_angle = self.src_anchor_module.mod.GetOrientationDegrees() - dst_anchor_module_angle
-            anchor_delta_pos = dst_anchor_module_position - self.src_anchor_module.mod.GetPosition()
+            sheet_plan = self.get_sheet_plan(sheet)
+            dst_anchor_module_position = sheet_plan.anchor_position
+            anchor_delta_angle = sheet_plan.anchor_delta_angle
+            anchor_delta_pos = sheet_plan.anchor_delta_pos
 
             # go through all the drawings
             nr_drawings = len(self.src_drawings)
@@ -904,98 +830,58 @@ class Replicator():
                         new_drawing.Rotate(dst_anchor_module_position, -anchor_delta_angle * 10)
                         self.board.Add(new_drawing)
 
+    def remove_item(self, item, index):
+        # remove item from the board and from the spatial index
+        self.board.RemoveNative(item)
+        index.remove(item)
+
     def remove_zones_tracks(self, containing):
+        board_index = self.get_board_index()
         for index in range(len(self.dst_sheets)):
             sheet = self.dst_sheets[index]
             self.update_progress(self.stage, index / len(self.dst_sheets), None)
             # get modules on a sheet
-            mod_sheet = self.get_modules_on_sheet(sheet)
+            mod_sheet = self.get_sheet_plan(sheet).modules
             # get bounding box
             bounding_box = self.get_modules_bounding_box(mod_sheet)
 
-            # from all the tracks on board
-            all_tracks = self.board.GetTracks()
             # remove the tracks that are not on nets contained in this sheet
-            nets_on_sheet = self.get_nets_from_modules(mod_sheet)
-            tracks_on_nets_on_sheet = []
-            for track in all_tracks:
-                if track.GetNetname() in nets_on_sheet:
-                    tracks_on_nets_on_sheet.append(track)
-
-            for track in tracks_on_nets_on_sheet:
+            nets_on_sheet = set(self.get_nets_from_modules(mod_sheet))
+            # from all the tracks containing/interesecting in the replicated bounding box
+            for track in board_index.tracks.query(bounding_box, containing):
                 # minus the tracks in source bounding box
-                if track not in self.src_tracks:
-                    track_bounding_box = track.GetBoundingBox()
-                    # remove the tracks containing/interesecting in the replicated bounding box
-                    if containing:
-                        if bounding_box.Contains(track_bounding_box):
-                            self.board.RemoveNative(track)
-                    else:
-                        if bounding_box.Intersects(track_bounding_box):
-                            self.board.RemoveNative(track)
-
-            # from all the zones on the board
-            all_zones = []
-            for zoneid in range(self.board.GetAreaCount()):
-                all_zones.append(self.board.GetArea(zoneid))
-            # remove the zones that are not on nets contained in this sheet
-            zones_on_nets_on_sheet = []
-            for zone in all_zones:
-                if zone.GetNetname() in nets_on_sheet:
-                    zones_on_nets_on_sheet.append(zone)
-            for zone in all_zones:
+                if track.GetNetname() in nets_on_sheet and track not in self.src_tracks:
+                    self.remove_item(track, board_index.tracks)
+
+            # from all the zones containing/interesecting in the replicated bounding box
+            for zone in board_index.zones.query(bounding_box, containing):
                 # minus the zones in source bounding box
                 if zone not in self.src_zones:
-                    zone_bounding_box = zone.GetBoundingBox()
-                    # remove the zones containing/interesecting in the replicated bounding box
-                    if containing:
-                        if bounding_box.Contains(zone_bounding_box):
-                            self.board.RemoveNative(zone)
-                    else:
-                        if bounding_box.Intersects(zone_bounding_box):
-                            self.board.RemoveNative(zone)
-
-            # from all text items on the board
-            for drawing in self.board.GetDrawings():
-                if not isinstance(drawing, pcbnew.TEXTE_PCB):
-                    continue
-                # ignore text in the source sheet
-                if drawing in self.src_text:
-                    continue
-
-                # add text in/intersecting with the replicated bounding box to
-                # the list for removal.
-                text_bb = drawing.GetBoundingBox()
-                if containing:
-                    if bounding_box.Contains(text_bb):
-                        self.board.RemoveNative(drawing)
-                else:
-                    if bounding_box.Intersects(text_bb):
-                        self.board.RemoveNative(drawing)
+                    self.remove_item(zone, board_index.zones)
 
-            # from all drawing items on the board
-            for drawing in self.board.GetDrawings():
-                if not isinstance(drawing, pcbnew.DRAWSEGMENT):
-                    continue
+            # from all text items in/intersecting with the replicated bounding box
+            for drawing in board_index.text.query(bounding_box, containing):
                 # ignore text in the source sheet
-                if drawing in self.src_drawings:
-                    continue
+                if drawing not in self.src_text:
+                    self.remove_item(drawing, board_index.text)
 
-                # add text in/intersecting with the replicated bounding box to
-                # the list for removal.
-                dwg_bb = drawing.GetBoundingBox()
-                if containing:
-                    if bounding_box.Contains(dwg_bb):
-                        self.board.RemoveNative(drawing)
-                else:
-                    if bounding_box.Intersects(dwg_bb):
-                        self.board.RemoveNative(drawing)
+            # from all drawing items in/intersecting with the replicated bounding box
+            for drawing in board_index.drawings.query(bounding_box, containing):
+                # ignore drawings in the source sheet
+                if drawing not in self.src_drawings:
+                    self.remove_item(drawing, board_index.drawings)
 
     def removing_duplicates(self):
         remove_duplicates.remove_duplicates(self.board)
 
     def replicate_layout(self, src_anchor_module, level, dst_sheets,
-                         containing, remove, tracks, zones, text, drawings, rm_duplicates, rep_locked, edge_cuts):
+                         containing, remove, tracks, zones, text, drawings, rm_duplicates, rep_locked, edge_cuts,
+                         workers=1):
+        """
+        replicate layout of the source sheet onto destination sheets
+        with workers > 1 the plans for all destination sheets are computed up front in worker threads,
+        the board is still modified only in this thread
+        """
         logger.info( "Starting replication of sheets: " + repr(dst_sheets)
                      +"\non level: " + repr(level)
                      +"\nwith tracks=" + repr(tracks) +", zone=" + repr(zones) +", text=" + repr(text)
@@ -1005,6 +891,8 @@ class Replicator():
         self.src_anchor_module = src_anchor_module
         self.dst_sheets = dst_sheets
         self.rep_locked = rep_locked
+        # sheet plans depend on source modules, so they are valid only for this replication
+        self.sheet_plans = {}
 
         if remove:
             self.max_stages = 2
@@ -1025,7 +913,12 @@ class Replicator():
         self.src_anchor_module_angle = self.src_anchor_module.mod.GetOrientationDegrees()
         self.src_anchor_module_position = self.src_anchor_module.mod.GetPosition()
         self.update_progress(self.stage, 0.0, "Preparing for replication")
+        # board might have been edited since the index was built
+        self.board_index = None
         self.prepare_for_replication(level, containing)
+        if workers > 1:
+            logger.info("Planning replication with " + repr(workers) + " threads")
+            self.plan_sheets(workers)
         if remove:
             logger.info("Removing tracks and zones, before module placement")
             self.stage = 2
@@ -1070,7 +963,7 @@ def update_progress(stage, percentage, message=None):
     print(percentage)
 
 
-def test_file(in_filename, out_filename, src_anchor_module_reference, level, sheets, containing, remove):
+def test_file(in_filename, out_filename, src_anchor_module_reference, level, sheets, containing, remove, workers=1):
     board = pcbnew.LoadBoard(in_filename)
     # get board information
     replicator = Replicator(board)
@@ -1110,7 +1003,8 @@ def test_file(in_filename, out_filename, src_anchor_module_reference, level, she
     replicator.update_progress = update_progress
     replicator.replicate_layout(src_anchor_module, src_anchor_module.sheet_id[0:index+1], dst_sheets,
                                 containing=containing, remove=remove, rm_duplicates=True,
-                                tracks=True, zones=True, text=True, drawings=True, rep_locked=True)
+                                tracks=True, zones=True, text=True, drawings=True, rep_locked=True, edge_cuts=False,
+                                workers=workers)
 
     pcbnew.SaveBoard(out_filename, board)
     test_filename = out_filename.replace("temp", "test")
@@ -1126,6 +1020,14 @@ def main():
     output_file = input_file.split('.')[0]+"_temp"+".kicad_pcb"
     err = test_file(input_file, output_file, 'Q301', level=1, sheets=(0, 2, 5,), containing=False, remove=True)
     assert (err == 0), "multiple_hierarchy - inner levels failed"
+
+    logger.info("Testing multiple hierarchy - inner levels planned in worker threads")
+    input_file = 'multiple_hierarchy.kicad_pcb'
+    output_file = input_file.split('.')[0]+"_temp"+".kicad_pcb"
+    err = test_file(input_file, output_file, 'Q301', level=1, sheets=(0, 2, 5,), containing=False, remove=True,
+                    workers=4)
+    assert (err == 0), "multiple_hierarchy - inner levels planned in worker threads failed"
+
     
     logger.info("Testing multiple hierarchy - inner levels source on a different hierarchical level")
     input_file = 'multiple_hierarchy.kicad_pcb'
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+#  replication_plan.py
+#
+# Copyright (C) 2019 Mitja Nemec
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""
+Replication planning on a plain python snapshot of the footprints.
+This module must not import pcbnew, as the plans are computed in worker threads
+while board objects are only touched in the main thread
+"""
+from __future__ import absolute_import, division, print_function
+import os
+import sys
+import time
+import logging
+from collections import namedtuple, defaultdict
+
+try:
+    import concurrent.futures
+    HAS_FUTURES = True
+except ImportError:
+    # python 2 without "futures" backport
+    HAS_FUTURES = False
+
+logger = logging.getLogger(__name__)
+
+# snapshot of a footprint, pads are (pad name, net name) tuples sorted by pad name
+ModuleData = namedtuple('ModuleData', ['index', 'ref', 'mod_id', 'sheet_id',
+                                       'position', 'orientation', 'orientation_degrees', 'pads'])
+# result of planning, footprints are referenced by their index in the snapshot.
+# anchor_index is None when the anchor could not be found and net_map is None when nets could not
+# be paired, these are left to the serial planning, so errors are raised when they would be without the plan
+SheetPlanData = namedtuple('SheetPlanData', ['sheet', 'anchor_index', 'module_pairs', 'anchor_delta_angle',
+                                             'anchor_delta_pos', 'delta_orientation', 'net_map'])
+
+
+def find_anchor_module(sheet_modules, src_anchor):
+    """ same as Replicator.get_sheet_anchor_module """
+    list_of_possible_anchor_modules = [mod for mod in sheet_modules if mod.mod_id == src_anchor.mod_id]
+    if len(list_of_possible_anchor_modules) == 1:
+        return list_of_possible_anchor_modules[0]
+    # if there are more then one, we're dealing with multiple hierarchy
+    # the correct one is the one who's path is the best match
+    list_of_matches = []
+    for index, mod in enumerate(list_of_possible_anchor_modules):
+        matches = len([item for item in src_anchor.sheet_id if item in mod.sheet_id])
+        list_of_matches.append((index, matches))
+    index, _ = max(list_of_matches, key=lambda item: item[1])
+    return list_of_possible_anchor_modules[index]
+
+
+def find_src_module(dst_mod, src_modules):
+    """ same as Replicator.get_src_module """
+    list_of_possible_src_modules = [s_mod for s_mod in src_modules if s_mod.mod_id == dst_mod.mod_id]
+    if len(list_of_possible_src_modules) == 1:
+        return list_of_possible_src_modules[0]
+    list_of_matches = []
+    for index, mod in enumerate(list_of_possible_src_modules):
+        matches = len([item for item in dst_mod.sheet_id if item in mod.sheet_id])
+        list_of_matches.append((index, matches))
+    if not list_of_matches:
+        return None
+    index, _ = max(list_of_matches, key=lambda item: item[1])
+    return list_of_possible_src_modules[index]
+
+
+def get_net_map(src_modules, sheet_modules):
+    """ same as Replicator.get_net_pairs, but maps source net name to destination net name """
+    dst_modules_by_id = defaultdict(list)
+    for d_mod in sheet_modules:
+        dst_modules_by_id[d_mod.mod_id].append(d_mod)
+
+    net_map = {}
+    for s_mod in src_modules:
+        matches = dst_modules_by_id.get(s_mod.mod_id, [])
+        if len(matches) > 1:
+            src_sheet_id = set(s_mod.sheet_id)
+            match_len = [len(src_sheet_id & set(d_mod.sheet_id)) for d_mod in matches]
+            d_mod = matches[match_len.index(max(match_len))]
+        elif len(matches) == 1:
+            d_mod = matches[0]
+        else:
+            raise LookupError("Could not find at least one matching footprint for: " + s_mod.ref +
+                              ".\nPlease make sure that schematics and layout are in sync.")
+        # I am going to assume pads are in the same order
+        for index in range(len(s_mod.pads)):
+            s_net_name = s_mod.pads[index][1]
+            if s_net_name not in net_map:
+                net_map[s_net_name] = d_mod.pads[index][1]
+    return net_map
+
+
+def plan_sheet(sheet, sheet_modules, src_modules, src_anchor):
+    """ compute replication plan for one destination sheet """
+    try:
+        dst_anchor = find_anchor_module(sheet_modules, src_anchor)
+    except ValueError:
+        return SheetPlanData(sheet, None, None, None, None, None, None)
+    anchor_delta_angle = src_anchor.orientation_degrees - dst_anchor.orientation_degrees
+    anchor_delta_pos = (dst_anchor.position[0] - src_anchor.position[0],
+                        dst_anchor.position[1] - src_anchor.position[1])
+    delta_orientation = dst_anchor.orientation - src_anchor.orientation
+
+    module_pairs = []
+    for dst_mod in sheet_modules:
+        src_mod = find_src_module(dst_mod, src_modules)
+        module_pairs.append((dst_mod.index, src_mod.index if src_mod is not None else None))
+
+    try:
+        net_map = get_net_map(src_modules, sheet_modules)
+    except LookupError:
+        net_map = None
+    return SheetPlanData(sheet, dst_anchor.index, module_pairs, anchor_delta_angle,
+                         anchor_delta_pos, delta_orientation, net_map)
+
+
+def group_modules_by_sheet(modules, sheets):
+    """ get a list of modules for each of the sheets, walking through the modules only once per sheet depth """
+    depths = set(len(sheet) for sheet in sheets)
+    modules_by_prefix = defaultdict(list)
+    for mod in modules:
+        for depth in depths:
+            modules_by_prefix[(depth, tuple(mod.sheet_id[0:depth]))].append(mod)
+    return [modules_by_prefix.get((len(sheet), tuple(sheet)), []) for sheet in sheets]
+
+
+def plan_sheets(modules, src_modules, src_anchor, sheets, workers=1):
+    """
+    compute replication plans for all destination sheets
+    with workers > 1 the plans are computed in a pool of worker threads, which all share the snapshot
+    """
+    sheets_modules = group_modules_by_sheet(modules, sheets)
+    if workers > 1 and not HAS_FUTURES:
+        logger.info("concurrent.futures is not available, planning replication serially")
+        workers = 1
+
+    if workers <= 1:
+        return [plan_sheet(sheet, sheet_modules, src_modules, src_anchor)
+                for sheet, sheet_modules in zip(sheets, sheets_modules)]
+
+    logger.info("Planning replication of " + repr(len(sheets)) + " sheets with " + repr(workers) + " threads")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(plan_sheet, sheet, sheet_modules, src_modules, src_anchor)
+                   for sheet, sheet_modules in zip(sheets, sheets_modules)]
+        return [future.result() for future in futures]
+
+
+def make_test_snapshot(nr_sheets, nr_modules, nr_pads):
+    """ synthetic snapshot with source sheet and nr_sheets destination sheets """
+    modules = []
+    sheets = []
+    for sheet_index in range(nr_sheets + 1):
+        sheet = ['Channel_' + str(sheet_index)]
+        sheets.append(sheet)
+        for mod_index in range(nr_modules):
+            pads = tuple((str(pad_index), 'Net-(ch' + str(sheet_index) + '-' + str(mod_index + pad_index) + ')')
+                         for pad_index in range(nr_pads))
+            modules.append(ModuleData(len(modules), 'R' + str(sheet_index * 1000 + mod_index),
+                                      'MOD' + str(mod_index), sheet, (mod_index * 1000, sheet_index * 100000),
+                                      0.0, 0.0, pads))
+    src_modules = modules[0:nr_modules]
+    return modules, src_modules, src_modules[0], sheets[1:]
+
+
+def test_plans():
+    """ plans from worker threads are the same as serial ones, failures are left to the serial planning """
+    modules, src_modules, src_anchor, sheets = make_test_snapshot(8, 20, 4)
+    serial = plan_sheets(modules, src_modules, src_anchor, sheets)
+    assert plan_sheets(modules, src_modules, src_anchor, sheets, 4) == serial
+    plan = serial[2]
+    assert plan.anchor_index == 3 * 20
+    assert plan.net_map['Net-(ch0-1)'] == 'Net-(ch3-1)'
+    assert plan.module_pairs[5] == (3 * 20 + 5, 5)
+
+    # a footprint missing on the destination sheet
+    modules = [mod for mod in modules if mod.ref != 'R3005']
+    plan = plan_sheets(modules, src_modules, src_anchor, sheets, 4)[2]
+    assert plan.net_map is None and plan.anchor_index == 3 * 20
+    # or the anchor
+    modules = [mod for mod in modules if mod.ref != 'R3000']
+    assert plan_sheets(modules, src_modules, src_anchor, sheets, 4)[2].anchor_index is None
+
+
+def main():
+    test_plans()
+
+    nr_modules = 200
+    nr_pads = 4
+    logger.info("Benchmark: " + repr(nr_modules) + " footprints with " + repr(nr_pads) + " pads per sheet")
+    for nr_sheets in (8, 16, 32, 64, 128):
+        modules, src_modules, src_anchor, sheets = make_test_snapshot(nr_sheets, nr_modules, nr_pads)
+        results = []
+        for workers in (1, 2, 4):
+            start_time = time.time()
+            plans = plan_sheets(modules, src_modules, src_anchor, sheets, workers)
+            results.append("workers=%d: %.3f s" % (workers, time.time() - start_time))
+            assert len(plans) == nr_sheets
+        logger.info("sheets=%d, " % nr_sheets + ", ".join(results))
+
+
+# for testing purposes only
+if __name__ == "__main__":
+    # if debugging outside of this folder change the folder
+    os.chdir(os.path.dirname(os.path.realpath(__file__)))
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(name)s %(lineno)d:%(message)s',
+                        datefmt='%m-%d %H:%M:%S',
+                        handlers=[logging.StreamHandler(sys.stdout)]
+                        )
+    logger = logging.getLogger(__name__)
+    main()
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#  spatial_index.py
+#
+# Copyright (C) 2019 Mitja Nemec
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+from __future__ import absolute_import, division, print_function
+import pcbnew
+import math
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# items spanning more cells than this (in each direction) are not binned
+# but kept in a separate list which is checked on every query
+MAX_CELL_SPAN = 16
+
+
+def get_rect_bounds(rect):
+    """ get (left, top, right, bottom) of an EDA_RECT """
+    left = rect.GetLeft()
+    right = rect.GetRight()
+    top = rect.GetTop()
+    bottom = rect.GetBottom()
+    return min(left, right), min(top, bottom), max(left, right), max(top, bottom)
+
+
+class SpatialIndex():
+    """
+    Uniform grid over bounding boxes of board items. Grid only preselects
+    the candidates, final decision is left to EDA_RECT.Contains/Intersects
+    so the results are the same as when checking every item on the board
+    """
+    def __init__(self, items, group_key=None):
+        self.items = list(items)
+        self.boxes = [get_rect_bounds(item.GetBoundingBox()) for item in self.items]
+        self.positions = {}
+        self.groups = defaultdict(list)
+        self.cells = defaultdict(list)
+        self.oversized = []
+
+        for index, item in enumerate(self.items):
+            self.positions[id(item)] = index
+            if group_key is not None:
+                self.groups[group_key(item)].append(index)
+
+        # size the grid so that there is roughly one item per cell
+        if self.boxes:
+            self.origin_x = min(box[0] for box in self.boxes)
+            self.origin_y = min(box[1] for box in self.boxes)
+            width = max(box[2] for box in self.boxes) - self.origin_x
+            height = max(box[3] for box in self.boxes) - self.origin_y
+            area = max(width, 1) * max(height, 1)
+            self.cell_size = max(int(math.sqrt(area / len(self.boxes))), 1)
+        else:
+            self.origin_x = 0
+            self.origin_y = 0
+            self.cell_size = 1
+
+        for index, box in enumerate(self.boxes):
+            x_start, x_end, y_start, y_end = self.get_cell_span(box)
+            if x_end - x_start > MAX_CELL_SPAN or y_end - y_start > MAX_CELL_SPAN:
+                self.oversized.append(index)
+                continue
+            for cell_x in range(x_start, x_end + 1):
+                for cell_y in range(y_start, y_end + 1):
+                    self.cells[(cell_x, cell_y)].append(index)
+
+        logger.debug("Spatial index built with %d items in %d cells, %d oversized"
+                     % (len(self.items), len(self.cells), len(self.oversized)))
+
+    def get_cell_span(self, box):
+        """ get first and last cell (inclusive) in both directions covered by the box """
+        left, top, right, bottom = box
+        x_start = int((left - self.origin_x) // self.cell_size)
+        x_end = int((right - self.origin_x) // self.cell_size)
+        y_start = int((top - self.origin_y) // self.cell_size)
+        y_end = int((bottom - self.origin_y) // self.cell_size)
+        return x_start, x_end, y_start, y_end
+
+    def get_candidates(self, box):
+        x_start, x_end, y_start, y_end = self.get_cell_span(box)
+        candidates = set(self.oversized)
+        # do not walk through empty cells if query box is much larger than the items
+        if (x_end - x_start + 1) * (y_end - y_start + 1) > len(self.cells):
+            for cell, indices in self.cells.items():
+                if x_start <= cell[0] <= x_end and y_start <= cell[1] <= y_end:
+                    candidates.update(indices)
+        else:
+            for cell_x in range(x_start, x_end + 1):
+                for cell_y in range(y_start, y_end + 1):
+                    candidates.update(self.cells.get((cell_x, cell_y), ()))
+        return candidates
+
+    def query_indices(self, bounding_box, containing):
+        """ get sorted indices of all items contained in/intersecting with the bounding box """
+        box = get_rect_bounds(bounding_box)
+        left, top, right, bottom = box
+        hits = []
+        for index in self.get_candidates(box):
+            item = self.items[index]
+            # item was removed from the board
+            if item is None:
+                continue
+            i_left, i_top, i_right, i_bottom = self.boxes[index]
+            if containing:
+                if i_left < left or i_right > right or i_top < top or i_bottom > bottom:
+                    continue
+                if bounding_box.Contains(item.GetBoundingBox()):
+                    hits.append(index)
+            else:
+                if i_right < left or i_left > right or i_bottom < top or i_top > bottom:
+                    continue
+                if bounding_box.Intersects(item.GetBoundingBox()):
+                    hits.append(index)
+        return sorted(hits)
+
+    def query(self, bounding_box, containing):
+        """ get all items contained in/intersecting with the bounding box, in board order """
+        return self.get_items(self.query_indices(bounding_box, containing))
+
+    def query_group_indices(self, key):
+        """ get indices of all items within the group """
+        return [index for index in self.groups.get(key, ()) if self.items[index] is not None]
+
+    def get_items(self, indices):
+        return [self.items[index] for index in indices if self.items[index] is not None]
+
+    def remove(self, item):
+        """ forget the item, called when item is removed from the board """
+        index = self.positions.pop(id(item), None)
+        if index is not None:
+            self.items[index] = None
+
+
+class BoardIndex():
+    """ spatial indices of all tracks, zones, text items and drawings on the board """
+    def __init__(self, board):
+        logger.info("Building spatial index of board items")
+        zones = [board.GetArea(zoneid) for zoneid in range(board.GetAreaCount())]
+        text_items = []
+        drawings = []
+        for drawing in board.GetDrawings():
+            if isinstance(drawing, pcbnew.TEXTE_PCB):
+                text_items.append(drawing)
+            if isinstance(drawing, pcbnew.DRAWSEGMENT):
+                drawings.append(drawing)
+
+        self.tracks = SpatialIndex(board.GetTracks(), group_key=lambda x: x.GetNetname())
+        self.zones = SpatialIndex(zones, group_key=lambda x: x.GetNetname())
+        self.text = SpatialIndex(text_items)
+        self.drawings = SpatialIndex(drawings)
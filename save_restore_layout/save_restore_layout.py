@@ -21,16 +21,21 @@
 #
 from __future__ import absolute_import, division, print_function
 import pcbnew
-from collections import namedtuple
+from collections import namedtuple, defaultdict
 import os
 import sys
 import logging
-import re
 import hashlib
 import pickle
 import math
 import tempfile
 
+parent_module = sys.modules['.'.join(__name__.split('.')[:-1]) or '__main__']
+if __name__ == '__main__' or parent_module.__name__ == '__main__':
+    import sch_hierarchy
+else:
+    from . import sch_hierarchy
+
 Module = namedtuple('Module', ['ref', 'mod', 'mod_id', 'sheet_id', 'filename'])
 
 LayoutData = namedtuple('LayoutData', ['layout', 'hash', 'dict_of_sheets', 'list_of_local_nets', 'level', 'level_filename'])
@@ -101,6 +106,8 @@ def get_module_text_items(module):
 
 
 class Footprint():
+    __slots__ = ('ref', 'mod', 'mod_id', 'sheet_id', 'sheetname', 'filename')
+
     def __init__(self, ref, mod, mod_id, sheet_id, sheetname=None, filename=None):
         self.ref = ref
         self.mod = mod
@@ -111,74 +118,12 @@ class Footprint():
 
 
 class SchData():
-    @staticmethod
-    def extract_subsheets(filename):
-        with open(filename, 'rb') as f:
-            file_folder = os.path.dirname(os.path.abspath(filename))
-            file_lines = f.read().decode('utf-8')
-        # alternative solution
-        # extract all sheet references
-        sheet_indices = [m.start() for m in re.finditer('\$Sheet', file_lines)]
-        endsheet_indices = [m.start() for m in re.finditer('\$EndSheet', file_lines)]
-
-        if len(sheet_indices) != len(endsheet_indices):
-            raise LookupError("Schematic page contains errors")
-
-        sheet_locations = zip(sheet_indices, endsheet_indices)
-        for sheet_location in sheet_locations:
-            sheet_reference = file_lines[sheet_location[0]:sheet_location[1]].split('\n')
-            # parse the sheed description
-            for line in sheet_reference:
-                # found sheet ID
-                if line.startswith('U '):
-                    subsheet_id = line.split()[1]
-                # found sheet name
-                if line.startswith('F0 '):
-                    partial_line = line.lstrip("F0 ")
-                    partial_line = " ".join(partial_line.split()[:-1])
-                    # remove the last field (text size)
-                    subsheet_name = partial_line.rstrip("\"").lstrip("\"")
-                # found sheet filename
-                if line.startswith('F1 '):
-                    subsheet_path = re.findall("\s\"(.*.sch)\"\s", line)[0]
-                    if not os.path.isabs(subsheet_path):
-                        # check if path is encoded with variables
-                        if "${" in subsheet_path:
-                            start_index = subsheet_path.find("${") + 2
-                            end_index = subsheet_path.find("}")
-                            env_var = subsheet_path[start_index:end_index]
-                            path = os.getenv(env_var)
-                            # if variable is not defined rasie an exception
-                            if path is None:
-                                raise LookupError("Can not find subsheet: " + subsheet_path)
-                            # replace variable with full path
-                            subsheet_path = subsheet_path.replace("${", "") \
-                                .replace("}", "") \
-                                .replace("env_var", path)
-
-                    # if path is still not absolute, then it is relative to project
-                    if not os.path.isabs(subsheet_path):
-                        subsheet_path = os.path.join(file_folder, subsheet_path)
-
-                    subsheet_path = os.path.normpath(subsheet_path)
-                    # found subsheet reference go for the next one, no need to parse further
-                    break
-
-            file_path = os.path.abspath(subsheet_path)
-            yield file_path, subsheet_id, subsheet_name
-
-    def find_all_sch_files(self, filename, dict_of_sheets):
-        for file_path, subsheet_id, subsheet_name in self.extract_subsheets(filename):
-            dict_of_sheets[subsheet_id] = [subsheet_name, file_path]
-            dict_of_sheets = self.find_all_sch_files(file_path, dict_of_sheets)
-        return dict_of_sheets
-
     def __init__(self, board):
         main_sch_file = os.path.abspath(board.GetFileName()).replace(".kicad_pcb", ".sch")
         self.project_folder = os.path.dirname(main_sch_file)
         # get relation between sheetname and it's id
         logger.info('getting project hierarchy from schematics')
-        self.dict_of_sheets = self.find_all_sch_files(main_sch_file, {})
+        self.dict_of_sheets = sch_hierarchy.get_dict_of_sheets(main_sch_file)
         logger.info("Project hierarchy looks like:\n%s" % repr(self.dict_of_sheets))
 
         # make all paths relative
@@ -225,52 +170,63 @@ class PcbData():
         sheet_id = sheet_path[1:-1]
         return sheet_id
 
+    def index_modules(self):
+        """ build lookup tables by reference, by module id and by every sheet path prefix """
+        self.modules_by_ref = {}
+        self.modules_by_id = defaultdict(list)
+        self.modules_by_sheet = defaultdict(list)
+        for mod in self.modules:
+            # get_mod_by_ref returns the first footprint with this reference
+            self.modules_by_ref.setdefault(mod.ref, mod)
+            self.modules_by_id[mod.mod_id].append(mod)
+            # sheet names are known only after set_modules_hierarchy_names
+            if mod.sheetname is not None:
+                for depth in range(len(mod.sheetname) + 1):
+                    self.modules_by_sheet[tuple(mod.sheetname[0:depth])].append(mod)
+
     def get_mod_by_ref(self, ref):
-        for m in self.modules:
-            if m.ref == ref:
-                return m
-        return None
+        return self.modules_by_ref.get(ref)
 
     def get_board_modules(self, board):
-        bmod = board.GetModules()
+        """ construct a list of modules, parsing each footprint path only once """
         modules = []
-        mod_dict = {}
-        for module in bmod:
-            mod_named_tuple = Footprint(mod=module,
-                                        mod_id=self.get_module_id(module),
-                                        sheet_id=self.get_sheet_id(module),
-                                        ref=module.GetReference())
-            mod_dict[module.GetReference()] = mod_named_tuple
-            modules.append(mod_named_tuple)
-
+        # footprints on the same sheet share the same sheet id list
+        sheet_ids = {}
+        for module in board.GetModules():
+            module_path = get_path(module).split('/')
+            sheet_path = tuple(module_path[1:-1])
+            if sheet_path not in sheet_ids:
+                sheet_ids[sheet_path] = list(sheet_path)
+            modules.append(Footprint(mod=module,
+                                     mod_id=module_path[-1],
+                                     sheet_id=sheet_ids[sheet_path],
+                                     ref=module.GetReference()))
         return modules
 
     def set_modules_hierarchy_names(self, dict_of_sheets):
+        # footprints on the same sheet share the same lists of sheet names and files
+        sheet_names = {}
         for mod in self.modules:
-            mod.sheetname = [dict_of_sheets[x][0] for x in mod.sheet_id]
-            mod.filename = [dict_of_sheets[x][1] for x in mod.sheet_id]
+            sheet_path = tuple(mod.sheet_id)
+            if sheet_path not in sheet_names:
+                sheet_names[sheet_path] = ([dict_of_sheets[x][0] for x in mod.sheet_id],
+                                           [dict_of_sheets[x][1] for x in mod.sheet_id])
+            mod.sheetname, mod.filename = sheet_names[sheet_path]
+        self.index_modules()
 
     def __init__(self, board):
         self.board = board
         # construct a list of modules with all pertinent data 
         logger.info('getting a list of all footprints on board') 
         self.modules = self.get_board_modules(board)
+        self.index_modules()
 
     def get_modules_on_sheet(self, level):
-        modules_on_sheet = []
-        level_depth = len(level)
-        for mod in self.modules:
-            if level == mod.sheetname[0:level_depth]:
-                modules_on_sheet.append(mod)
-        return modules_on_sheet
+        return list(self.modules_by_sheet.get(tuple(level), []))
 
     def get_modules_not_on_sheet(self, level):
-        modules_not_on_sheet = []
-        level_depth = len(level)
-        for mod in self.modules:
-            if level != mod.sheetname[0:level_depth]:
-                modules_not_on_sheet.append(mod)
-        return modules_not_on_sheet
+        modules_on_sheet = set(id(mod) for mod in self.modules_by_sheet.get(tuple(level), []))
+        return [mod for mod in self.modules if id(mod) not in modules_on_sheet]
 
     @staticmethod
     def get_nets_from_modules(modules):
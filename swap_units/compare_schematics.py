@@ -20,81 +20,25 @@
 #
 #
 import os
-import re
+import sys
 import logging
 
+parent_module = sys.modules['.'.join(__name__.split('.')[:-1]) or '__main__']
+if __name__ == '__main__' or parent_module.__name__ == '__main__':
+    import sch_hierarchy
+else:
+    from . import sch_hierarchy
+
 logger = logging.getLogger(__name__)
 
 
 class SchData():
-    @staticmethod
-    def extract_subsheets(filename):
-        with open(filename) as f:
-            file_folder = os.path.dirname(os.path.abspath(filename))
-            file_lines = f.read()
-        # alternative solution
-        # extract all sheet references
-        sheet_indices = [m.start() for m in re.finditer('\$Sheet', file_lines)]
-        endsheet_indices = [m.start() for m in re.finditer('\$EndSheet', file_lines)]
-
-        if len(sheet_indices) != len(endsheet_indices):
-            raise LookupError("Schematic page contains errors")
-
-        sheet_locations = zip(sheet_indices, endsheet_indices)
-        for sheet_location in sheet_locations:
-            sheet_reference = file_lines[sheet_location[0]:sheet_location[1]].split('\n')
-            # parse the sheed description
-            for line in sheet_reference:
-                # found sheet ID
-                if line.startswith('U '):
-                    subsheet_id = line.split()[1]
-                # found sheet name
-                if line.startswith('F0 '):
-                    partial_line = line.lstrip("F0 ")
-                    partial_line = " ".join(partial_line.split()[:-1])
-                    # remove the last field (text size)
-                    subsheet_name = partial_line.rstrip("\"").lstrip("\"")
-                # found sheet filename
-                if line.startswith('F1 '):
-                    subsheet_path = re.findall("\s\"(.*.sch)\"\s", line)[0]
-                    if not os.path.isabs(subsheet_path):
-                        # check if path is encoded with variables
-                        if "${" in subsheet_path:
-                            start_index = subsheet_path.find("${") + 2
-                            end_index = subsheet_path.find("}")
-                            env_var = subsheet_path[start_index:end_index]
-                            path = os.getenv(env_var)
-                            # if variable is not defined rasie an exception
-                            if path is None:
-                                raise LookupError("Can not find subsheet: " + subsheet_path)
-                            # replace variable with full path
-                            subsheet_path = subsheet_path.replace("${", "") \
-                                .replace("}", "") \
-                                .replace("env_var", path)
-
-                    # if path is still not absolute, then it is relative to project
-                    if not os.path.isabs(subsheet_path):
-                        subsheet_path = os.path.join(file_folder, subsheet_path)
-
-                    subsheet_path = os.path.normpath(subsheet_path)
-                    # found subsheet reference go for the next one, no need to parse further
-                    break
-
-            file_path = os.path.abspath(subsheet_path)
-            yield file_path, subsheet_id, subsheet_name
-
-    def find_all_sch_files(self, filename, dict_of_sheets):
-        for file_path, subsheet_id, subsheet_name in self.extract_subsheets(filename):
-            dict_of_sheets[subsheet_id] = [subsheet_name, file_path]
-            dict_of_sheets = self.find_all_sch_files(file_path, dict_of_sheets)
-        return dict_of_sheets
-
     def __init__(self, filename):
         main_sch_file = filename
         self.project_folder = os.path.dirname(main_sch_file)
         # get relation between sheetname and it's id
         logger.info('getting project hierarchy from schematics')
-        self.dict_of_sheets = self.find_all_sch_files(main_sch_file, {})
+        self.dict_of_sheets = sch_hierarchy.get_dict_of_sheets(main_sch_file)
         logger.info("Project hierarchy looks like:\n%s" % repr(self.dict_of_sheets))
 
 
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+#  sch_hierarchy.py
+#
+# Copyright (C) 2019 Mitja Nemec
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""
+Schematics hierarchy parser shared by all the plugins. The same file is in every plugin
+folder which needs it, so keep the copies identical.
+Subsheets found in each .sch file are cached on disk together with file modification
+time and size, so unchanged files are not read again.
+"""
+from __future__ import absolute_import, division, print_function
+import os
+import io
+import sys
+import time
+import json
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# bump when the format of cached entries changes
+CACHE_VERSION = 2
+CACHE_FILENAME = os.path.join(tempfile.gettempdir(), "kicad_action_plugins_sch_hierarchy.json")
+
+# file path -> {"mtime": , "size": , "sheets": [[path, sheet id, sheet name, line number], ...]}
+cache = {}
+cache_loaded = False
+cache_changed = False
+
+
+def load_cache():
+    global cache_loaded
+    if cache_loaded:
+        return
+    cache_loaded = True
+    try:
+        with open(CACHE_FILENAME, 'rb') as f:
+            contents = json.loads(f.read().decode('utf-8'))
+        if contents.get("version") == CACHE_VERSION:
+            cache.update(contents["files"])
+    except (IOError, OSError, ValueError, KeyError, AttributeError):
+        # missing or corrupted cache is simply rebuilt
+        logger.info("Schematics hierarchy cache not available, parsing all files")
+
+
+def save_cache():
+    global cache_changed
+    if not cache_changed:
+        return
+    # forget about the files which do not exist anymore
+    for filename in [x for x in cache if not os.path.isfile(x)]:
+        del cache[filename]
+    contents = json.dumps({"version": CACHE_VERSION, "files": cache})
+    temp_filename = CACHE_FILENAME + "." + str(os.getpid())
+    try:
+        with open(temp_filename, 'wb') as f:
+            f.write(contents.encode('utf-8'))
+        if os.path.exists(CACHE_FILENAME):
+            os.remove(CACHE_FILENAME)
+        os.rename(temp_filename, CACHE_FILENAME)
+        cache_changed = False
+    except (IOError, OSError):
+        logger.info("Could not write schematics hierarchy cache")
+
+
+def iter_subsheets(lines):
+    """
+    single pass through the lines of a schematics file, yields
+    (path as written in file, sheet id, sheet name, line number) for each $Sheet ... $EndSheet block
+    """
+    in_sheet = False
+    subsheet_path = None
+    for line_nr, line in enumerate(lines):
+        if line.startswith('$Sheet'):
+            if in_sheet:
+                raise LookupError("Schematic page contains errors")
+            in_sheet = True
+            subsheet_id = None
+            subsheet_name = None
+            subsheet_path = None
+            subsheet_line = None
+        elif line.startswith('$EndSheet'):
+            if not in_sheet:
+                raise LookupError("Schematic page contains errors")
+            in_sheet = False
+            if subsheet_path is not None:
+                yield subsheet_path, subsheet_id, subsheet_name, subsheet_line
+        # only the first F1 field describes the sheet
+        elif in_sheet and subsheet_path is None:
+            # found sheet ID
+            if line.startswith('U '):
+                subsheet_id = line.split()[1]
+            # found sheet name
+            elif line.startswith('F0 '):
+                # remove the first field ("F0 ")
+                partial_line = line.lstrip("F0 ")
+                partial_line = " ".join(partial_line.split()[:-1])
+                # remove the last field (text size)
+                subsheet_name = partial_line.rstrip("\"").lstrip("\"")
+            # found sheet filename
+            elif line.startswith('F1 '):
+                subsheet_path = line.split("\"")[1]
+                subsheet_line = line_nr
+
+    if in_sheet:
+        raise LookupError("Schematic page contains errors")
+
+
+def parse_subsheets(file_lines):
+    """ parse all sheet references, return a list of [path as written in file, sheet id, sheet name, line number] """
+    return [list(subsheet) for subsheet in iter_subsheets(file_lines.split('\n'))]
+
+
+def resolve_subsheet_path(subsheet_path, file_folder):
+    """ get absolute path of the subsheet """
+    if not os.path.isabs(subsheet_path):
+        # check if path is encoded with variables
+        if "${" in subsheet_path:
+            start_index = subsheet_path.find("${") + 2
+            end_index = subsheet_path.find("}")
+            env_var = subsheet_path[start_index:end_index]
+            path = os.getenv(env_var)
+            # if variable is not defined rasie an exception
+            if path is None:
+                raise LookupError("Can not find subsheet: " + subsheet_path)
+            # replace variable with full path
+            subsheet_path = subsheet_path.replace("${" + env_var + "}", path)
+
+    # if path is still not absolute, then it is relative to project
+    if not os.path.isabs(subsheet_path):
+        subsheet_path = os.path.join(file_folder, subsheet_path)
+
+    return os.path.abspath(os.path.normpath(subsheet_path))
+
+
+def get_subsheets(filename):
+    """ get a list of (subsheet path, sheet id, sheet name, line number) for all subsheets in a file """
+    global cache_changed
+    load_cache()
+    filename = os.path.abspath(filename)
+    file_stat = os.stat(filename)
+
+    entry = cache.get(filename)
+    if entry is None or entry["mtime"] != file_stat.st_mtime or entry["size"] != file_stat.st_size:
+        with io.open(filename, 'r', encoding='utf-8') as f:
+            sheets = [list(subsheet) for subsheet in iter_subsheets(f)]
+        entry = {"mtime": file_stat.st_mtime,
+                 "size": file_stat.st_size,
+                 "sheets": sheets}
+        cache[filename] = entry
+        cache_changed = True
+
+    file_folder = os.path.dirname(filename)
+    return [(resolve_subsheet_path(path, file_folder), sheet_id, sheet_name, line_nr)
+            for path, sheet_id, sheet_name, line_nr in entry["sheets"]]
+
+
+def get_dict_of_sheets(filename):
+    """ get relation between sheet id and [sheet name, sheet file] for the whole hierarchy """
+    def walk(sch_filename, dict_of_sheets):
+        for file_path, subsheet_id, subsheet_name, _ in get_subsheets(sch_filename):
+            dict_of_sheets[subsheet_id] = [subsheet_name, file_path]
+            walk(file_path, dict_of_sheets)
+        return dict_of_sheets
+
+    dict_of_sheets = walk(filename, {})
+    save_cache()
+    return dict_of_sheets
+
+
+def find_all_sch_files(filename):
+    """ get a list of all .sch files in the hierarchy, files used for multiple sheets are listed multiple times """
+    def walk(sch_filename, list_of_files):
+        list_of_files.append(sch_filename)
+        for file_path, _, _, line_nr in get_subsheets(sch_filename):
+            logger.info("found subsheet:\n\t" + file_path +
+                        "\n\t in:\n\t" + sch_filename + ", line: " + str(line_nr))
+            walk(file_path, list_of_files)
+        return list_of_files
+
+    list_of_files = walk(filename, [])
+    save_cache()
+    return list_of_files
+
+
+def make_test_sheet(nr_subsheets):
+    """ synthetic top level sheet with nr_subsheets subsheet references """
+    lines = ["EESchema Schematic File Version 4", "$Descr A4 11693 8268", "$EndDescr"]
+    for index in range(nr_subsheets):
+        lines.extend(["$Sheet",
+                      "S 1000 %d 1000 500" % (index * 1000),
+                      "U %08X" % (0x5C000000 + index),
+                      "F0 \"Channel_%d\" 50" % index,
+                      "F1 \"channel.sch\" 50",
+                      "F2 \"IN\" I L 1000 %d 50" % (index * 1000 + 100),
+                      "$EndSheet"])
+    lines.append("$EndSCHEMATC")
+    return "\n".join(lines)
+
+
+def main():
+    for nr_subsheets in (500, 5000):
+        file_lines = make_test_sheet(nr_subsheets)
+        start_time = time.time()
+        subsheets = parse_subsheets(file_lines)
+        assert len(subsheets) == nr_subsheets
+        assert subsheets[-1][1:] == ["%08X" % (0x5C000000 + nr_subsheets - 1), "Channel_%d" % (nr_subsheets - 1),
+                                     3 + 7 * (nr_subsheets - 1) + 4]
+        print("%d subsheets parsed in %.4f s" % (nr_subsheets, time.time() - start_time))
+
+    # subsheet path with an environment variable
+    os.environ["SCH_HIERARCHY_TEST_DIR"] = os.path.join(os.sep, "library", "sheets")
+    assert resolve_subsheet_path("${SCH_HIERARCHY_TEST_DIR}/channel.sch", os.path.join(os.sep, "project")) == \
+        os.path.abspath(os.path.join(os.sep, "library", "sheets", "channel.sch"))
+
+
+# for testing purposes only
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler(sys.stdout)])
+    main()
@@ -26,6 +26,12 @@ import logging
 import sys
 from distutils.dir_util import copy_tree
 
+parent_module = sys.modules['.'.join(__name__.split('.')[:-1]) or '__main__']
+if __name__ == '__main__' or parent_module.__name__ == '__main__':
+    import sch_hierarchy
+else:
+    from . import sch_hierarchy
+
 if __name__ != "__main__":
     logger = logging.getLogger(__name__)
 
@@ -68,8 +74,7 @@ def swap(board, pad_1, pad_2):
     logger.info("Swaping units on: " + footprint_reference)
 
     # get all schematic pages
-    all_sch_files = []
-    all_sch_files = find_all_sch_files(sch_file, all_sch_files)
+    all_sch_files = sch_hierarchy.find_all_sch_files(sch_file)
     all_sch_files = list(set(all_sch_files))
 
     # find all schematic pages containing reference
@@ -417,59 +422,6 @@ def swap(board, pad_1, pad_2):
     logger.info("Saved the schematics.")
 
 
-def extract_subsheets(filename):
-    with open(filename, 'rb') as f:
-        file_folder = os.path.dirname(os.path.abspath(filename))
-        file_lines = f.read().decode('utf-8')
-    # alternative solution
-    # extract all sheet references
-    sheet_indices = [m.start() for m in re.finditer('\$Sheet', file_lines)]
-    endsheet_indices = [m.start() for m in re.finditer('\$EndSheet', file_lines)]
-
-    if len(sheet_indices) != len(endsheet_indices):
-        raise LookupError("Schematic page contains errors")
-
-    sheet_locations = zip(sheet_indices, endsheet_indices)
-    for sheet_location in sheet_locations:
-        sheet_reference = file_lines[sheet_location[0]:sheet_location[1]].split('\n')
-        for line in sheet_reference:
-            if line.startswith('F1 '):
-                subsheet_path = line.split()[1].rstrip("\"").lstrip("\"")
-                subsheet_line = file_lines.split("\n").index(line)
-                if not os.path.isabs(subsheet_path):
-                    # check if path is encoded with variables
-                    if "${" in subsheet_path:
-                        start_index = subsheet_path.find("${") + 2
-                        end_index = subsheet_path.find("}")
-                        env_var = subsheet_path[start_index:end_index]
-                        path = os.getenv(env_var)
-                        # if variable is not defined rasie an exception
-                        if path is None:
-                            raise LookupError("Can not find subsheet: " + subsheet_path)
-                        # replace variable with full path
-                        subsheet_path = subsheet_path.replace("${", "") \
-                            .replace("}", "") \
-                            .replace("env_var", path)
-
-                # if path is still not absolute, then it is relative to project
-                if not os.path.isabs(subsheet_path):
-                    subsheet_path = os.path.join(file_folder, subsheet_path)
-
-                subsheet_path = os.path.normpath(subsheet_path)
-                # found subsheet reference go for the next one, no need to parse further
-                break
-        yield subsheet_path, subsheet_line
-
-
-def find_all_sch_files(filename, list_of_files):
-    list_of_files.append(filename)
-    for sheet, line_nr in extract_subsheets(filename):
-        #logger.info("found subsheet:\n\t" + sheet +
-        #            "\n in:\n\t" + filename + ", line: " + str(line_nr))
-        seznam = find_all_sch_files(sheet, list_of_files)
-        list_of_files = seznam
-    return list_of_files
-
 
 def main():
     import compare_projects